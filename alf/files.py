@@ -19,6 +19,7 @@ Created on Tue Sep 11 18:06:21 2018
 """
 import re
 import os
+import time
 from fnmatch import fnmatch
 
 # to include underscores: r'(?P<namespace>(?:^_)\w+(?:_))?'
@@ -153,6 +154,41 @@ def to_alf(object, attribute, extension, namespace=None, timescale=None, extra=N
     return '.'.join(parts)
 
 
+_FOLDER_INDEX = {}  # folder: (mtime_ns, file names, ALF file names, ALF parts dictionaries)
+FOLDER_INDEX_SIZE = 2048  # maximum number of folders indexed
+FOLDER_INDEX_RACY_SECONDS = 2  # folders modified more recently than this are not indexed
+
+
+def folder_index(alf_path):
+    """
+    Lists a folder and parses its ALF file names. The result is cached and invalidated when the
+    folder modification time changes, so repeated queries on a folder do not list and parse
+    it again.
+
+    Args:
+        alf_path (str): A Path to a directory containing ALF files
+
+    Returns:
+        file_names (list): all the file names of the folder
+        alf_files (list): ALF file names
+        attributes (list of dicts): parsed parts of each ALF file
+    """
+    alf_path = os.path.abspath(alf_path)
+    mtime_ns = os.stat(alf_path).st_mtime_ns
+    cached = _FOLDER_INDEX.get(alf_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1:]
+    file_names = os.listdir(alf_path)
+    alf_files = [f for f in file_names if is_valid(f)]
+    attributes = [alf_parts(f, as_dict=True) for f in alf_files]
+    # within the mtime resolution, the folder could change again without changing its mtime
+    if time.time() - mtime_ns / 1e9 > FOLDER_INDEX_RACY_SECONDS:
+        if len(_FOLDER_INDEX) >= FOLDER_INDEX_SIZE:
+            _FOLDER_INDEX.pop(next(iter(_FOLDER_INDEX)))
+        _FOLDER_INDEX[alf_path] = (mtime_ns, file_names, alf_files, attributes)
+    return file_names, alf_files, attributes
+
+
 def filter_by(alf_path, **kwargs):
     """
     Given a path and optional filters, returns all ALF files and their associated parts. The
@@ -185,8 +221,8 @@ def filter_by(alf_path, **kwargs):
         # Filter all intervals that are in bpod time
         filter_by(alf_path, attribute='intervals', timescale='bpod')
     """
-    alf_files = [f for f in os.listdir(alf_path) if is_valid(f)]
-    attributes = [alf_parts(f, as_dict=True) for f in alf_files]
+    _, alf_files, attributes = folder_index(alf_path)
+    alf_files, attributes = (list(alf_files), list(attributes))
 
     if kwargs:
         # Validate keyword arguments against regex group names
@@ -5,10 +5,14 @@ For a full overview of the scope of the format, see:
 https://ibllib.readthedocs.io/en/develop/04_reference.html#alf
 """
 
+import io
 import json
 import copy
+import fnmatch
 import logging
+import os
 import re
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from typing import Union
@@ -23,6 +27,11 @@ from . import files
 
 _logger = logging.getLogger('ibllib')
 
+CONSOLIDATED_FILE = '.alf_consolidated'  # name of the single file holding a folder ALF files
+_CONSOLIDATED_EXTENSIONS = ('.npy', '.json', '.csv', '.tsv', '.ssv')
+_CONSOLIDATED_CACHE = OrderedDict()  # folder: (stat of the consolidated file, ConsolidatedFile)
+CONSOLIDATED_CACHE_SIZE = 64  # each cached reader keeps a file descriptor open for its memmap
+
 
 class AlfBunch(Bunch):
 
@@ -102,9 +111,10 @@ def _find_metadata(file_alf):
     :return: PurePath of meta-data if exists
     """
     ns, obj = file_alf.name.split('.')[:2]
-    meta_data_file = list(file_alf.parent.glob(f'{ns}.{obj}*.metadata*.json'))
+    file_names = files.folder_index(file_alf.parent)[0]
+    meta_data_file = fnmatch.filter(file_names, f'{ns}.{obj}*.metadata*.json')
     if meta_data_file:
-        return meta_data_file[0]
+        return file_alf.parent.joinpath(meta_data_file[0])
 
 
 def check_dimensions(dico):
@@ -151,15 +161,18 @@ def read_ts(filename):
         _logger.error(name + ' not found! no time-scale for' + str(filename))
         raise FileNotFoundError(name + ' not found! no time-scale for' + str(filename))
 
-    return np.load(filename.parent / time_file), np.load(filename)
+    cfile = _consolidated(filename.parent)
+    return (_load_alf_file(filename.parent / time_file, cfile),
+            _load_alf_file(filename, cfile))
 
 
-def load_file_content(fil):
+def load_file_content(fil, mmap_mode=None):
     """
     Returns content of files. Designed for very generic file formats:
     so far supported contents are `json`, `npy`, `csv`, `tsv`, `ssv`, `jsonable`
 
     :param fil: file to read
+    :param mmap_mode: memory-map mode for `npy` files, see `np.load`. Defaults to None
     :return:array/json/pandas dataframe depending on format
     """
     if not fil:
@@ -179,7 +192,7 @@ def load_file_content(fil):
     if fil.suffix == '.jsonable':
         return jsonable.read(fil)
     if fil.suffix == '.npy':
-        return np.load(file=fil)
+        return np.load(file=fil, mmap_mode=mmap_mode)
     if fil.suffix == '.pqt':
         return parquet.load(fil)
     if fil.suffix == '.ssv':
@@ -242,7 +255,7 @@ def exists(alfpath, object, attributes=None, **kwargs):
     return set(attributes).issubset(attributes_found)
 
 
-def load_object(alfpath, object=None, short_keys=False, **kwargs):
+def load_object(alfpath, object=None, short_keys=False, lazy=False, **kwargs):
     """
     Reads all files (ie. attributes) sharing the same object.
     For example, if the file provided to the function is `spikes.times`, the function will
@@ -256,6 +269,10 @@ def load_object(alfpath, object=None, short_keys=False, **kwargs):
     :param short_keys: by default, the output dictionary keys will be compounds of attributes,
      timescale and any eventual parts separated by a dot. Use True to shorten the keys to the
      attribute and timescale.
+    :param lazy: if True, `npy` attributes are read-only memory-mapped arrays: the data is only
+     read from disk when accessed. The files stay open as long as the arrays are referenced.
+    If the folder contains a consolidated file (see `save_consolidated`), the unchanged files
+    are read from it.
     :return: a dictionary of all attributes pertaining to the object
 
     Examples:
@@ -276,6 +293,7 @@ def load_object(alfpath, object=None, short_keys=False, **kwargs):
     assert len(set(attributes)) == len(attributes), (
         f'multiple object {object} with the same attribute in {alfpath}, restrict parts/namespace')
     out = AlfBunch({})
+    cfile = _consolidated(files_alf[0].parent)
     # load content for each file
     for fil, att in zip(files_alf, attributes):
         # if there is a corresponding metadata file, read it:
@@ -283,9 +301,9 @@ def load_object(alfpath, object=None, short_keys=False, **kwargs):
         # if this is the actual meta-data file, skip and it will be read later
         if meta_data_file == fil:
             continue
-        out[att] = load_file_content(fil)
+        out[att] = _load_alf_file(fil, cfile, lazy=lazy)
         if meta_data_file:
-            meta = load_file_content(meta_data_file)
+            meta = _load_alf_file(meta_data_file, cfile)
             # the columns keyword splits array along the last dimension
             if 'columns' in meta.keys():
                 out.update({v: out[att][::, k] for k, v in enumerate(meta['columns'])})
@@ -353,6 +371,170 @@ def save_metadata(file_alf, dico):
         fid.write(json.dumps(dico, indent=1))
 
 
+class ConsolidatedFile:
+    """
+    Reader of the single file holding the content of the ALF files of a folder, written by
+    `save_consolidated`. The file is opened once as a memory map and arrays are zero-copy views
+    into it.
+
+    Layout: 8 bytes magic, uint64 header length, json header, then the data blocks aligned on
+    64 bytes. The header maps each file name to its size and modification time at consolidation,
+    its offset and length in the data section and for `npy` files its dtype, shape and order.
+    """
+    MAGIC = b'ALFCONS1'
+    ALIGN = 64
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        with open(self.file_path, 'rb') as fid:
+            if fid.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"{self.file_path} is not a consolidated ALF file")
+            nheader = int.from_bytes(fid.read(8), 'little')
+            self.files = json.loads(fid.read(nheader).decode())
+        self._data_offset = self._align(len(self.MAGIC) + 8 + nheader)
+        self._mmap = np.memmap(self.file_path, dtype=np.uint8, mode='r')
+
+    @classmethod
+    def _align(cls, n):
+        return int(np.ceil(n / cls.ALIGN) * cls.ALIGN)
+
+    def __contains__(self, file_name):
+        return file_name in self.files
+
+    def is_fresh(self, file_path):
+        """
+        True if the file is in the consolidated file and hasn't changed since
+        """
+        file_path = Path(file_path)
+        rec = self.files.get(file_path.name)
+        if rec is None:
+            return False
+        try:
+            st = file_path.stat()
+        except FileNotFoundError:
+            return False
+        return rec['size'] == st.st_size and rec['mtime_ns'] == st.st_mtime_ns
+
+    def load(self, file_name, copy=True):
+        """
+        Returns the content of a file, same as `load_file_content`
+
+        :param file_name: name of the file within the folder
+        :param copy: (True) if False, arrays are read-only views of the memory map
+        """
+        rec = self.files[file_name]
+        first = self._data_offset + rec['offset']
+        buf = self._mmap[first:first + rec['nbytes']]
+        suffix = Path(file_name).suffix
+        if suffix == '.npy':
+            shape = tuple(rec['shape'])
+            arr = buf.view(np.dtype(rec['dtype']))
+            arr = arr.reshape(shape[::-1]).T if rec['fortran_order'] else arr.reshape(shape)
+            return np.array(arr) if copy else arr
+        if suffix == '.json':
+            try:
+                return json.loads(buf.tobytes().decode())
+            except Exception as e:
+                _logger.error(e)
+                return None
+        delimiter = {'.csv': ',', '.tsv': '\t', '.ssv': ' '}[suffix]
+        return pd.read_csv(io.BytesIO(buf.tobytes()), delimiter=delimiter)
+
+
+def _consolidated(alfpath):
+    """
+    Returns the ConsolidatedFile of a folder, None if there is none. Readers are cached and
+    re-opened if the consolidated file changes. The cache keeps the CONSOLIDATED_CACHE_SIZE
+    most recently used readers, the memory map of an evicted reader is closed once the arrays
+    viewing it are released.
+    """
+    file_path = Path(alfpath).joinpath(CONSOLIDATED_FILE)
+    try:
+        st = file_path.stat()
+    except FileNotFoundError:
+        _CONSOLIDATED_CACHE.pop(str(file_path), None)
+        return
+    cached = _CONSOLIDATED_CACHE.get(str(file_path))
+    if cached and cached[0] == (st.st_size, st.st_mtime_ns):
+        _CONSOLIDATED_CACHE.move_to_end(str(file_path))
+        return cached[1]
+    cfile = ConsolidatedFile(file_path)
+    _CONSOLIDATED_CACHE[str(file_path)] = ((st.st_size, st.st_mtime_ns), cfile)
+    _CONSOLIDATED_CACHE.move_to_end(str(file_path))
+    while len(_CONSOLIDATED_CACHE) > CONSOLIDATED_CACHE_SIZE:
+        _CONSOLIDATED_CACHE.popitem(last=False)
+    return cfile
+
+
+def _load_alf_file(fil, cfile=None, lazy=False):
+    """
+    Loads the content of an ALF file, from the consolidated file of the folder if up to date
+    """
+    if cfile is not None and cfile.is_fresh(fil):
+        return cfile.load(fil.name, copy=not lazy)
+    return load_file_content(fil, mmap_mode='r' if lazy else None)
+
+
+def save_consolidated(alfpath, chunk_bytes=2 ** 26):
+    """
+    Writes the content of all the ALF files of a folder in a single file, preferred by
+    `load_object` and `read_ts` over the individual files as long as those are unchanged.
+    Consolidates `npy` files with numerical dtypes and `json`, `csv`, `tsv`, `ssv` files.
+
+    :param alfpath: folder containing ALF files
+    :param chunk_bytes: size of the blocks copied at once
+    :return: pathlib.Path of the consolidated file
+
+    example: alf.io.save_consolidated('/path/to/my/session/alf')
+    """
+    alfpath = Path(alfpath)
+    entries, sources = ({}, {})
+    offset = 0
+    for name in sorted(files.folder_index(alfpath)[1]):
+        fil = alfpath.joinpath(name)
+        if fil.suffix not in _CONSOLIDATED_EXTENSIONS:
+            continue
+        st = fil.stat()
+        if st.st_size == 0:
+            continue
+        rec = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'offset': offset}
+        if fil.suffix == '.npy':
+            try:
+                arr = np.load(fil, mmap_mode='r')
+            except ValueError:  # object arrays can't be memory mapped
+                continue
+            if arr.dtype.hasobject or arr.dtype.fields is not None:
+                continue
+            fortran_order = arr.flags.f_contiguous and not arr.flags.c_contiguous
+            rec.update({'dtype': arr.dtype.str, 'shape': list(arr.shape),
+                        'fortran_order': bool(fortran_order), 'nbytes': int(arr.nbytes)})
+            # flat view in storage order
+            sources[name] = (arr.T if fortran_order else arr).reshape(-1).view(np.uint8)
+        else:
+            rec['nbytes'] = st.st_size
+            sources[name] = np.memmap(fil, dtype=np.uint8, mode='r')
+        entries[name] = rec
+        offset += ConsolidatedFile._align(rec['nbytes'])
+    header = json.dumps(entries).encode()
+    file_path = alfpath.joinpath(CONSOLIDATED_FILE)
+    tmp_file = file_path.with_suffix('.tmp')
+    with open(tmp_file, 'wb') as fid:
+        fid.write(ConsolidatedFile.MAGIC)
+        fid.write(len(header).to_bytes(8, 'little'))
+        fid.write(header)
+        for name, rec in entries.items():
+            fid.seek(ConsolidatedFile._align(len(ConsolidatedFile.MAGIC) + 8 + len(header)) +
+                     rec['offset'])
+            src = sources[name]
+            for first in range(0, src.size, chunk_bytes):
+                fid.write(src[first:first + chunk_bytes].tobytes())
+        fid.truncate(ConsolidatedFile._align(len(ConsolidatedFile.MAGIC) + 8 + len(header)) +
+                     offset)
+    del sources
+    os.replace(tmp_file, file_path)
+    return file_path
+
+
 def remove_uuid_file(file_path, dry=False):
     """
      Renames a file without the UUID and returns the new pathlib.Path object
@@ -5,7 +5,7 @@ import numpy as np
 from numpy import pi
 import scipy.interpolate as interpolate
 from scipy.signal import convolve, gaussian
-from scipy.linalg import hankel
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
 from typing import TypeVar, Type, Sequence, Optional, Union
@@ -202,24 +202,216 @@ def movements(t, pos, freq=1000, pos_thresh=8, t_thresh=.2, min_gap=.1, pos_thre
 
     # Convert the time threshold into number of samples given the sampling frequency
     t_thresh_samps = int(np.round(t_thresh * freq))
-    max_disp = np.empty(t.size, dtype=float)  # initialize array of total wheel displacement
-
-    # Calculate a Hankel matrix of size t_thresh_samps in batches.  This is effectively a
-    # sliding window within which we look for changes in position greater than pos_thresh
-    BATCH_SIZE = 10000  # do this in batches in order to keep memory usage reasonable
-    c = 0  # index of 'window' position
-    while True:
-        i2proc = np.arange(BATCH_SIZE) + c
-        i2proc = i2proc[i2proc < t.size]
-        w2e = hankel(pos[i2proc], np.full(t_thresh_samps, np.nan))
-        # Below is the total change in position for each window
-        max_disp[i2proc] = np.nanmax(w2e, axis=1) - np.nanmin(w2e, axis=1)
-        c += BATCH_SIZE - t_thresh_samps
-        if i2proc[-1] == t.size - 1:
-            break
+    # Total change in position within a sliding window of t_thresh_samps: for each window is the
+    # change in position greater than our threshold?
+    moving = _window_range(pos, t_thresh_samps) > pos_thresh
+    vel = _movement_velocity(pos)
+    onset_samps, offset_samps = _movements_from_mask(
+        t, pos, moving, freq, t_thresh_samps, min_gap, pos_thresh_onset, min_dur)
+    onsets, offsets = t[onset_samps], t[offset_samps]
+    peak_amps, peak_vel_times = _movements_peaks(t, pos, vel, onset_samps, offset_samps)
+
+    if make_plots:
+        fig, axes = plt.subplots(nrows=2, sharex='all')
+        indices = np.sort(np.hstack((onset_samps, offset_samps)))  # Points to split trace
+        vel, acc = velocity_smoothed(pos, freq, 0.015)
+
+        # Plot the wheel position and velocity
+        for ax, y in zip(axes, (pos, vel)):
+            ax.plot(onsets, y[onset_samps], 'go')
+            ax.plot(offsets, y[offset_samps], 'bo')
+
+            t_split = np.split(np.vstack((t, y)).T, indices, axis=0)
+            ax.add_collection(LineCollection(t_split[1::2], colors='r'))  # Moving
+            ax.add_collection(LineCollection(t_split[0::2], colors='k'))  # Not moving
+
+        axes[1].autoscale()  # rescale after adding line collections
+        axes[0].autoscale()
+        axes[0].set_ylabel('position')
+        axes[1].set_ylabel('velocity')
+        axes[1].set_xlabel('time')
+        axes[0].legend(['onsets', 'offsets', 'in movement'])
+        plt.show()
+
+    return onsets, offsets, peak_amps, peak_vel_times
+
+
+class MovementDetector:
+    """
+    Streaming version of `movements`: the wheel data is fed in consecutive chunks and the
+    movements are output as soon as they can't be affected by subsequent samples. The
+    concatenated outputs are identical to those of `movements` on the whole recording, while
+    only the samples of the current movement are kept in memory.
+
+    Examples
+    --------
+    Process a recording in chunks of 1 minute
+
+        md = MovementDetector(freq=1000, pos_thresh=8, pos_thresh_onset=1.5)
+        outs = [md.update(t[i:i + 60000], pos[i:i + 60000]) for i in range(0, t.size, 60000)]
+        outs.append(md.finish())
+        onsets, offsets, peak_amps, peak_vel_times = map(np.concatenate, zip(*outs))
+    """
+    _margin = 11  # samples of context needed for the velocity convolution
+
+    def __init__(self, freq=1000, pos_thresh=8, t_thresh=.2, min_gap=.1, pos_thresh_onset=1.5,
+                 min_dur=.05):
+        """
+        See `movements` for a description of the parameters
+        """
+        self.freq = freq
+        self.pos_thresh = pos_thresh
+        self.min_gap = min_gap
+        self.pos_thresh_onset = pos_thresh_onset
+        self.min_dur = min_dur
+        self.t_thresh_samps = int(np.round(t_thresh * freq))
+        # a quiet period this long can't be bridged by the gap criteria
+        self._quiet_samps = int(np.ceil(min_gap * freq)) + 2
+        self._t = np.array([], dtype=float)
+        self._pos = np.array([], dtype=float)
+        self._moving = np.array([], dtype=bool)
+        self._i0 = 0  # sample index of the first buffered sample
+        self._seg0 = 0  # sample index of the first sample not yet output
+        self._dt = None
+
+    @property
+    def _nsamples(self):
+        return self._i0 + self._t.size
+
+    def update(self, t, pos):
+        """
+        Adds a chunk of evenly sampled wheel data
+
+        Parameters
+        ----------
+        t : array_like
+            Chunk of timestamps, following the previous chunk at the same sampling rate
+        pos : array_like
+            Chunk of wheel positions
+
+        Returns
+        -------
+        onsets, offsets, peak_amps, peak_vel_times : np.ndarray
+            The movements completed so far, see `movements`
+        """
+        t, pos = np.asarray(t, dtype=float), np.asarray(pos, dtype=float)
+        if t.size == 0:
+            return self._output([], [])
+        dt = np.diff(np.r_[self._t[-1:], t])
+        if self._dt is None and dt.size:
+            self._dt = dt.mean()
+        if dt.size:
+            assert np.all(np.abs(dt - self._dt) < 1e-10), 'Values not evenly sampled'
+        self._t, self._pos = np.r_[self._t, t], np.r_[self._pos, pos]
+        # the windowed displacement is known for the samples whose window is complete
+        n_win = self.t_thresh_samps
+        first = self._i0 + self._moving.size
+        ncomplete = self._nsamples - max(n_win, 1) + 1 - first
+        if ncomplete > 0:
+            p = self._pos[first - self._i0:first - self._i0 + ncomplete + n_win - 1]
+            moving = _window_range(p, n_win)[:ncomplete] > self.pos_thresh
+            self._moving = np.r_[self._moving, moving]
+        return self._flush(self._find_cut())
+
+    def finish(self):
+        """
+        Outputs the remaining movements once the last chunk has been added
+
+        Returns
+        -------
+        onsets, offsets, peak_amps, peak_vel_times : np.ndarray
+            The remaining movements, see `movements`
+        """
+        first = self._i0 + self._moving.size
+        p = self._pos[first - self._i0:]
+        if p.size:
+            moving = _window_range(p, self.t_thresh_samps) > self.pos_thresh
+            self._moving = np.r_[self._moving, moving]
+        return self._flush(self._nsamples, last=True)
+
+    def _find_cut(self):
+        """
+        Returns the last sample index splitting the recording into independent parts: it is
+        preceded by a quiet period long enough not to be bridged, and far enough from the last
+        onset for the onset refinement window
+        """
+        moving = self._moving[self._seg0 - self._i0:]
+        n = min(moving.size, self._nsamples - self._margin - self._seg0)
+        if n <= self._quiet_samps:
+            return
+        nmoving = np.r_[0, np.cumsum(moving[:n])]
+        quiet = nmoving[self._quiet_samps:] == nmoving[:-self._quiet_samps]
+        cuts = np.arange(self._quiet_samps, n + 1)
+        # the last movement onset before each candidate cut
+        is_onset = np.r_[moving[:1], moving[1:n] & ~moving[:n - 1]]
+        last_onset = np.maximum.accumulate(np.where(is_onset, np.arange(n), -n))
+        ok = quiet & (cuts >= last_onset[cuts - 1] + self.t_thresh_samps)
+        if np.any(ok):
+            return self._seg0 + cuts[np.where(ok)[0][-1]]
+
+    def _flush(self, cut, last=False):
+        if cut is None or cut <= self._seg0:
+            return self._output([], [])
+        i0, i1 = self._seg0 - self._i0, cut - self._i0
+        t, pos = self._t[i0:i1], self._pos[i0:i1]
+        onset_samps, offset_samps = _movements_from_mask(
+            t, pos, self._moving[i0:i1], self.freq, self.t_thresh_samps, self.min_gap,
+            self.pos_thresh_onset, self.min_dur)
+        # the velocity needs a few samples of context on each side of the segment
+        c0 = max(i0 - self._margin, 0)
+        start = self._i0 + c0 == 0
+        vel = _movement_velocity(self._pos[c0:i1 + self._margin], start=start)
+        vel = vel[i0 - c0 - (not start):i1 - c0 - (not start)]
+        out = self._output(onset_samps, offset_samps, t, pos, vel)
+        # discard the samples that are no longer needed
+        self._seg0 = cut
+        keep = max(cut - self._margin, self._i0) - self._i0
+        self._t, self._pos, self._moving = self._t[keep:], self._pos[keep:], self._moving[keep:]
+        self._i0 += keep
+        return out
+
+    @staticmethod
+    def _output(onset_samps, offset_samps, t=None, pos=None, vel=None):
+        onset_samps = np.asarray(onset_samps, dtype=int)
+        offset_samps = np.asarray(offset_samps, dtype=int)
+        if onset_samps.size == 0:
+            return tuple(np.array([], dtype=float) for _ in range(4))
+        peak_amps, peak_vel_times = _movements_peaks(t, pos, vel, onset_samps, offset_samps)
+        return t[onset_samps], t[offset_samps], peak_amps, peak_vel_times
+
+
+def _window_range(pos, n_win):
+    """
+    Difference between the max and min position within a window of n_win samples starting at
+    each sample, the windows being truncated at the end of the array. Uses running max / min
+    filters in O(n) regardless of the window size
+    """
+    if pos.size == 0:
+        return np.array([], dtype=float)
+    n_win = max(n_win, 1)
+    # a negative origin makes the window start at the current sample, the edge mode repeats
+    # the last sample which is equivalent to truncating the windows
+    kwargs = dict(size=n_win, mode='nearest', origin=-(n_win // 2))
+    return maximum_filter1d(pos, **kwargs) - minimum_filter1d(pos, **kwargs)
+
+
+def _movement_velocity(pos, start=True):
+    """
+    Smoothed velocity used for the peak velocity times. If start is False, pos[0] is the sample
+    preceding the first output sample
+    """
+    N = 10  # Number of points in the Gaussian
+    STDEV = 1.8  # Equivalent to a width factor (alpha value) of 2.5
+    gauss = gaussian(N, STDEV)  # A 10-point Gaussian window of a given s.d.
+    return convolve(np.diff(np.insert(pos, 0, 0) if start else pos), gauss, mode='same')
+
 
-    moving = max_disp > pos_thresh  # for each window is the change in position greater than
-    # our threshold?
+def _movements_from_mask(t, pos, moving, freq, t_thresh_samps, min_gap, pos_thresh_onset,
+                         min_dur):
+    """
+    From a boolean array of samples above the windowed displacement threshold, returns the
+    onsets and offsets sample indices of the movements
+    """
     moving = np.insert(moving, 0, False)  # First sample should always be not moving to ensure
     # we have an onset
     moving[-1] = False  # Likewise, ensure we always end on an offset
@@ -230,31 +422,20 @@ def movements(t, pos, freq=1000, pos_thresh=8, t_thresh=.2, min_gap=.1, pos_thre
     for p in too_short:
         moving[offset_samps[p]:onset_samps[p + 1] + 1] = True
 
+    # Refine the onsets: the last sample of the window following the onset whose displacement
+    # relative to the onset position is below pos_thresh_onset
     onset_samps = np.where(~moving[:-1] & moving[1:])[0]
-    onsets_disp_arr = np.empty((onset_samps.size, t_thresh_samps))
-    c = 0
-    cwt = 0
-    while onset_samps.size != 0:
-        i2proc = np.arange(BATCH_SIZE) + c
-        icomm = np.intersect1d(i2proc[:-t_thresh_samps - 1], onset_samps, assume_unique=True)
-        itpltz = np.intersect1d(i2proc[:-t_thresh_samps - 1], onset_samps,
-                                return_indices=True, assume_unique=True)[1]
-        i2proc = i2proc[i2proc < t.size]
-        if icomm.size > 0:
-            w2e = hankel(pos[i2proc], np.full(t_thresh_samps, np.nan))
-            w2e = np.abs((w2e.T - w2e[:, 0]).T)
-            onsets_disp_arr[cwt + np.arange(icomm.size), :] = w2e[itpltz, :]
-            cwt += icomm.size
-        c += BATCH_SIZE - t_thresh_samps
-        if i2proc[-1] >= onset_samps[-1]:
-            break
-
-    has_onset = onsets_disp_arr > pos_thresh_onset
-    A = np.argmin(np.fliplr(has_onset).T, axis=0)
-    onset_lags = t_thresh_samps - A
-    onset_samps = onset_samps + onset_lags - 1
-    onsets = t[onset_samps]
+    onset_lags = np.zeros(onset_samps.shape, dtype=int)
+    BATCH_SIZE = 10000  # number of onsets processed at once to keep memory usage reasonable
+    for i in range(0, onset_samps.size, BATCH_SIZE):
+        isamps = onset_samps[i:i + BATCH_SIZE, np.newaxis] + np.arange(t_thresh_samps)
+        disp = np.abs(pos[np.minimum(isamps, pos.size - 1)] - pos[isamps[:, :1]])
+        has_onset = (disp > pos_thresh_onset) & (isamps < pos.size)
+        A = np.argmin(np.fliplr(has_onset), axis=1)
+        onset_lags[i:i + BATCH_SIZE] = t_thresh_samps - A
+    onset_samps = np.minimum(onset_samps + onset_lags - 1, t.size - 1)
     offset_samps = np.where(moving[:-1] & ~moving[1:])[0]
+    onsets = t[onset_samps]
     offsets = t[offset_samps]
 
     durations = offsets - onsets
@@ -267,47 +448,23 @@ def movements(t, pos, freq=1000, pos_thresh=8, t_thresh=.2, min_gap=.1, pos_thre
     moveGaps = onsets[1:] - offsets[:-1]
     gap_too_small = moveGaps < min_gap
     if onsets.size > 0:
-        onsets = onsets[np.insert(~gap_too_small, 0, True)]  # always keep first onset
-        onset_samps = onset_samps[np.insert(~gap_too_small, 0, True)]
-        offsets = offsets[np.append(~gap_too_small, True)]  # always keep last offset
-        offset_samps = offset_samps[np.append(~gap_too_small, True)]
+        onset_samps = onset_samps[np.insert(~gap_too_small, 0, True)]  # always keep first onset
+        offset_samps = offset_samps[np.append(~gap_too_small, True)]  # always keep last offset
+    return onset_samps, offset_samps
+
 
-    # Calculate the peak amplitudes -
-    # the maximum absolute value of the difference from the onset position
+def _movements_peaks(t, pos, vel, onset_samps, offset_samps):
+    """
+    Returns the peak amplitudes, i.e. the maximum absolute value of the difference from the
+    onset position, and the timestamps of peak velocity of the movements
+    """
     peaks = (pos[m + np.abs(pos[m:n] - pos[m]).argmax()] - pos[m]
              for m, n in zip(onset_samps, offset_samps))
-    peak_amps = np.fromiter(peaks, dtype=float, count=onsets.size)
-    N = 10  # Number of points in the Gaussian
-    STDEV = 1.8  # Equivalent to a width factor (alpha value) of 2.5
-    gauss = gaussian(N, STDEV)  # A 10-point Gaussian window of a given s.d.
-    vel = convolve(np.diff(np.insert(pos, 0, 0)), gauss, mode='same')
+    peak_amps = np.fromiter(peaks, dtype=float, count=onset_samps.size)
     # For each movement period, find the timestamp where the absolute velocity was greatest
     peaks = (t[m + np.abs(vel[m:n]).argmax()] for m, n in zip(onset_samps, offset_samps))
-    peak_vel_times = np.fromiter(peaks, dtype=float, count=onsets.size)
-
-    if make_plots:
-        fig, axes = plt.subplots(nrows=2, sharex='all')
-        indices = np.sort(np.hstack((onset_samps, offset_samps)))  # Points to split trace
-        vel, acc = velocity_smoothed(pos, freq, 0.015)
-
-        # Plot the wheel position and velocity
-        for ax, y in zip(axes, (pos, vel)):
-            ax.plot(onsets, y[onset_samps], 'go')
-            ax.plot(offsets, y[offset_samps], 'bo')
-
-            t_split = np.split(np.vstack((t, y)).T, indices, axis=0)
-            ax.add_collection(LineCollection(t_split[1::2], colors='r'))  # Moving
-            ax.add_collection(LineCollection(t_split[0::2], colors='k'))  # Not moving
-
-        axes[1].autoscale()  # rescale after adding line collections
-        axes[0].autoscale()
-        axes[0].set_ylabel('position')
-        axes[1].set_ylabel('velocity')
-        axes[1].set_xlabel('time')
-        axes[0].legend(['onsets', 'offsets', 'in movement'])
-        plt.show()
-
-    return onsets, offsets, peak_amps, peak_vel_times
+    peak_vel_times = np.fromiter(peaks, dtype=float, count=onset_samps.size)
+    return peak_amps, peak_vel_times
 
 
 def cm_to_deg(positions, wheel_diameter=WHEEL_DIAMETER):
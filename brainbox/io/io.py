@@ -1,15 +1,14 @@
-import time
 import numpy as np
-# (Previously required `os.path` to get file info before memmapping)
-# import os.path as op
 from ibllib.io import spikeglx
 
+WAVEFORMS_MAX_BLOCK_SAMPLES = 2 ** 15  # maximum number of samples read at once
+
 
 def extract_waveforms(ephys_file, ts, ch, t=2.0, sr=30000, n_ch_probe=385, dtype='int16',
                       offset=0, car=True):
     '''
     Extracts spike waveforms from binary ephys data file, after (optionally)
-    common-average-referencing (CAR) spatial noise.
+    common-average-referencing (CAR) spatial noise. See `extract_waveforms_batch`.
 
     Parameters
     ----------
@@ -22,20 +21,20 @@ def extract_waveforms(ephys_file, ts, ch, t=2.0, sr=30000, n_ch_probe=385, dtype
     t : numeric (optional)
         The time (in ms) of each returned waveform.
     sr : int (optional)
-        The sampling rate (in hz) that the ephys data was acquired at.
+        Unused: the sampling rate is read from the spikeglx metadata.
     n_ch_probe : int (optional)
-        The number of channels of the recording.
+        Unused: the number of channels is read from the spikeglx metadata.
     dtype: str (optional)
-        The datatype represented by the bytes in `ephys_file`.
+        Unused: spikeglx files are int16.
     offset: int (optional)
-        The offset (in bytes) from the start of `ephys_file`.
+        Unused: spikeglx files have no header.
     car: bool (optional)
         A flag to perform CAR before extracting waveforms.
 
     Returns
     -------
     waveforms : ndarray
-        An array of shape (#spikes, #samples, #channels) containing the waveforms.
+        An array of shape (#spikes, #samples, #channels) containing the waveforms in Volts.
 
     Examples
     --------
@@ -64,71 +63,93 @@ def extract_waveforms(ephys_file, ts, ch, t=2.0, sr=30000, n_ch_probe=385, dtype
         >>> wf_car = bb.io.extract_waveforms(path_to_ephys_file, ts, ch, car=True)
     '''
 
-    # (Previously memmaped the file manually, but now use `spikeglx.Reader`)
-    # item_bytes = np.dtype(dtype).itemsize
-    # n_samples = (op.getsize(ephys_file) - offset) // (item_bytes * n_ch_probe)
-    # file_m = np.memmap(ephys_file, shape=(n_samples, n_ch_probe), dtype=dtype, mode='r')
+    ch = np.asarray(ch).flatten()
+    return extract_waveforms_batch(ephys_file, ts, ch, t=t, car=car)
 
-    # Get memmapped array of `ephys_file`
-    s_reader = spikeglx.Reader(ephys_file)
-    file_m = s_reader.data  # the memmapped array
-    n_wf_samples = np.int(sr / 1000 * (t / 2))  # number of samples to return on each side of a ts
-    ts_samples = np.array(ts * sr).astype(int)  # the samples corresponding to `ts`
-    t_sample_first = ts_samples[0] - n_wf_samples
-    t_sample_last = ts_samples[-1] + n_wf_samples
 
-    # Exception handling for impossible channels
-    ch = np.asarray(ch)
-    ch = ch.reshape((ch.size, 1)) if ch.size == 1 else ch
-    if np.any(ch < 0) or np.any(ch > n_ch_probe):
-        raise Exception('At least one specified channel number is impossible. The minimum channel'
-                        ' number was {}, and the maximum channel number was {}. Check specified'
-                        ' channel numbers and try again.'.format(np.min(ch), np.max(ch)))
+def extract_waveforms_batch(ephys_file, ts, ch, t=2.0, car=True,
+                            max_block_samples=WAVEFORMS_MAX_BLOCK_SAMPLES):
+    '''
+    Extracts spike waveforms from a SpikeGLX binary file (.bin or mtscomp .cbin), using the
+    sampling rate, channel count and gains from the metadata.
+    The spikes are sorted and windows that overlap are coalesced into contiguous reads of at most
+    `max_block_samples` samples, so that many waveforms are extracted with few reads.
 
-    # TODO car should be a separate function
-    if car:  # compute spatial noise in chunks
-        # (previously computed temporal noise also, but was too costly)
-        # Get number of chunks.
-        n_chunk_samples = 5e6  # number of samples per chunk
-        n_chunks = np.ceil((t_sample_last - t_sample_first) / n_chunk_samples).astype('int')
-        # Get samples that make up each chunk. e.g. `chunk_sample[1] - chunk_sample[0]` are the
-        # samples that make up the first chunk.
-        chunk_sample = np.arange(t_sample_first, t_sample_last, n_chunk_samples, dtype=int)
-        chunk_sample = np.append(chunk_sample, t_sample_last)
-        noise_s_chunks = np.zeros((n_chunks, ch.size), dtype=np.int16)  # spatial noise array
-        # Give time estimate for computing `noise_s_chunks`.
-        t0 = time.perf_counter()
-        np.median(file_m[chunk_sample[0]:chunk_sample[1], ch], axis=0)
-        dt = time.perf_counter() - t0
-        print('Performing spatial CAR before waveform extraction. Estimated time is {:.2f} mins.'
-              ' ({})'.format(dt * n_chunks / 60, time.ctime()))
-        # Compute noise for each chunk, then take the median noise of all chunks.
-        for chunk in range(n_chunks):
-            noise_s_chunks[chunk, :] = np.median(
-                file_m[chunk_sample[chunk]:chunk_sample[chunk + 1], ch], axis=0)
-        noise_s = np.median(noise_s_chunks, axis=0)
-        print('Done. ({})'.format(time.ctime()))
+    Parameters
+    ----------
+    ephys_file : string, pathlib.Path or ibllib.io.spikeglx.Reader
+        The binary ephys data file (the .meta file has to be present).
+    ts : ndarray_like
+        The timestamps (in s) of the spikes.
+    ch : int or ndarray_like
+        The channels on which to extract the waveforms: a channel or a vector of channels common
+        to all spikes, or an array (#spikes, #channels) of channels for each spike.
+    t : numeric (optional)
+        The time (in ms) of each returned waveform.
+    car: bool (optional)
+        A flag to perform common average referencing (median across all the channels for each
+        sample, computed on each read block) before extracting waveforms.
+    max_block_samples : int (optional)
+        The maximum number of samples read at once, bounds the memory usage.
 
-    # Initialize `waveforms`, extract waveforms from `file_m`, and CAR.
-    waveforms = np.zeros((len(ts), 2 * n_wf_samples, ch.size))
-    # Give time estimate for extracting waveforms.
-    t0 = time.perf_counter()
-    for i in range(5):
-        waveforms[i, :, :] = \
-            file_m[i * n_wf_samples * 2 + t_sample_first:
-                   i * n_wf_samples * 2 + t_sample_first + n_wf_samples * 2, ch].reshape(
-                       (n_wf_samples * 2, ch.size))
-    dt = time.perf_counter() - t0
-    print('Performing waveform extraction. Estimated time is {:.2f} mins. ({})'
-          .format(dt * len(ts) / 60 / 5, time.ctime()))
-    for spk, _ in enumerate(ts):  # extract waveforms
-        spk_ts_sample = ts_samples[spk]
-        spk_samples = np.arange(spk_ts_sample - n_wf_samples, spk_ts_sample + n_wf_samples)
-        # have to reshape to add an axis to broadcast `file_m` into `waveforms`
-        waveforms[spk, :, :] = \
-            file_m[spk_samples[0]:spk_samples[-1] + 1, ch].reshape((spk_samples.size, ch.size))
-    print('Done. ({})'.format(time.ctime()))
-    if car:  # perform CAR (subtract spatial noise)
-        waveforms -= noise_s[None, None, :]
+    Returns
+    -------
+    waveforms : ndarray
+        A float32 array of shape (#spikes, #samples, #channels) containing the waveforms in
+        Volts, in the order of `ts`. Samples out of the recording are set to NaN.
 
+    Examples
+    --------
+    1) Extract 100 waveforms for each cluster on 20 channels around its max amplitude channel.
+        >>> spikes = aio.load_object(path_to_alf_out, 'spikes')
+        >>> clusters = aio.load_object(path_to_alf_out, 'clusters')
+        >>> isel = np.concatenate([np.where(spikes.clusters == c)[0][:100]
+        >>>                        for c in np.unique(spikes.clusters)])
+        >>> ch_max = np.minimum(np.maximum(clusters.channels[spikes.clusters[isel]], 10), 373)
+        >>> ch = ch_max[:, np.newaxis] + np.arange(-10, 10)
+        >>> wf = bb.io.extract_waveforms_batch(path_to_ephys_file, spikes.times[isel], ch)
+    '''
+    sr = ephys_file if isinstance(ephys_file, spikeglx.Reader) else spikeglx.Reader(ephys_file)
+    ts = np.asarray(ts).flatten()
+    ch = np.atleast_1d(ch)
+    per_spike_channels = ch.ndim == 2
+    if np.any(ch < 0) or np.any(ch >= sr.nc):
+        raise ValueError(f"At least one specified channel number is impossible. The minimum "
+                         f"channel number was {np.min(ch)}, and the maximum channel number was "
+                         f"{np.max(ch)}. Check specified channel numbers and try again.")
+    n_wf_samples = int(sr.fs / 1000 * (t / 2))  # number of samples on each side of a ts
+    ns_wf = 2 * n_wf_samples
+    waveforms = np.full((ts.size, ns_wf, ch.shape[-1]), np.nan, dtype=np.float32)
+    if ts.size == 0:
+        return waveforms
+    # sort the spikes and compute the first sample of each window
+    ordre = np.argsort(ts, kind='stable')
+    first = np.array(ts[ordre] * sr.fs).astype(int) - n_wf_samples
+    # overlapping windows are grouped, groups are then split in blocks of max_block_samples
+    igroup = np.cumsum(np.r_[True, np.diff(first) >= ns_wf]) - 1
+    group_first = first[np.r_[0, np.where(np.diff(igroup))[0] + 1]]
+    isub = (first - group_first[igroup]) // max_block_samples
+    iblock = np.where(np.r_[True, (np.diff(igroup) != 0) | (np.diff(isub) != 0)])[0]
+    # if all channels are not needed, read only the requested ones
+    csel = slice(None) if (car or per_spike_channels) else ch
+    car_channels = np.setdiff1d(np.arange(sr.nc),
+                                spikeglx._get_sync_trace_indices_from_meta(sr.meta))
+    for i0, i1 in zip(iblock, np.r_[iblock[1:], ts.size]):
+        b0, b1 = (first[i0], first[i1 - 1] + ns_wf)
+        data = sr.read(slice(max(b0, 0), min(b1, sr.ns)), csel, sync=False)
+        if car:
+            data -= np.median(data[:, car_channels], axis=1)[:, np.newaxis]
+        # pad with NaNs if the block spans over the start or end of the recording
+        if b0 < 0 or b1 > sr.ns:
+            data = np.r_[np.full((max(-b0, 0), data.shape[1]), np.nan, dtype=np.float32), data,
+                         np.full((max(b1 - sr.ns, 0), data.shape[1]), np.nan, dtype=np.float32)]
+        # (nspikes, nsamples) indices of each window within the block
+        iw = (first[i0:i1] - b0)[:, np.newaxis] + np.arange(ns_wf)
+        if per_spike_channels:
+            waveforms[ordre[i0:i1]] = data[iw[:, :, np.newaxis],
+                                           ch[ordre[i0:i1]][:, np.newaxis, :]]
+        elif car:
+            waveforms[ordre[i0:i1]] = data[iw][:, :, ch]
+        else:
+            waveforms[ordre[i0:i1]] = data[iw]
     return waveforms
@@ -18,7 +18,6 @@ TODO add spikemetrics as dependency?
 TODO metrics that could be added: iso_dist, l_ratio, d_prime, nn_hit, nn_miss, sil
 """
 
-import time
 
 import numpy as np
 import scipy.ndimage.filters as filters
@@ -26,7 +25,6 @@ import scipy.stats as stats
 
 import brainbox as bb
 from brainbox.core import Bunch
-from brainbox.processing import bincount2D
 from ibllib.io import spikeglx
 
 # Parameters to be used in `quick_unit_metrics`
@@ -552,13 +550,13 @@ def ptp_over_noise(ephys_file, ts, ch, t=2.0, sr=30000, n_ch_probe=385, dtype='i
     t : numeric (optional)
         The time (in ms) of the waveforms to extract to compute the ptp.
     sr : int (optional)
-        The sampling rate (in hz) that the ephys data was acquired at.
+        Unused: the sampling rate is read from the spikeglx metadata.
     n_ch_probe : int (optional)
-        The number of channels of the recording.
+        Unused: the number of channels is read from the spikeglx metadata.
     dtype: str (optional)
-        The datatype represented by the bytes in `ephys_file`.
+        Unused: spikeglx files are int16.
     offset: int (optional)
-        The offset (in bytes) from the start of `ephys_file`.
+        Unused: spikeglx files have no header.
     car: bool (optional)
         A flag to perform common-average-referencing before extracting waveforms.
 
@@ -586,37 +584,26 @@ def ptp_over_noise(ephys_file, ts, ch, t=2.0, sr=30000, n_ch_probe=385, dtype='i
     ch = np.asarray(ch)
     ch = ch.reshape((ch.size, 1)) if ch.size == 1 else ch
 
-    # Get waveforms.
-    wf = bb.io.extract_waveforms(ephys_file, ts, ch, t=t, sr=sr, n_ch_probe=n_ch_probe,
-                                 dtype=dtype, offset=offset, car=car)
+    # Get waveforms, the sampling rate and number of channels are read from the metadata.
+    s_reader = spikeglx.Reader(ephys_file)
+    wf = bb.io.extract_waveforms_batch(s_reader, ts, ch.flatten(), t=t, car=car)
 
-    # Initialize `mean_ptp` based on `ch`, and compute mean ptp of all spikes for each ch.
-    mean_ptp = np.zeros((ch.size,))
-    for cur_ch in range(ch.size, ):
-        mean_ptp[cur_ch] = np.mean(np.max(wf[:, :, cur_ch], axis=1) -
-                                   np.min(wf[:, :, cur_ch], axis=1))
+    # Compute mean ptp of all spikes for each ch.
+    mean_ptp = np.nanmean(np.nanmax(wf, axis=1) - np.nanmin(wf, axis=1), axis=0)
 
     # Compute MAD for `ch` in chunks.
-    s_reader = spikeglx.Reader(ephys_file)
-    file_m = s_reader.data  # the memmapped array
     n_chunk_samples = 5e6  # number of samples per chunk
-    n_chunks = np.ceil(file_m.shape[0] / n_chunk_samples).astype('int')
+    n_chunks = np.ceil(s_reader.ns / n_chunk_samples).astype('int')
     # Get samples that make up each chunk. e.g. `chunk_sample[1] - chunk_sample[0]` are the
     # samples that make up the first chunk.
-    chunk_sample = np.arange(0, file_m.shape[0], n_chunk_samples, dtype=int)
-    chunk_sample = np.append(chunk_sample, file_m.shape[0])
-    # Give time estimate for computing MAD.
-    t0 = time.perf_counter()
-    stats.median_absolute_deviation(file_m[chunk_sample[0]:chunk_sample[1], ch], axis=0)
-    dt = time.perf_counter() - t0
-    print('Performing MAD computation. Estimated time is {:.2f} mins.'
-          ' ({})'.format(dt * n_chunks / 60, time.ctime()))
+    chunk_sample = np.arange(0, s_reader.ns, n_chunk_samples, dtype=int)
+    chunk_sample = np.append(chunk_sample, s_reader.ns)
     # Compute MAD for each chunk, then take the median MAD of all chunks.
-    mad_chunks = np.zeros((n_chunks, ch.size), dtype=np.int16)
+    mad_chunks = np.zeros((n_chunks, ch.size), dtype=np.float32)
     for chunk in range(n_chunks):
-        mad_chunks[chunk, :] = stats.median_absolute_deviation(
-            file_m[chunk_sample[chunk]:chunk_sample[chunk + 1], ch], axis=0, scale=1)
-    print('Done. ({})'.format(time.ctime()))
+        mad_chunks[chunk, :] = stats.median_absolute_deviation(s_reader.read(
+            slice(chunk_sample[chunk], chunk_sample[chunk + 1]), ch.flatten(), sync=False),
+            axis=0, scale=1)
 
     # Return `mean_ptp` over `mad`
     mad = np.median(mad_chunks, axis=0)
@@ -781,6 +768,8 @@ def quick_unit_metrics(spike_clusters, spike_times, spike_amps, spike_depths,
     -----
     This function is called by `ephysqc.unit_metrics_ks2` which is called by `spikes.ks2_to_alf`
     during alf extraction of an ephys dataset in the ibl ephys extraction pipeline.
+    The spikes are sorted by cluster once and the metrics of all clusters are computed with
+    grouped numpy reductions; only `missed_spikes_est` is computed per cluster.
 
     Examples
     --------
@@ -817,39 +806,76 @@ def quick_unit_metrics(spike_clusters, spike_times, spike_amps, spike_depths,
     # vectorized computation of basic metrics such as presence ratio and firing rate
     tmin = spike_times[0]
     tmax = spike_times[-1]
-    presence_ratio = bincount2D(spike_times, spike_clusters,
-                                xbin=params['presence_window'],
-                                ybin=cluster_ids, xlim=[tmin, tmax])[0]
+    # same as `bincount2D` with `ybin=cluster_ids`, without sorting the clusters
+    win = params['presence_window']
+    nbins = np.arange(tmin, tmax + win / 2, win).size
+    ibins = np.floor((spike_times - tmin) / win).astype(np.int64)
+    presence_ratio = np.bincount(spike_clusters.astype(np.int64) * nbins + ibins,
+                                 minlength=nclust * nbins)
+    presence_ratio = presence_ratio.reshape(nclust, nbins).astype(float)
     r.presence_ratio = np.sum(presence_ratio > 0, axis=1) / presence_ratio.shape[1]
     r.presence_ratio_std = np.std(presence_ratio, axis=1)
     r.num_spikes = np.sum(presence_ratio, axis=1)
     r.firing_rate = r.num_spikes / (tmax - tmin)
 
-    # loop over each cluster to compute the rest of the metrics
-    for ic in np.arange(nclust):
-        # slice the spike_times array
-        ispikes = spike_clusters == cluster_ids[ic]
-        if np.all(~ispikes):  # if this cluster has no spikes, continue
-            continue
-        ts = spike_times[ispikes]
-        amps = spike_amps[ispikes]
-        depths = spike_depths[ispikes]
-
-        # compute metrics
-        r.frac_isi_viol[ic], _, _ = isi_viol(ts, rp=params['refractory_period'])
-        r.contamination_est[ic] = contamination_est(ts, rp=params['refractory_period'])
-        r.contamination_est2[ic], _ = contamination_est2(
-            ts, tmin, tmax, rp=params['refractory_period'], min_isi=params['min_isi'])
-        try:  # this may fail because `missed_spikes_est` requires a min number of spikes
-            r.missed_spikes_est[ic], _, _ = missed_spikes_est(
-                amps, spks_per_bin=params['spks_per_bin_for_missed_spks_est'],
-                sigma=params['std_smoothing_kernel_for_missed_spks_est'],
-                min_num_bins=params['min_num_bins_for_missed_spks_est'])
-        except AssertionError:
-            pass
-        r.cum_amp_drift[ic] = cum_drift(amps)
-        r.max_amp_drift[ic] = max_drift(amps)
-        r.cum_depth_drift[ic] = cum_drift(depths)
-        r.max_depth_drift[ic] = max_drift(depths)
+    # sort the spikes by cluster once: the spikes of a cluster are contiguous and keep their order
+    # NB: numpy uses a radix sort for the stable sort of 16 bits integers
+    isort = np.argsort(spike_clusters.astype(np.uint16) if nclust <= 2 ** 16 else spike_clusters,
+                       kind='stable')
+    clu = spike_clusters[isort]
+    ts = spike_times[isort]
+    amps = spike_amps[isort]
+    depths = spike_depths[isort]
+    nspikes = np.bincount(clu, minlength=nclust)
+    # only the clusters with spikes are computed, the others stay nan
+    iok = np.where(nspikes > 0)[0]
+    i1 = np.cumsum(nspikes)[iok]
+    n = nspikes[iok]
+    i0 = i1 - n
+    # `same` selects the differences between consecutive spikes of the same cluster
+    same = clu[1:] == clu[:-1]
+
+    def _cluster_count(mask, clusters=clu):
+        return np.bincount(clusters[:-1][mask], minlength=nclust)[iok]
+
+    def _cluster_cum_drift(feat):
+        # cumulative drift (see `cum_drift`) per cluster
+        d = np.abs(np.diff(feat))
+        return np.bincount(clu[:-1][same], weights=d[same], minlength=nclust)[iok] / n
+
+    # isi violations (see `isi_viol`) and contamination estimate (see `contamination_est`)
+    rp = params['refractory_period']
+    isis = np.diff(ts)
+    n_isi_viol = _cluster_count(same & (isis < rp))
+    r.frac_isi_viol[iok] = n_isi_viol / n
+    # the smallest absolute root of -x ** 2 + x + c, c >= 0 written in a numerically stable form
+    c = ((ts[i1 - 1] - ts[i0]) * n_isi_viol) / (2 * rp * n ** 2)
+    r.contamination_est[iok] = 2 * c / (1 + np.sqrt(1 + 4 * c))
+
+    # contamination estimate 2 (see `contamination_est2`): duplicate spikes are removed first
+    dup = np.r_[False, same & (isis <= params['min_isi'])]
+    clu_, ts_ = (clu[~dup], ts[~dup])
+    isis_ = np.diff(ts_)
+    n_ = np.bincount(clu_, minlength=nclust)[iok]
+    num_violations = _cluster_count((clu_[1:] == clu_[:-1]) & (isis_ < rp), clusters=clu_)
+    violation_time = 2 * n_ * (rp - params['min_isi'])
+    total_rate = n_ / (tmax - tmin)
+    violation_rate = num_violations / violation_time
+    r.contamination_est2[iok] = violation_rate / total_rate
+
+    # drift metrics (see `cum_drift` and `max_drift`)
+    r.cum_amp_drift[iok] = _cluster_cum_drift(amps)
+    r.max_amp_drift[iok] = np.maximum.reduceat(amps, i0) - np.minimum.reduceat(amps, i0)
+    r.cum_depth_drift[iok] = _cluster_cum_drift(depths)
+    r.max_depth_drift[iok] = np.maximum.reduceat(depths, i0) - np.minimum.reduceat(depths, i0)
+
+    # `missed_spikes_est` requires a min number of spikes, it is computed on each cluster slice
+    min_spikes = params['spks_per_bin_for_missed_spks_est'] * \
+        params['min_num_bins_for_missed_spks_est']
+    for ic in np.where(n > min_spikes)[0]:
+        r.missed_spikes_est[iok[ic]], _, _ = missed_spikes_est(
+            amps[i0[ic]:i1[ic]], spks_per_bin=params['spks_per_bin_for_missed_spks_est'],
+            sigma=params['std_smoothing_kernel_for_missed_spks_est'],
+            min_num_bins=params['min_num_bins_for_missed_spks_est'])
 
     return r
@@ -6,6 +6,7 @@ Code for decoding by G. Meijer
 '''
 
 import numpy as np
+from numba import jit
 import types
 from itertools import groupby
 from sklearn.ensemble import RandomForestClassifier
@@ -120,9 +121,47 @@ def _symmetrize_correlograms(correlograms):
     return np.dstack((sym, correlograms))
 
 
-def xcorr(spike_times, spike_clusters, bin_size=None, window_size=None):
+@jit(nopython=True)
+def _xcorr_kernel(spike_times, spike_clusters_i, bin_size, half_bins, correlograms):
+    """
+    One-sided correlograms: for each spike, walks the following spikes until the delay gets
+    outside of the window. Increments correlograms[cluster_i, cluster_j, delay_bins] in-place.
+    """
+    n = spike_times.size
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = np.int64(np.round((spike_times[j] - spike_times[i]) / bin_size))
+            if d > half_bins:
+                break
+            correlograms[spike_clusters_i[i], spike_clusters_i[j], d] += 1
+
+
+@jit(nopython=True)
+def _xcorr_pairs_kernel(spike_times, spike_clusters_i, bin_size, half_bins, lookup, pos, neg):
+    """
+    Same as _xcorr_kernel for a subset of pairs of clusters. lookup[a, b] is the index of the pair
+    (a, b) in the output or -1. For the pair p = (a, b), pos[p] is the one-sided correlogram of
+    spikes of b following spikes of a and neg[p] of spikes of a following spikes of b.
+    """
+    n = spike_times.size
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = np.int64(np.round((spike_times[j] - spike_times[i]) / bin_size))
+            if d > half_bins:
+                break
+            ci, cj = (spike_clusters_i[i], spike_clusters_i[j])
+            if lookup[ci, cj] >= 0:
+                pos[lookup[ci, cj], d] += 1
+            if lookup[cj, ci] >= 0:
+                neg[lookup[cj, ci], d] += 1
+
+
+def xcorr(spike_times, spike_clusters, bin_size=None, window_size=None, pairs=None):
     """Compute all pairwise cross-correlograms among the clusters appearing in `spike_clusters`.
 
+    The spike trains are walked once with a compiled kernel: for each spike, only the following
+    spikes within the window are visited.
+
     Parameters
     ----------
 
@@ -134,9 +173,14 @@ def xcorr(spike_times, spike_clusters, bin_size=None, window_size=None):
     :type bin_size: float
     :param window_size: Size of the window, in seconds.
     :type window_size: float
+    :param pairs: (optional) `(n_pairs, 2)` array of cluster ids. If provided, only the
+     cross-correlograms of these pairs are computed, avoiding the dense output.
+    :type pairs: array-like
 
     Returns an `(n_clusters, n_clusters, winsize_samples)` array with all pairwise
-    cross-correlograms.
+    cross-correlograms, or if `pairs` is provided, an `(n_pairs, winsize_samples)` array
+    where `c[p]` is the cross-correlogram of `pairs[p, 0]` and `pairs[p, 1]`, same as the
+    `c[i, j]` of the dense output.
 
     """
     assert np.all(np.diff(spike_times) >= 0), ("The spike times must be increasing.")
@@ -157,42 +201,29 @@ def xcorr(spike_times, spike_clusters, bin_size=None, window_size=None):
     # Like spike_clusters, but with 0..n_clusters-1 indices.
     spike_clusters_i = _index_of(spike_clusters, clusters)
 
-    # Shift between the two copies of the spike trains.
-    shift = 1
-
-    # At a given shift, the mask precises which spikes have matching spikes
-    # within the correlogram time window.
-    mask = np.ones_like(spike_times, dtype=np.bool)
-
-    correlograms = _create_correlograms_array(n_clusters, winsize_bins)
-
-    # The loop continues as long as there is at least one spike with
-    # a matching spike.
-    while mask[:-shift].any():
-        # Interval between spike i and spike i+shift.
-        spike_diff = _diff_shifted(spike_times, shift)
-
-        # Binarize the delays between spike i and spike i+shift.
-        spike_diff_b = np.round(spike_diff / bin_size).astype(np.int64)
-
-        # Spikes with no matching spikes are masked.
-        mask[:-shift][spike_diff_b > (winsize_bins / 2)] = False
-
-        # Cache the masked spike delays.
-        m = mask[:-shift].copy()
-        d = spike_diff_b[m]
-
-        # Find the indices in the raveled correlograms array that need
-        # to be incremented, taking into account the spike clusters.
-        indices = np.ravel_multi_index(
-            (spike_clusters_i[:-shift][m], spike_clusters_i[+shift:][m], d), correlograms.shape)
-
-        # Increment the matching spikes in the correlograms array.
-        _increment(correlograms.ravel(), indices)
-
-        shift += 1
-
-    return _symmetrize_correlograms(correlograms)
+    if pairs is None:
+        correlograms = _create_correlograms_array(n_clusters, winsize_bins)
+        _xcorr_kernel(spike_times, spike_clusters_i, float(bin_size), winsize_bins // 2,
+                      correlograms)
+        return _symmetrize_correlograms(correlograms)
+
+    # pairs of clusters: the lookup table gives the index of each pair in the output
+    pairs = np.atleast_2d(np.asarray(pairs))
+    pairs_i = np.searchsorted(clusters, pairs)
+    missing = np.any((pairs_i == n_clusters) |
+                     (clusters[np.minimum(pairs_i, n_clusters - 1)] != pairs), axis=1)
+    lookup = np.zeros((n_clusters, n_clusters), dtype=np.int64) - 1
+    lookup[pairs_i[~missing, 0], pairs_i[~missing, 1]] = np.where(~missing)[0]
+    pos = np.zeros((pairs.shape[0], winsize_bins // 2 + 1), dtype=np.int32)
+    neg = np.zeros_like(pos)
+    _xcorr_pairs_kernel(spike_times, spike_clusters_i, float(bin_size), winsize_bins // 2,
+                        lookup, pos, neg)
+    # pairs requested several times are counted in a single row: copy it to the others
+    ifirst = lookup[pairs_i[~missing, 0], pairs_i[~missing, 1]]
+    pos[~missing], neg[~missing] = (pos[ifirst], neg[ifirst])
+    # symmetrize as in _symmetrize_correlograms
+    pos[:, 0] = np.maximum(pos[:, 0], neg[:, 0])
+    return np.c_[neg[:, 1:][:, ::-1], pos]
 
 
 def decode(spike_times, spike_clusters, event_times, event_groups, pre_time=0, post_time=0.5,
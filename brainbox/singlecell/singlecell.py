@@ -3,7 +3,8 @@ Computes properties of single-cells, e.g. the autocorrelation and firing rate.
 '''
 
 import numpy as np
-from scipy.signal import convolve, gaussian
+from scipy.ndimage import convolve1d
+from scipy.signal import gaussian
 from brainbox.core import Bunch
 from brainbox.population import xcorr
 
@@ -30,11 +31,15 @@ def acorr(spike_times, bin_size=None, window_size=None):
 
 def calculate_peths(
         spike_times, spike_clusters, cluster_ids, align_times, pre_time=0.2,
-        post_time=0.5, bin_size=0.025, smoothing=0.025, return_fr=True):
+        post_time=0.5, bin_size=0.025, smoothing=0.025, return_fr=True, dtype=np.float64,
+        n_trials_block=None):
     """
     Calcluate peri-event time histograms; return means and standard deviations
     for each time point across specified clusters
 
+    All the trials of a block are binned at once and smoothed with a single convolution along
+    the time axis.
+
     :param spike_times: spike times (in seconds)
     :type spike_times: array-like
     :param spike_clusters: cluster ids corresponding to each event in `spikes`
@@ -54,6 +59,11 @@ def calculate_peths(
     :type smoothing: float
     :param return_fr: `True` to return (estimated) firing rate, `False` to return spike counts
     :type return_fr: bool
+    :param dtype: data type of the outputs, use `np.float32` to halve the memory footprint
+    :type dtype: numpy dtype
+    :param n_trials_block: number of trials processed at once, bounds the memory used by
+        the intermediate arrays. Defaults to all trials at once.
+    :type n_trials_block: int
     :return: peths, binned_spikes
     :rtype: peths: Bunch({'mean': peth_means, 'std': peth_stds, 'tscale': ts, 'cscale': ids})
     :rtype: binned_spikes: np.array (n_align_times, n_clusters, n_bins)
@@ -64,7 +74,12 @@ def calculate_peths(
     n_bins_pre = int(np.ceil(pre_time / bin_size)) + n_offset
     n_bins_post = int(np.ceil(post_time / bin_size)) + n_offset
     n_bins = n_bins_pre + n_bins_post
-    binned_spikes = np.zeros(shape=(len(align_times), len(cluster_ids), n_bins))
+    # bins kept in the outputs once the smoothing boundaries are removed
+    ikeep = slice(n_offset, n_bins - n_offset)
+    align_times = np.asarray(align_times)
+    ids = np.unique(cluster_ids)
+    binned_spikes = np.zeros(shape=(align_times.size, ids.size, n_bins - 2 * n_offset),
+                             dtype=dtype)
 
     # build gaussian kernel if requested
     if smoothing > 0:
@@ -73,9 +88,6 @@ def calculate_peths(
         # half (causal) gaussian filter
         # window[int(np.ceil(w/2)):] = 0
         window /= np.sum(window)
-        binned_spikes_conv = np.copy(binned_spikes)
-
-    ids = np.unique(cluster_ids)
 
     # filter spikes outside of the loop
     idxs = np.bitwise_and(spike_times >= np.min(align_times) - (n_bins_pre + 1) * bin_size,
@@ -83,57 +95,54 @@ def calculate_peths(
     idxs = np.bitwise_and(idxs, np.isin(spike_clusters, cluster_ids))
     spike_times = spike_times[idxs]
     spike_clusters = spike_clusters[idxs]
+    # spikes need to be sorted to look up the trials windows
+    if not np.all(np.diff(spike_times) >= 0):
+        ordre = np.argsort(spike_times, kind='stable')
+        spike_times, spike_clusters = (spike_times[ordre], spike_clusters[ordre])
+    spike_rows = np.searchsorted(ids, spike_clusters)
 
     # compute floating tscale
     tscale = np.arange(-n_bins_pre, n_bins_post + 1) * bin_size
-    # bin spikes
-    for i, t_0 in enumerate(align_times):
-        # define bin edges
-        ts = tscale + t_0
-        # filter spikes
-        idxs = np.bitwise_and(spike_times >= ts[0], spike_times <= ts[-1])
-        i_spikes = spike_times[idxs]
-        i_clusters = spike_clusters[idxs]
-
-        # bin spikes similar to bincount2D: x = spike times, y = spike clusters
-        xscale = ts
-        xind = (np.floor((i_spikes - np.min(ts)) / bin_size)).astype(np.int64)
-        yscale, yind = np.unique(i_clusters, return_inverse=True)
-        nx, ny = [xscale.size, yscale.size]
-        ind2d = np.ravel_multi_index(np.c_[yind, xind].transpose(), dims=(ny, nx))
-        r = np.bincount(ind2d, minlength=nx * ny, weights=None).reshape(ny, nx)
-
-        # store (ts represent bin edges, so there are one fewer bins)
-        bs_idxs = np.isin(ids, yscale)
-        binned_spikes[i, bs_idxs, :] = r[:, :-1]
-
+    # mean and sum of squared deviations, merged across blocks of trials
+    peth_means = np.zeros((ids.size, n_bins - 2 * n_offset))
+    peth_m2 = np.zeros((ids.size, n_bins - 2 * n_offset))
+    n_trials_block = n_trials_block or max(align_times.size, 1)
+    for first in np.arange(0, align_times.size, n_trials_block):
+        t_0 = align_times[first:first + n_trials_block]
+        nt = t_0.size
+        # select spikes within the bin edges of each trial
+        ts_first, ts_last = (tscale[0] + t_0, tscale[-1] + t_0)
+        i0 = np.searchsorted(spike_times, ts_first, side='left')
+        nspikes = np.searchsorted(spike_times, ts_last, side='right') - i0
+        itrial = np.repeat(np.arange(nt), nspikes)
+        ispikes = np.arange(np.sum(nspikes)) + np.repeat(i0 - np.cumsum(nspikes) + nspikes,
+                                                         nspikes)
+        # bin spikes: ts represent bin edges, spikes on the last edge go into an extra bin
+        xind = (np.floor((spike_times[ispikes] - ts_first[itrial]) / bin_size)).astype(np.int64)
+        ind3d = (itrial * ids.size + spike_rows[ispikes]) * (n_bins + 1) + xind
+        r = np.bincount(ind3d, minlength=nt * ids.size * (n_bins + 1)).reshape(
+            nt, ids.size, n_bins + 1).astype(np.float64)
+        binned_spikes[first:first + nt] = r[:, :, ikeep]
         # smooth
         if smoothing > 0:
-            idxs = np.where(bs_idxs)[0]
-            for j in range(r.shape[0]):
-                binned_spikes_conv[i, idxs[j], :] = convolve(
-                    r[j, :], window, mode='same', method='auto')[:-1]
-
-    # average
-    if smoothing > 0:
-        binned_spikes_ = np.copy(binned_spikes_conv)
-    else:
-        binned_spikes_ = np.copy(binned_spikes)
-    if return_fr:
-        binned_spikes_ /= bin_size
-
-    peth_means = np.mean(binned_spikes_, axis=0)
-    peth_stds = np.std(binned_spikes_, axis=0)
-
-    if smoothing > 0:
-        peth_means = peth_means[:, n_offset:-n_offset]
-        peth_stds = peth_stds[:, n_offset:-n_offset]
-        binned_spikes = binned_spikes[:, :, n_offset:-n_offset]
-        tscale = tscale[n_offset:-n_offset]
+            r = convolve1d(r, window, axis=-1, mode='constant')
+        r = r[:, :, ikeep]
+        if return_fr:
+            r /= bin_size
+        # average: merge the block mean and sum of squared deviations (Chan et al.)
+        block_means = np.mean(r, axis=0)
+        block_m2 = np.sum((r - block_means) ** 2, axis=0)
+        delta = block_means - peth_means
+        peth_means += delta * nt / (first + nt)
+        peth_m2 += block_m2 + delta ** 2 * first * nt / (first + nt)
+
+    peth_stds = np.sqrt(peth_m2 / align_times.size)
+    tscale = tscale[n_offset:tscale.size - n_offset]
 
     # package output
     tscale = (tscale[:-1] + tscale[1:]) / 2
-    peths = Bunch({'means': peth_means, 'stds': peth_stds, 'tscale': tscale, 'cscale': ids})
+    peths = Bunch({'means': peth_means.astype(dtype), 'stds': peth_stds.astype(dtype),
+                   'tscale': tscale, 'cscale': ids})
     return peths, binned_spikes
 
 
@@ -75,6 +75,20 @@ class TestWheel(unittest.TestCase):
         self.assertTrue(np.allclose(peak_vel, expected[3], atol=1.e-2),
                         msg='Unexpected peak velocities')
 
+    def test_movements_stream(self):
+        # Processing the data in chunks gives the same output as the whole recording
+        t, pos = self.test_data[0][0]
+        kwargs = dict(freq=1000, pos_thresh=8, pos_thresh_onset=1.5)
+        expected = wheel.movements(t, pos, **kwargs)
+        for chunk in (37, 1000, 60000):
+            md = wheel.MovementDetector(**kwargs)
+            outs = [md.update(t[i:i + chunk], pos[i:i + chunk]) for i in range(0, t.size, chunk)]
+            outs.append(md.finish())
+            for out, exp in zip(map(np.concatenate, zip(*outs)), expected):
+                np.testing.assert_array_equal(out, exp)
+            # only the samples of the last segment are kept in memory
+            self.assertTrue(md._t.size < 1000)
+
     def test_traces_by_trial(self):
         t, pos = self.test_data[0][0]
         start = self.trials['stimOn_times']
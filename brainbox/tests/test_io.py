@@ -1,12 +1,15 @@
 import json
 from pathlib import Path
+import tempfile
 import unittest
 import uuid
 
 import numpy as np
 
 from brainbox.core import intersect2d, ismember2d, ismember
+from brainbox.io.io import extract_waveforms, extract_waveforms_batch
 from brainbox.io.parquet import uuid2np, np2uuid, rec2col, np2str
+from ibllib.io import spikeglx
 
 
 class TestParquet(unittest.TestCase):
@@ -73,3 +76,56 @@ class TestParquet(unittest.TestCase):
         uuids = [uuid.uuid4() for _ in np.arange(4)]
         np_uuids = uuid2np(uuids)
         assert np2uuid(np_uuids) == uuids
+
+
+class TestExtractWaveforms(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.TemporaryDirectory()
+        file_meta = Path(__file__).parents[2].joinpath(
+            'tests', 'ibllib', 'fixtures', 'io', 'spikeglx', 'sample3A_short_g0_t0.imec.ap.meta')
+        self.file_bin = spikeglx._mock_spikeglx_file(
+            Path(self.tdir.name).joinpath('sample3A_short_g0_t0.imec.ap.bin'), file_meta,
+            ns=76104, nc=385, sync_depth=16, random=True)['bin_file']
+        self.sr = spikeglx.Reader(self.file_bin)
+        np.random.seed(42)
+        # spikes overlapping, unsorted and at the edges of the recording
+        self.ts = np.r_[np.random.rand(200) * self.sr.ns / self.sr.fs, 0.0001, 1.001, 1.0011,
+                        self.sr.ns / self.sr.fs - 0.0001]
+
+    def tearDown(self):
+        self.tdir.cleanup()
+
+    def _waveforms_ref(self, ts, ch, car):
+        """ spike by spike extraction to compare with """
+        nw = int(self.sr.fs / 1000)
+        d = np.r_[np.full((nw, self.sr.nc), np.nan),
+                  self.sr.read(slice(None), sync=False),
+                  np.full((nw, self.sr.nc), np.nan)]
+        if car:
+            d -= np.median(d[:, :-1], axis=1)[:, np.newaxis]
+        wf = np.zeros((ts.size, 2 * nw, ch.shape[-1]))
+        for i, s in enumerate(np.array(ts * self.sr.fs).astype(int)):
+            wf[i] = d[s:s + 2 * nw][:, ch[i] if ch.ndim == 2 else ch]
+        return wf
+
+    def test_extract_waveforms_batch(self):
+        ch = np.arange(100, 120)
+        ch_spikes = np.random.randint(0, 364, self.ts.size)[:, np.newaxis] + np.arange(20)
+        for car in [False, True]:
+            for c in [ch, ch_spikes]:
+                wf = extract_waveforms_batch(self.sr, self.ts, c, car=car, max_block_samples=500)
+                np.testing.assert_allclose(wf, self._waveforms_ref(self.ts, c, car), atol=1e-7)
+        # compressed files give the same result
+        wf = extract_waveforms_batch(self.sr, self.ts, ch_spikes)
+        wf_cbin = extract_waveforms_batch(self.sr.compress_file(), self.ts, ch_spikes)
+        np.testing.assert_array_equal(wf, wf_cbin)
+        # legacy interface and error handling
+        wf = extract_waveforms(self.file_bin, self.ts, ch, car=False)
+        self.assertEqual(wf.shape, (self.ts.size, 60, 20))
+        self.assertEqual(extract_waveforms_batch(self.sr, [], ch).shape, (0, 60, 20))
+        # a single channel may be given as a scalar
+        np.testing.assert_array_equal(extract_waveforms_batch(self.sr, self.ts, 105),
+                                      extract_waveforms_batch(self.sr, self.ts, ch)[:, :, 5:6])
+        with self.assertRaises(ValueError):
+            extract_waveforms_batch(self.sr, self.ts, [385])
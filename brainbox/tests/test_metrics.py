@@ -1,4 +1,9 @@
 # Create synthetic dataset in a top-level function (times, amps, clusters)
+import unittest
+
+import numpy as np
+
+import brainbox.metrics.metrics as metrics
 
 
 def test_unit_stability():
@@ -15,3 +20,43 @@ def test_wf_similarity():
 
 def test_firing_rate_coeff_var():
     pass
+
+
+class TestQuickUnitMetrics(unittest.TestCase):
+
+    def test_quick_unit_metrics(self):
+        np.random.seed(0)
+        n = 20000
+        ts = np.sort(np.random.rand(n) * 500)
+        ts[50:55] = ts[50]  # duplicate spikes
+        clusters = np.minimum((np.random.pareto(1.5, n) * 4).astype(np.int64), 30)
+        clusters[clusters == 3] = 4  # a cluster without spikes
+        amps = np.random.rand(n) * 1e-4
+        depths = np.random.rand(n) * 3800
+        r = metrics.quick_unit_metrics(clusters, ts, amps, depths)
+        self.assertTrue(np.all(np.isnan(r.frac_isi_viol[3])))
+        self.assertEqual(np.nansum(r.num_spikes), n)
+        # the grouped computation matches the single unit metrics functions
+        p = metrics.METRICS_PARAMS
+        rp = p['refractory_period']
+        for ic in np.unique(clusters):
+            i = clusters == ic
+            self.assertEqual(r.frac_isi_viol[ic], metrics.isi_viol(ts[i], rp=rp)[0])
+            self.assertAlmostEqual(r.contamination_est[ic],
+                                   metrics.contamination_est(ts[i], rp=rp))
+            self.assertEqual(r.contamination_est2[ic], metrics.contamination_est2(
+                ts[i], ts[0], ts[-1], rp=rp, min_isi=p['min_isi'])[0])
+            self.assertAlmostEqual(r.cum_amp_drift[ic], metrics.cum_drift(amps[i]))
+            self.assertEqual(r.max_depth_drift[ic], metrics.max_drift(depths[i]))
+            if np.sum(i) > p['spks_per_bin_for_missed_spks_est'] * \
+                    p['min_num_bins_for_missed_spks_est']:
+                self.assertEqual(r.missed_spikes_est[ic], metrics.missed_spikes_est(
+                    amps[i], spks_per_bin=p['spks_per_bin_for_missed_spks_est'],
+                    sigma=p['std_smoothing_kernel_for_missed_spks_est'],
+                    min_num_bins=p['min_num_bins_for_missed_spks_est'])[0])
+            else:
+                self.assertTrue(np.isnan(r.missed_spikes_est[ic]))
+
+
+if __name__ == "__main__":
+    unittest.main(exit=False)
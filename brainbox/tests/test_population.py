@@ -56,6 +56,21 @@ class TestPopulation(unittest.TestCase):
 
         self.assertEqual(c.shape, (max_cluster, max_cluster, 51))
 
+    def test_xcorr_pairs(self):
+        max_cluster = 10
+        spike_times, spike_clusters = _random_data(max_cluster)
+        bin_size, winsize_bins = .001, .05
+        c = xcorr(spike_times, spike_clusters, bin_size=bin_size, window_size=winsize_bins)
+        # pairs in both orders, auto-correlograms, duplicates and a cluster without spikes
+        pairs = np.array([[0, 1], [1, 0], [3, 3], [9, 2], [0, 1], [4, 12]])
+        cp = xcorr(spike_times, spike_clusters, bin_size=bin_size, window_size=winsize_bins,
+                   pairs=pairs)
+        self.assertEqual(cp.shape, (pairs.shape[0], 51))
+        self.assertTrue(np.all(cp[:-1] == c[pairs[:-1, 0], pairs[:-1, 1]]))
+        self.assertTrue(np.all(cp[-1] == 0))
+        # the correlograms of the pair in reverse order are time-reversed
+        self.assertTrue(np.all(cp[0] == cp[1][::-1]))
+
 
 if __name__ == "__main__":
     np.random.seed(0)
@@ -36,6 +36,31 @@ class TestPeths(unittest.TestCase):
         self.assertTrue(np.all(fr.shape == (n_events, len(cluster_sel), 28)))
         self.assertTrue(peth.tscale.size == 28)
 
+    def test_peths_blocks_dtype(self):
+        np.random.seed(seed=42)
+        spike_times = np.random.rand(5000, ) * 100  # unsorted on purpose
+        spike_clusters = np.random.randint(0, 10, 5000)
+        event_times = np.arange(50) * 2. + 0.5
+        # one spike on a known bin for each event
+        spike_times = np.r_[spike_times, event_times + 0.0125]
+        spike_clusters = np.r_[spike_clusters, np.zeros(50, dtype=int) + 11]
+        kwargs = dict(cluster_ids=[2, 5, 11], align_times=event_times, smoothing=0)
+        peth, counts = calculate_peths(spike_times, spike_clusters, **kwargs)
+        self.assertTrue(np.all(counts[:, 2, :] == (np.abs(peth.tscale - 0.0125) < 1e-6)))
+        self.assertTrue(np.allclose(peth.stds[2], 0))
+        # streaming blocks of trials and single precision give the same outputs
+        for kwargs['smoothing'] in (0, 0.025):
+            peth, counts = calculate_peths(spike_times, spike_clusters, **kwargs)
+            peth_, counts_ = calculate_peths(spike_times, spike_clusters, **kwargs,
+                                             n_trials_block=7)
+            peth32, counts32 = calculate_peths(spike_times, spike_clusters, **kwargs,
+                                               dtype=np.float32)
+            self.assertTrue(np.all(counts == counts_) and np.all(counts == counts32))
+            self.assertEqual(peth32.means.dtype, np.float32)
+            for k in ('means', 'stds'):
+                self.assertTrue(np.allclose(peth[k], peth_[k]))
+                self.assertTrue(np.allclose(peth[k], peth32[k], atol=1e-3))
+
 
 def test_firing_rate():
     pass
@@ -6,7 +6,7 @@ import pandas as pd
 import numpy as np
 import nrrd
 
-from brainbox.core import Bunch, ismember
+from brainbox.core import Bunch
 from ibllib.io import params
 from oneibl.webclient import http_download_file
 
@@ -595,6 +595,8 @@ class BrainRegions:
     self.id: contains label ids found in the BrainCoordinate.label volume
     self.name: list/tuple of brain region names
     self.acronym: list/tuple of brain region acronyms
+    The tree is indexed once at instantiation so that the look-ups of large arrays of ids, the
+    ancestors and descendants queries are vectorized.
     """
     id: np.ndarray
     name: np.object
@@ -603,15 +605,90 @@ class BrainRegions:
     level: np.ndarray
     parent: np.ndarray
 
+    def __post_init__(self):
+        self._compute_tree_index()
+
+    def _compute_tree_index(self):
+        """
+        Indexes the region tree:
+        -   _isort, _sorted_id: the ids are sorted once to look-up the table rows of ids
+        -   _depth: depth of each region in the tree, 0 for the roots
+        -   _ancestors: [nregions, max depth + 1] array, row of the ancestor at each depth, -1
+            for depths below the region
+        -   _preorder, _left, _right: nested sets, the rows of the descendants of a region
+            (itself included) are `_preorder[_left[row]:_right[row] + 1]`
+        """
+        n = self.id.size
+        self._isort = np.argsort(self.id)
+        self._sorted_id = self.id[self._isort]
+        parent_rows = np.zeros(n, dtype=np.int64) - 1
+        iparent = np.where(~np.isnan(self.parent.astype(float)))[0]
+        parent_rows[iparent] = self._id2row(self.parent[iparent].astype(np.int64))
+        # walk up the tree from all the regions at once, one generation at a time
+        generations = [np.arange(n)]
+        while np.any(generations[-1] >= 0):
+            current = generations[-1]
+            generations.append(np.where(current >= 0, parent_rows[np.maximum(current, 0)], -1))
+        generations = np.array(generations[:-1])
+        self._depth = np.sum(generations >= 0, axis=0) - 1
+        depths = np.arange(generations.shape[0])
+        igen = self._depth[:, np.newaxis] - depths[np.newaxis, :]
+        self._ancestors = np.where(
+            igen >= 0, generations[np.maximum(igen, 0), np.arange(n)[:, np.newaxis]], -1)
+        # depth first traversal for the nested sets, the children are visited in the table order
+        children = [[] for _ in range(n)]
+        for row in iparent:
+            children[parent_rows[row]].append(row)
+        preorder = []
+        stack = list(np.where(parent_rows < 0)[0][::-1])
+        while stack:
+            row = stack.pop()
+            preorder.append(row)
+            stack.extend(children[row][::-1])
+        self._preorder = np.array(preorder, dtype=np.int64)
+        self._left = np.zeros(n, dtype=np.int64)
+        self._left[self._preorder] = np.arange(n)
+        # the size of a subtree is the number of regions having it as an ancestor
+        nsub = np.bincount(self._ancestors[self._ancestors >= 0], minlength=n)
+        self._right = self._left + nsub - 1
+
+    def _id2row(self, ids):
+        """
+        Vectorized look-up of the table rows of an array of ids
+        :param ids: np.array or scalar of region ids
+        :return: np.array of rows, same shape as ids
+        """
+        ids = np.asarray(ids)
+        i = np.minimum(np.searchsorted(self._sorted_id, ids), self._sorted_id.size - 1)
+        rows = self._isort[i]
+        if not np.all(self.id[rows] == ids):
+            raise ValueError(f"Unknown region ids: {np.unique(ids[self.id[rows] != ids])}")
+        return rows
+
+    def _descendants_mask(self, ids):
+        """Boolean mask of the table rows of the descendants of ids, ids included"""
+        rows = self._id2row(np.unique(ids))
+        # union of the nested set intervals, in the preorder
+        marks = np.zeros(self.id.size + 1, dtype=np.int64)
+        np.add.at(marks, self._left[rows], 1)
+        np.add.at(marks, self._right[rows] + 1, -1)
+        return (np.cumsum(marks[:-1]) > 0)[self._left]
+
+    def _ancestors_mask(self, ids):
+        """Boolean mask of the table rows of the ancestors of ids, ids included"""
+        rows = self._ancestors[self._id2row(np.unique(ids))]
+        mask = np.zeros(self.id.size, dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
     def get(self, ids) -> Bunch:
         """
         Get a bunch of the name/id
         """
-        uid, uind = np.unique(ids, return_inverse=True)
-        a, iself, _ = np.intersect1d(self.id, uid, assume_unique=False, return_indices=True)
+        rows = self._id2row(np.array(ids).flatten())
         b = Bunch()
         for k in self.__dataclass_fields__.keys():
-            b[k] = self.__getattribute__(k)[iself[uind]]
+            b[k] = self.__getattribute__(k)[rows]
         return b
 
     def _navigate_tree(self, ids, direction='down'):
@@ -621,19 +698,12 @@ class BrainRegions:
         :param direction:
         :return: Bunch
         """
-        indices = ismember(self.id, ids)[0]
-        count = np.sum(indices)
-        while True:
-            if direction == 'down':
-                indices |= ismember(self.parent, self.id[indices])[0]
-            elif direction == 'up':
-                indices |= ismember(self.id, self.parent[indices])[0]
-            else:
-                raise ValueError("direction should be either 'up' or 'down'")
-            if count == np.sum(indices):  # last iteration didn't find any match
-                break
-            else:
-                count = np.sum(indices)
+        if direction == 'down':
+            indices = self._descendants_mask(ids)
+        elif direction == 'up':
+            indices = self._ancestors_mask(ids)
+        else:
+            raise ValueError("direction should be either 'up' or 'down'")
         return self.get(self.id[indices])
 
     def descendants(self, ids):
@@ -652,6 +722,29 @@ class BrainRegions:
         """
         return self._navigate_tree(ids, direction='up')
 
+    def is_descendant(self, ids, ancestor_ids):
+        """
+        Tests whether each region of an array of ids is a descendant of any of the ancestor ids,
+        a region is considered a descendant of itself
+        :param ids: np.array or scalar of region ids, e.g. the region of each channel
+        :param ancestor_ids: np.array or scalar of region ids
+        :return: boolean np.array, same shape as ids
+        """
+        return self._descendants_mask(ancestor_ids)[self._id2row(ids)]
+
+    def remap_level(self, ids, level):
+        """
+        Maps each region of an array of ids to its ancestor at a given depth of the tree. The
+        regions above this level are left unchanged.
+        :param ids: np.array or scalar of region ids, e.g. the region of each channel
+        :param level: depth in the tree, 0 is the root
+        :return: np.array of region ids, same shape as ids
+        """
+        rows = self._id2row(ids)
+        level = min(level, self._ancestors.shape[1] - 1)
+        rows_level = self._ancestors[rows, level]
+        return self.id[np.where(rows_level >= 0, rows_level, rows)]
+
 
 class AllenAtlas(BrainAtlas):
     """
@@ -1,6 +1,8 @@
 """
 Quality control of raw Neuropixel electrophysiology data.
 """
+from collections import deque
+import concurrent.futures
 from pathlib import Path
 import logging
 import shutil
@@ -27,17 +29,91 @@ WELCH_WIN_LENGTH_SAMPLES = 1024
 NCH_WAVEFORMS = 32  # number of channels to be saved in templates.waveforms and channels.waveforms
 
 
-def rmsmap(fbin):
+def _rmsmap_window(sglx, first, last):
+    """
+    Computes the RMS and the welch spectral density of a single window of the rmsmap
+    :return: rms per channel, number of samples, spectral density (None if window too short)
+    """
+    D = sglx.read_samples(first_sample=first, last_sample=last)[0].transpose()
+    # remove low frequency noise below 1 Hz
+    D = dsp.hp(D, 1 / sglx.fs, [0, 1])
+    # the last window may be smaller than what is needed for welch
+    if last - first < WELCH_WIN_LENGTH_SAMPLES:
+        return dsp.rms(D), D.shape[1], None
+    # compute a smoothed spectrum using welch method
+    _, w = signal.welch(D, fs=sglx.fs, window='hanning', nperseg=WELCH_WIN_LENGTH_SAMPLES,
+                        detrend='constant', return_onesided=True, scaling='density', axis=-1)
+    return dsp.rms(D), D.shape[1], w.T
+
+
+_PROCESS_READERS = {}
+
+
+def _rmsmap_window_process(fbin, first, last):
+    """
+    Process pool entry point for `_rmsmap_window`: the reader is opened once per worker process
+    """
+    if fbin not in _PROCESS_READERS:
+        _PROCESS_READERS[fbin] = spikeglx.Reader(fbin)
+    return _rmsmap_window(_PROCESS_READERS[fbin], first, last)
+
+
+def _load_rmsmap_checkpoint(checkpoint_file, win):
+    """
+    Loads the rmsmap accumulators from a checkpoint file in-place
+    :return: index of the first window left to compute, 0 if no valid checkpoint
+    """
+    if checkpoint_file is None or not Path(checkpoint_file).exists():
+        return 0
+    try:
+        with np.load(checkpoint_file) as ckpt:
+            for k in ['TRMS', 'nsamples', 'spectral_density']:
+                assert ckpt[k].shape == win[k].shape
+                win[k][:] = ckpt[k]
+            iw = int(ckpt['iw'])
+    except Exception:
+        _logger.warning(f"{checkpoint_file} corrupt or inconsistent checkpoint, starting over")
+        return 0
+    _logger.info(f"Resuming rmsmap from checkpoint {checkpoint_file} at window {iw}")
+    return iw
+
+
+def _save_rmsmap_checkpoint(checkpoint_file, win, iw):
+    """
+    Writes the rmsmap accumulators to disk, the write is atomic so that a crash can't leave
+    a half-written checkpoint
+    :param iw: index of the first window left to compute
+    """
+    checkpoint_file = Path(checkpoint_file)
+    file_tmp = checkpoint_file.with_suffix('.tmp')
+    with open(file_tmp, 'wb') as fid:
+        np.savez(fid, iw=iw, TRMS=win['TRMS'], nsamples=win['nsamples'],
+                 spectral_density=win['spectral_density'])
+    file_tmp.replace(checkpoint_file)
+
+
+def rmsmap(fbin, n_workers=1, max_in_flight=None, parallel='thread',
+           checkpoint_file=None, checkpoint_every=50):
     """
     Computes RMS map in time domain and spectra for each channel of Neuropixel probe
 
+    Windows can be computed in parallel. Results are always accumulated in window order so that
+    the output is identical to the serial computation regardless of the number of workers.
+
     :param fbin: binary file in spike glx format (will look for attached metatdata)
-    :type fbin: str or pathlib.Path
+    :type fbin: str or pathlib.Path or spikeglx.Reader
+    :param n_workers: (1) number of parallel workers, 1 computes serially
+    :param max_in_flight: (2 * n_workers) maximum number of windows submitted and not yet
+     accumulated, bounds memory usage
+    :param parallel: 'thread' or 'process' pool
+    :param checkpoint_file: (None) if provided, accumulators are saved to this file every
+     `checkpoint_every` windows and the computation resumes from it if it exists. The file is
+     removed upon completion.
+    :param checkpoint_every: (50) number of windows between checkpoints
     :return: a dictionary with amplitudes in channeltime space, channelfrequency space, time
      and frequency scales
     """
-    if not isinstance(fbin, spikeglx.Reader):
-        sglx = spikeglx.Reader(fbin)
+    sglx = fbin if isinstance(fbin, spikeglx.Reader) else spikeglx.Reader(fbin)
     rms_win_length_samples = 2 ** np.ceil(np.log2(sglx.fs * RMS_WIN_LENGTH_SECS))
     # the window generator will generates window indices
     wingen = dsp.WindowGenerator(ns=sglx.ns, nswin=rms_win_length_samples, overlap=0)
@@ -47,28 +123,59 @@ def rmsmap(fbin):
            'fscale': dsp.fscale(WELCH_WIN_LENGTH_SAMPLES, 1 / sglx.fs, one_sided=True),
            'tscale': wingen.tscale(fs=sglx.fs)}
     win['spectral_density'] = np.zeros((len(win['fscale']), sglx.nc))
-    # loop through the whole session
-    for first, last in wingen.firstlast:
-        D = sglx.read_samples(first_sample=first, last_sample=last)[0].transpose()
-        # remove low frequency noise below 1 Hz
-        D = dsp.hp(D, 1 / sglx.fs, [0, 1])
-        iw = wingen.iw
-        win['TRMS'][iw, :] = dsp.rms(D)
-        win['nsamples'][iw] = D.shape[1]
-        # the last window may be smaller than what is needed for welch
-        if last - first < WELCH_WIN_LENGTH_SAMPLES:
-            continue
-        # compute a smoothed spectrum using welch method
-        _, w = signal.welch(D, fs=sglx.fs, window='hanning', nperseg=WELCH_WIN_LENGTH_SAMPLES,
-                            detrend='constant', return_onesided=True, scaling='density', axis=-1)
-        win['spectral_density'] += w.T
-        # print at least every 20 windows
-        if (iw % min(20, max(int(np.floor(wingen.nwin / 75)), 1))) == 0:
-            print_progress(iw, wingen.nwin)
+    iw_start = _load_rmsmap_checkpoint(checkpoint_file, win)
+    firstlast = list(wingen.firstlast)[iw_start:]
+
+    if n_workers == 1:
+        results = (_rmsmap_window(sglx, first, last) for first, last in firstlast)
+        executor = None
+    else:
+        if parallel == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+            fcn, args = _rmsmap_window_process, [(str(sglx.file_bin), *fl) for fl in firstlast]
+        elif parallel == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+            fcn, args = _rmsmap_window, [(sglx, *fl) for fl in firstlast]
+        else:
+            raise ValueError(f"parallel should be 'thread' or 'process', got {parallel}")
+        results = _imap_ordered(executor, fcn, args, max_in_flight or 2 * n_workers)
+
+    # loop through the whole session, accumulating in window order
+    try:
+        for iw, (trms, nsamples, w) in enumerate(results, start=iw_start):
+            win['TRMS'][iw, :] = trms
+            win['nsamples'][iw] = nsamples
+            if w is not None:
+                win['spectral_density'] += w
+            if checkpoint_file and (iw + 1) % checkpoint_every == 0:
+                _save_rmsmap_checkpoint(checkpoint_file, win, iw + 1)
+            # print at least every 20 windows
+            if (iw % min(20, max(int(np.floor(wingen.nwin / 75)), 1))) == 0:
+                print_progress(iw, wingen.nwin)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    if checkpoint_file and Path(checkpoint_file).exists():
+        Path(checkpoint_file).unlink()
     return win
 
 
-def extract_rmsmap(fbin, out_folder=None, overwrite=False):
+def _imap_ordered(executor, fcn, args, max_in_flight):
+    """
+    Generator mapping fcn over a list of argument tuples with an executor, yielding results in
+    submission order while keeping at most `max_in_flight` pending futures
+    """
+    futures = deque()
+    for arg in args:
+        futures.append(executor.submit(fcn, *arg))
+        if len(futures) >= max_in_flight:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def extract_rmsmap(fbin, out_folder=None, overwrite=False, n_workers=1, parallel='thread',
+                   checkpoint=True):
     """
     Wrapper for rmsmap that outputs _ibl_ephysRmsMap and _ibl_ephysSpectra ALF files
 
@@ -76,7 +183,10 @@ def extract_rmsmap(fbin, out_folder=None, overwrite=False):
     :param out_folder: folder in which to store output ALF files. Default uses the folder in which
      the `fbin` file lives.
     :param overwrite: do not re-extract if all ALF files already exist
-    :param label: string or list of strings that will be appended to the filename before extension
+    :param n_workers: (1) number of parallel workers for the rmsmap computation
+    :param parallel: ('thread') 'thread' or 'process' pool, see rmsmap
+    :param checkpoint: (True) keeps a checkpoint file in the output folder so that an interrupted
+     computation restarts where it left off
     :return: None
     """
     _logger.info(f"Computing QC for {fbin}")
@@ -94,10 +204,12 @@ def extract_rmsmap(fbin, out_folder=None, overwrite=False):
         _logger.warning(f'{fbin.name} QC already exists, skipping. Use overwrite option.')
         return files_time + files_freq
     # crunch numbers
-    rms = rmsmap(fbin)
-    # output ALF files, single precision with the optional label as suffix before extension
     if not out_folder.exists():
         out_folder.mkdir()
+    checkpoint_file = out_folder.joinpath(f"{Path(fbin).stem}.rmsmap_checkpoint.npz")
+    rms = rmsmap(sglx, n_workers=n_workers, parallel=parallel,
+                 checkpoint_file=checkpoint_file if checkpoint else None)
+    # output ALF files, single precision with the optional label as suffix before extension
     tdict = {'rms': rms['TRMS'].astype(np.single), 'timestamps': rms['tscale'].astype(np.single)}
     fdict = {'power': rms['spectral_density'].astype(np.single),
              'freqs': rms['fscale'].astype(np.single)}
@@ -108,21 +220,24 @@ def extract_rmsmap(fbin, out_folder=None, overwrite=False):
     return out_time + out_freq
 
 
-def raw_qc_session(session_path, overwrite=False):
+def raw_qc_session(session_path, overwrite=False, n_workers=1):
     """
     Wrapper that exectutes QC from a session folder and outputs the results whithin the same folder
     as the original raw data.
     :param session_path: path of the session (Subject/yyyy-mm-dd/number
     :param overwrite: bool (False) Force means overwriting an existing QC file
+    :param n_workers: (1) number of parallel workers used to compute each rms map
     :return: None
     """
     efiles = spikeglx.glob_ephys_files(session_path)
     qc_files = []
     for efile in efiles:
         if efile.get('ap') and efile.ap.exists():
-            qc_files.extend(extract_rmsmap(efile.ap, out_folder=None, overwrite=overwrite))
+            qc_files.extend(extract_rmsmap(efile.ap, out_folder=None, overwrite=overwrite,
+                                           n_workers=n_workers))
         if efile.get('lf') and efile.lf.exists():
-            qc_files.extend(extract_rmsmap(efile.lf, out_folder=None, overwrite=overwrite))
+            qc_files.extend(extract_rmsmap(efile.lf, out_folder=None, overwrite=overwrite,
+                                           n_workers=n_workers))
     return qc_files
 
 
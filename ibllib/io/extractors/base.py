@@ -51,6 +51,96 @@ class BaseExtractor(abc.ABC):
         pass
 
 
+class BpodSession(object):
+    """
+    Session-scoped cache of the raw Bpod data shared by the trials extractors: the jsonable
+    trials, the settings and the rotary encoder tables are loaded at most once, and the states
+    and events of all trials are gathered into a flat table on first request.
+
+    >>> session = BpodSession(session_path)
+    >>> stim_on = session.states('stim_on')  # (ntrials, 2) first [start, stop] of the state
+    >>> times, trial = session.table.port_events('BNC1')  # BNC1 fronts of all trials
+
+    :param session_path: Absolute path of session folder
+    :param bpod_trials: (optional) bpod trials from jsonable in a list of dictionaries
+    :param settings: (optional) bpod iblrig settings json file in a dictionary
+    """
+
+    def __init__(self, session_path, bpod_trials=None, settings=None):
+        self.session_path = Path(session_path)
+        self._cache = {}
+        if bpod_trials:
+            self._cache['bpod_trials'] = bpod_trials
+        if settings:
+            self._cache['raw_settings'] = settings
+
+    def _cached(self, key, fcn):
+        if key not in self._cache:
+            self._cache[key] = fcn()
+        return self._cache[key]
+
+    @property
+    def bpod_trials(self):
+        return self._cached('bpod_trials', lambda: raw.load_data(self.session_path))
+
+    @property
+    def raw_settings(self):
+        """settings as read from disk, None if there is no settings file"""
+        return self._cached('raw_settings', lambda: raw.load_settings(self.session_path))
+
+    @property
+    def settings(self):
+        """settings with a default version tag when it is missing"""
+        def _settings():
+            settings = self.raw_settings
+            if settings is None:
+                return {'IBLRIG_VERSION_TAG': '100.0.0'}
+            if settings['IBLRIG_VERSION_TAG'] == '':
+                return dict(settings, IBLRIG_VERSION_TAG='100.0.0')
+            return settings
+        return self._cached('settings', _settings)
+
+    @property
+    def ntrials(self):
+        return len(self.bpod_trials)
+
+    # the raw settings are passed so that the loaders detect the file format on a missing tag
+    @property
+    def encoder_positions(self):
+        return self._cached('encoder_positions', lambda: raw.load_encoder_positions(
+            self.session_path, settings=self.raw_settings or False))
+
+    @property
+    def encoder_events(self):
+        return self._cached('encoder_events', lambda: raw.load_encoder_events(
+            self.session_path, settings=self.raw_settings or False))
+
+    @property
+    def table(self):
+        """
+        States and BNC events of all trials as a raw.BpodTrialsTable. The camera Port events
+        make the bulk of the events and are left out.
+        """
+        return self._cached('table', lambda: raw.BpodTrialsTable(
+            self.bpod_trials, events=('BNC1', 'BNC2')))
+
+    def states(self, name):
+        """
+        First [start, stop] of a state for each trial, NaNs if the state wasn't visited
+        :param name: state name, e.g. 'stim_on'
+        :return: np.array (ntrials, 2)
+        """
+        return self._cached(('states', name), lambda: self.table.first_state(name))
+
+    def trial_times(self):
+        """
+        Trial start and end timestamps
+        :return: np.array (ntrials, 2)
+        """
+        return self._cached('trial_times', lambda: np.c_[
+            self.table.trial_start, self.table.trial_end])
+
+
 class BaseBpodTrialsExtractor(BaseExtractor):
     """
     Base (abstract) extractor class for bpod jsonable data set
@@ -60,29 +150,27 @@ class BaseBpodTrialsExtractor(BaseExtractor):
     :type session_path: str
     :param bpod_trials
     :param settings
+    :param session: BpodSession shared with the other extractors of the session
     """
     bpod_trials = None
     settings = None
+    session = None
 
-    def extract(self, bpod_trials=None, settings=None, **kwargs):
+    def extract(self, bpod_trials=None, settings=None, session=None, **kwargs):
         """
         :param: bpod_trials (optional) bpod trials from jsonable in a dictionary
         :param: settings (optional) bpod iblrig settings json file in a dictionary
+        :param: session (optional) BpodSession cache, supersedes bpod_trials and settings
         :param: save (bool) write output ALF files, defaults to False
         :param: path_out (pathlib.Path) output path (defaults to `{session_path}/alf`)
         :return: numpy.ndarray or list of ndarrays, list of filenames
         :rtype: dtype('float64')
         """
-        self.bpod_trials = bpod_trials
-        self.settings = settings
-        if self.bpod_trials is None:
-            self.bpod_trials = raw.load_data(self.session_path)
-        if not self.settings:
-            self.settings = raw.load_settings(self.session_path)
-        if self.settings is None:
-            self.settings = {'IBLRIG_VERSION_TAG': '100.0.0'}
-        elif self.settings['IBLRIG_VERSION_TAG'] == '':
-            self.settings['IBLRIG_VERSION_TAG'] = '100.0.0'
+        if session is None:
+            session = BpodSession(self.session_path, bpod_trials=bpod_trials, settings=settings)
+        self.session = session
+        self.bpod_trials = session.bpod_trials
+        self.settings = session.settings
         return super(BaseBpodTrialsExtractor, self).extract(**kwargs)
 
 
@@ -93,13 +181,22 @@ def run_extractor_classes(classes, session_path=None, **kwargs):
     :param save: True/False
     :param path_out: (defaults to alf path)
     :param kwargs: extractor arguments (session_path...)
+    :param session: (optional) BpodSession, if not provided the Bpod extractors share a new one
     :return: dictionary of arrays, list of files
     """
     files = []
     outputs = OrderedDict({})
     assert session_path
+    # the raw Bpod data is parsed once and shared by all the Bpod extractors
+    session = kwargs.pop('session', None)
     for classe in classes:
-        out, fil = classe(session_path=session_path).extract(**kwargs)
+        if issubclass(classe, BaseBpodTrialsExtractor):
+            if session is None:
+                session = BpodSession(session_path, bpod_trials=kwargs.get('bpod_trials'),
+                                      settings=kwargs.get('settings'))
+            out, fil = classe(session_path=session_path).extract(session=session, **kwargs)
+        else:
+            out, fil = classe(session_path=session_path).extract(**kwargs)
         if isinstance(fil, list):
             files.extend(fil)
         elif fil is not None:
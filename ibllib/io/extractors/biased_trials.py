@@ -1,7 +1,6 @@
-from ibllib.io.extractors.base import BaseBpodTrialsExtractor, run_extractor_classes
+from ibllib.io.extractors.base import BaseBpodTrialsExtractor, BpodSession, run_extractor_classes
 import numpy as np
 
-import ibllib.io.raw_data_loaders as raw
 from ibllib.io.extractors.training_trials import (  # noqa; noqa
     CameraTimestamps, Choice, FeedbackTimes, FeedbackType, GoCueTimes, GoCueTriggerTimes,
     IncludedTrials, Intervals, ItiDuration, ProbabilityLeft, ResponseTimes, RewardVolume,
@@ -25,12 +24,8 @@ class ContrastLR(BaseBpodTrialsExtractor):
 
 
 def extract_all(session_path, save=False, bpod_trials=False, settings=False):
-    if not bpod_trials:
-        bpod_trials = raw.load_data(session_path)
-    if not settings:
-        settings = raw.load_settings(session_path)
-    if settings is None or settings['IBLRIG_VERSION_TAG'] == '':
-        settings = {'IBLRIG_VERSION_TAG': '100.0.0'}
+    session = BpodSession(session_path, bpod_trials=bpod_trials, settings=settings)
+    settings = session.settings
     base = [FeedbackType, ContrastLR, ProbabilityLeft, Choice, RewardVolume,
             FeedbackTimes, StimOnTimes, Intervals, ResponseTimes, GoCueTriggerTimes,
             GoCueTimes, CameraTimestamps]
@@ -40,6 +35,5 @@ def extract_all(session_path, save=False, bpod_trials=False, settings=False):
     else:
         base.append(ItiDuration)
 
-    out, fil = run_extractor_classes(
-        base, save=save, session_path=session_path, bpod_trials=bpod_trials, settings=settings)
+    out, fil = run_extractor_classes(base, save=save, session_path=session_path, session=session)
     return out, fil
@@ -1,7 +1,6 @@
 from collections import OrderedDict
 import logging
 from pathlib import Path, PureWindowsPath
-import uuid
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -91,30 +90,21 @@ def _sync_to_alf(raw_ephys_apfile, output_path=None, save=False, parts=''):
     else:
         raw_ephys_apfile = Path(raw_ephys_apfile)
         sr = spikeglx.Reader(raw_ephys_apfile)
-    # if no output, need a temp folder to swap for big files
     if not output_path:
-        output_path = raw_ephys_apfile.parent
-    file_ftcp = Path(output_path).joinpath(f'fronts_times_channel_polarity{str(uuid.uuid4())}.bin')
-
-    # loop over chunks of the raw ephys file
+        output_path = sr.file_bin.parent
+    # loop over chunks of the raw ephys file, fronts are accumulated in memory
     wg = dsp.WindowGenerator(sr.ns, SYNC_BATCH_SIZE_SAMPLES, overlap=1)
-    fid_ftcp = open(file_ftcp, 'wb')
+    times, channels, polarities = ([], [], [])
     for sl in wg.slice:
-        ss = sr.read_sync(sl)
-        ind, fronts = dsp.fronts(ss, axis=0)
-        # a = sr.read_sync_analog(sl)
-        sav = np.c_[(ind[0, :] + sl.start) / sr.fs, ind[1, :], fronts.astype(np.double)]
-        sav.tofile(fid_ftcp)
+        ind, chans, fronts = sr.read_sync_fronts(sl)
+        times.append((ind + sl.start) / sr.fs)
+        channels.append(chans.astype(np.double))
+        polarities.append(fronts.astype(np.double))
         # print progress
         wg.print_progress()
-    # close temp file, read from it and delete
-    fid_ftcp.close()
-    tim_chan_pol = np.fromfile(str(file_ftcp))
-    tim_chan_pol = tim_chan_pol.reshape((int(tim_chan_pol.size / 3), 3))
-    file_ftcp.unlink()
-    sync = {'times': tim_chan_pol[:, 0],
-            'channels': tim_chan_pol[:, 1],
-            'polarities': tim_chan_pol[:, 2]}
+    sync = {'times': np.concatenate(times),
+            'channels': np.concatenate(channels),
+            'polarities': np.concatenate(polarities)}
     if save:
         out_files = alf.io.save_object_npy(output_path, sync, '_spikeglx_sync', parts=parts)
         return Bunch(sync), out_files
@@ -3,8 +3,7 @@ import cv2
 import numpy as np
 from pkg_resources import parse_version
 
-import ibllib.io.raw_data_loaders as raw
-from ibllib.io.extractors.base import BaseBpodTrialsExtractor, run_extractor_classes
+from ibllib.io.extractors.base import BaseBpodTrialsExtractor, BpodSession, run_extractor_classes
 from ibllib.misc import version
 
 
@@ -29,14 +28,8 @@ class FeedbackType(BaseBpodTrialsExtractor):
     def _extract(self):
         feedbackType = np.empty(len(self.bpod_trials))
         feedbackType.fill(np.nan)
-        reward = []
-        error = []
-        no_go = []
-        for t in self.bpod_trials:
-            reward.append(~np.isnan(t['behavior_data']['States timestamps']['reward'][0][0]))
-            error.append(~np.isnan(t['behavior_data']['States timestamps']['error'][0][0]))
-            no_go.append(~np.isnan(t['behavior_data']['States timestamps']['no_go'][0][0]))
-
+        reward, error, no_go = (~np.isnan(self.session.states(state)[:, 0])
+                                for state in ('reward', 'error', 'no_go'))
         if not all(np.sum([reward, error, no_go], axis=0) == np.ones(len(self.bpod_trials))):
             raise ValueError
 
@@ -94,9 +87,7 @@ class Choice(BaseBpodTrialsExtractor):
     def _extract(self):
         sitm_side = np.array([np.sign(t['position']) for t in self.bpod_trials])
         trial_correct = np.array([t['trial_correct'] for t in self.bpod_trials])
-        trial_nogo = np.array(
-            [~np.isnan(t['behavior_data']['States timestamps']['no_go'][0][0])
-             for t in self.bpod_trials])
+        trial_nogo = ~np.isnan(self.session.states('no_go')[:, 0])
         choice = sitm_side.copy()
         choice[trial_correct] = -choice[trial_correct]
         choice[trial_nogo] = 0
@@ -164,56 +155,44 @@ class FeedbackTimes(BaseBpodTrialsExtractor):
     var_names = 'feedback_times'
 
     @staticmethod
-    def get_feedback_times_lt5(session_path, data=False):
-        if not data:
-            data = raw.load_data(session_path)
-        rw_times = [tr['behavior_data']['States timestamps']['reward'][0][0]
-                    for tr in data]
-        err_times = [tr['behavior_data']['States timestamps']['error'][0][0]
-                     for tr in data]
-        nogo_times = [tr['behavior_data']['States timestamps']['no_go'][0][0]
-                      for tr in data]
-        assert sum(np.isnan(rw_times) &
-                   np.isnan(err_times) & np.isnan(nogo_times)) == 0
-        merge = np.array([np.array(times)[~np.isnan(times)] for times in
-                          zip(rw_times, err_times, nogo_times)]).squeeze()
-
-        return np.array(merge)
+    def get_feedback_times_lt5(session_path, data=False, session=None):
+        if session is None:
+            session = BpodSession(session_path, bpod_trials=data)
+        times = np.stack([session.states(state)[:, 0] for state in ('reward', 'error', 'no_go')],
+                         axis=1)
+        assert np.all(np.any(~np.isnan(times), axis=1))
+        # only one of the 3 states is visited in each trial
+        return times[np.arange(times.shape[0]), np.argmax(~np.isnan(times), axis=1)]
 
     @staticmethod
-    def get_feedback_times_ge5(session_path, data=False):
+    def get_feedback_times_ge5(session_path, data=False, session=None):
         # ger err and no go trig times -- look for BNC2High of trial -- verify
         # only 2 onset times go tone and noise, select 2nd/-1 OR select the one
         # that is grater than the nogo or err trial onset time
-        if not data:
-            data = raw.load_data(session_path)
-        missed_bnc2 = 0
-        rw_times, err_sound_times, merge = [np.zeros([len(data), ]) for _ in range(3)]
-
-        for ind, tr in enumerate(data):
-            st = tr['behavior_data']['Events timestamps'].get('BNC2High', None)
-            if not st:
-                st = np.array([np.nan, np.nan])
-                missed_bnc2 += 1
-            # xonar soundcard duplicates events, remove consecutive events too close together
-            st = np.delete(st, np.where(np.diff(st) < 0.020)[0] + 1)
-            rw_times[ind] = tr['behavior_data']['States timestamps']['reward'][0][0]
-            # get the error sound only if the reward is nan
-            err_sound_times[ind] = st[-1] if st.size >= 2 and np.isnan(rw_times[ind]) else np.nan
-        if missed_bnc2 == len(data):
+        if session is None:
+            session = BpodSession(session_path, bpod_trials=data)
+        st, itrial = session.table.events('BNC2High')
+        if st.size == 0:
             _logger.warning('No BNC2 for feedback times, filling error trials NaNs')
-        merge *= np.nan
-        merge[~np.isnan(rw_times)] = rw_times[~np.isnan(rw_times)]
-        merge[~np.isnan(err_sound_times)] = err_sound_times[~np.isnan(err_sound_times)]
-
+        # xonar soundcard duplicates events, remove consecutive events too close together
+        duplicate = np.r_[False, (np.diff(st) < 0.020) & (np.diff(itrial) == 0)]
+        st, itrial = (st[~duplicate], itrial[~duplicate])
+        # get the error sound only if the reward is nan: the last of at least 2 BNC2 fronts
+        last = np.r_[itrial[1:] != itrial[:-1], True]
+        nfronts = np.bincount(itrial, minlength=session.ntrials)
+        err_sound_times = np.full(session.ntrials, np.nan)
+        err_sound_times[itrial[last]] = st[last]
+        err_sound_times[nfronts < 2] = np.nan
+        rw_times = session.states('reward')[:, 0]
+        merge = np.where(np.isnan(rw_times), err_sound_times, rw_times)
         return merge
 
     def _extract(self):
         # Version check
         if version.ge(self.settings['IBLRIG_VERSION_TAG'], '5.0.0'):
-            merge = self.get_feedback_times_ge5(self.session_path, data=self.bpod_trials)
+            merge = self.get_feedback_times_ge5(self.session_path, session=self.session)
         else:
-            merge = self.get_feedback_times_lt5(self.session_path, data=self.bpod_trials)
+            merge = self.get_feedback_times_lt5(self.session_path, session=self.session)
         return np.array(merge)
 
 
@@ -229,9 +208,7 @@ class Intervals(BaseBpodTrialsExtractor):
     var_names = 'intervals'
 
     def _extract(self):
-        starts = [t['behavior_data']['Trial start timestamp'] for t in self.bpod_trials]
-        ends = [t['behavior_data']['Trial end timestamp'] for t in self.bpod_trials]
-        return np.array([starts, ends]).T
+        return self.session.trial_times().copy()
 
 
 class ResponseTimes(BaseBpodTrialsExtractor):
@@ -245,8 +222,7 @@ class ResponseTimes(BaseBpodTrialsExtractor):
     var_names = 'response_times'
 
     def _extract(self):
-        rt = np.array([tr['behavior_data']['States timestamps']['closed_loop'][0][1]
-                       for tr in self.bpod_trials])
+        rt = self.session.states('closed_loop')[:, 1].copy()
         return rt
 
 
@@ -261,10 +237,8 @@ class ItiDuration(BaseBpodTrialsExtractor):
     var_names = 'iti_dur'
 
     def _extract(self):
-        rt, _ = ResponseTimes(self.session_path).extract(
-            save=False, bpod_trials=self.bpod_trials, settings=self.settings)
-        ends = np.array([t['behavior_data']['Trial end timestamp'] for t in self.bpod_trials])
-        iti_dur = ends - rt
+        rt, _ = ResponseTimes(self.session_path).extract(save=False, session=self.session)
+        iti_dur = self.session.trial_times()[:, 1] - rt
         return iti_dur
 
 
@@ -282,11 +256,9 @@ class GoCueTriggerTimes(BaseBpodTrialsExtractor):
 
     def _extract(self):
         if version.ge(self.settings['IBLRIG_VERSION_TAG'], '5.0.0'):
-            goCue = np.array([tr['behavior_data']['States timestamps']
-                              ['play_tone'][0][0] for tr in self.bpod_trials])
+            goCue = self.session.states('play_tone')[:, 0].copy()
         else:
-            goCue = np.array([tr['behavior_data']['States timestamps']
-                             ['closed_loop'][0][0] for tr in self.bpod_trials])
+            goCue = self.session.states('closed_loop')[:, 0].copy()
         return goCue
 
 
@@ -323,20 +295,10 @@ class GoCueTimes(BaseBpodTrialsExtractor):
     var_names = 'goCue_times'
 
     def _extract(self):
-        go_cue_times = np.zeros([len(self.bpod_trials), ])
-        for ind, tr in enumerate(self.bpod_trials):
-            if raw.get_port_events(tr, 'BNC2'):
-                bnchigh = tr['behavior_data']['Events timestamps'].get('BNC2High', None)
-                if bnchigh:
-                    go_cue_times[ind] = bnchigh[0]
-                    continue
-                bnclow = tr['behavior_data']['Events timestamps'].get('BNC2Low', None)
-                if bnclow:
-                    go_cue_times[ind] = bnclow[0] - 0.1
-                    continue
-                go_cue_times[ind] = np.nan
-            else:
-                go_cue_times[ind] = np.nan
+        # first BNC2 high front, or first low front minus the tone duration if there is none
+        go_cue_times = self.session.table.first_event('BNC2High')
+        bnclow = self.session.table.first_event('BNC2Low') - 0.1
+        go_cue_times[np.isnan(go_cue_times)] = bnclow[np.isnan(go_cue_times)]
 
         nmissing = np.sum(np.isnan(go_cue_times))
         # Check if all stim_syncs have failed to be detected
@@ -385,10 +347,7 @@ class ItiInTimes(BaseBpodTrialsExtractor):
         if parse_version(self.settings["IBLRIG_VERSION_TAG"]) < parse_version("5.0.0"):
             iti_in = np.ones(len(self.bpod_trials)) * np.nan
         else:
-            iti_in = np.array(
-                [tr["behavior_data"]["States timestamps"]
-                 ["exit_state"][0][0] for tr in self.bpod_trials]
-            )
+            iti_in = self.session.states("exit_state")[:, 0].copy()
         return iti_in
 
 
@@ -397,14 +356,9 @@ class ErrorCueTriggerTimes(BaseBpodTrialsExtractor):
     var_names = 'errorCueTrigger_times'
 
     def _extract(self):
-        errorCueTrigger_times = np.zeros(len(self.bpod_trials)) * np.nan
-        for i, tr in enumerate(self.bpod_trials):
-            nogo = tr["behavior_data"]["States timestamps"]["no_go"][0][0]
-            error = tr["behavior_data"]["States timestamps"]["error"][0][0]
-            if np.all(~np.isnan(nogo)):
-                errorCueTrigger_times[i] = nogo
-            elif np.all(~np.isnan(error)):
-                errorCueTrigger_times[i] = error
+        nogo = self.session.states("no_go")[:, 0]
+        error = self.session.states("error")[:, 0]
+        errorCueTrigger_times = np.where(np.isnan(nogo), error, nogo)
         return errorCueTrigger_times
 
 
@@ -415,41 +369,14 @@ class StimFreezeTriggerTimes(BaseBpodTrialsExtractor):
     def _extract(self):
         if parse_version(self.settings["IBLRIG_VERSION_TAG"]) < parse_version("6.2.5"):
             return np.ones(len(self.bpod_trials)) * np.nan
-        freeze_reward = np.array(
-            [
-                True
-                if np.all(~np.isnan(tr["behavior_data"]["States timestamps"]["freeze_reward"][0]))
-                else False
-                for tr in self.bpod_trials
-            ]
-        )
-        freeze_error = np.array(
-            [
-                True
-                if np.all(~np.isnan(tr["behavior_data"]["States timestamps"]["freeze_error"][0]))
-                else False
-                for tr in self.bpod_trials
-            ]
-        )
-        no_go = np.array(
-            [
-                True
-                if np.all(~np.isnan(tr["behavior_data"]["States timestamps"]["no_go"][0]))
-                else False
-                for tr in self.bpod_trials
-            ]
-        )
+        freeze_reward, freeze_error, no_go = (
+            np.all(~np.isnan(self.session.states(state)), axis=1)
+            for state in ("freeze_reward", "freeze_error", "no_go"))
         assert (np.sum(freeze_error) + np.sum(freeze_reward) +
                 np.sum(no_go) == len(self.bpod_trials))
-        stimFreezeTrigger = np.array([])
-        for r, e, n, tr in zip(freeze_reward, freeze_error, no_go, self.bpod_trials):
-            if n:
-                stimFreezeTrigger = np.append(stimFreezeTrigger, np.nan)
-                continue
-            state = "freeze_reward" if r else "freeze_error"
-            stimFreezeTrigger = np.append(
-                stimFreezeTrigger, tr["behavior_data"]["States timestamps"][state][0][0]
-            )
+        stimFreezeTrigger = np.where(freeze_reward, self.session.states("freeze_reward")[:, 0],
+                                     self.session.states("freeze_error")[:, 0])
+        stimFreezeTrigger[no_go] = np.nan
         return stimFreezeTrigger
 
 
@@ -465,17 +392,12 @@ class StimOffTriggerTimes(BaseBpodTrialsExtractor):
         else:
             stim_off_trigger_state = "trial_start"
 
-        stimOffTrigger_times = np.array(
-            [tr["behavior_data"]["States timestamps"][stim_off_trigger_state][0][0]
-             for tr in self.bpod_trials]
-        )
+        stimOffTrigger_times = self.session.states(stim_off_trigger_state)[:, 0].copy()
         # If pre version 5.0.0 no specific nogo Off trigger was given, just return trial_starts
         if stim_off_trigger_state == "trial_start":
             return stimOffTrigger_times
 
-        no_goTrigger_times = np.array(
-            [tr["behavior_data"]["States timestamps"]["no_go"][0][0] for tr in self.bpod_trials]
-        )
+        no_goTrigger_times = self.session.states("no_go")[:, 0]
         # Stim off trigs are either in their own state or in the no_go state if the
         # mouse did not move, if the stim_off_trigger_state always exist
         # (exit_state or trial_start)
@@ -496,9 +418,7 @@ class StimOnTriggerTimes(BaseBpodTrialsExtractor):
 
     def _extract(self):
         # Get the stim_on_state that triggers the onset of the stim
-        stim_on_state = np.array([tr['behavior_data']['States timestamps']
-                                 ['stim_on'][0] for tr in self.bpod_trials])
-        return stim_on_state[:, 0].T
+        return self.session.states('stim_on')[:, 0].copy()
 
 
 class StimOnTimes(BaseBpodTrialsExtractor):
@@ -515,13 +435,13 @@ class StimOnTimes(BaseBpodTrialsExtractor):
         """
         # Version check
         if version.ge(self.settings['IBLRIG_VERSION_TAG'], '5.0.0'):
-            stimOn_times = self.get_stimOn_times_ge5(self.session_path, data=self.bpod_trials)
+            stimOn_times = self.get_stimOn_times_ge5(self.session_path, session=self.session)
         else:
-            stimOn_times = self.get_stimOn_times_lt5(self.session_path, data=self.bpod_trials)
+            stimOn_times = self.get_stimOn_times_lt5(self.session_path, session=self.session)
         return np.array(stimOn_times)
 
     @staticmethod
-    def get_stimOn_times_ge5(session_path, data=False):
+    def get_stimOn_times_ge5(session_path, data=False, session=None):
         """
         Find first and last stim_sync pulse of the trial.
         stimOn_times should be the first after the stim_on state.
@@ -532,23 +452,15 @@ class StimOnTimes(BaseBpodTrialsExtractor):
         Substitute that trial's missing or incorrect value with a NaN.
         return stimOn_times
         """
-        if not data:
-            data = raw.load_data(session_path)
+        if session is None:
+            session = BpodSession(session_path, bpod_trials=data)
         # Get all stim_sync events detected
-        stim_sync_all = [raw.get_port_events(tr, 'BNC1') for tr in data]
-        stim_sync_all = [np.array(x) for x in stim_sync_all]
+        sync, itrial = session.table.port_events('BNC1')
         # Get the stim_on_state that triggers the onset of the stim
-        stim_on_state = np.array([tr['behavior_data']['States timestamps']
-                                 ['stim_on'][0] for tr in data])
-
-        stimOn_times = np.array([])
-        for sync, on, off in zip(
-                stim_sync_all, stim_on_state[:, 0], stim_on_state[:, 1]):
-            pulse = sync[np.where(np.bitwise_and((sync > on), (sync <= off)))]
-            if pulse.size == 0:
-                stimOn_times = np.append(stimOn_times, np.nan)
-            else:
-                stimOn_times = np.append(stimOn_times, pulse)
+        stim_on_state = session.states('stim_on')
+        # first stim_sync pulse within the state
+        pulse = (sync > stim_on_state[itrial, 0]) & (sync <= stim_on_state[itrial, 1])
+        stimOn_times = session.table.first(sync[pulse], itrial[pulse])
 
         nmissing = np.sum(np.isnan(stimOn_times))
         # Check if all stim_syncs have failed to be detected
@@ -562,7 +474,7 @@ class StimOnTimes(BaseBpodTrialsExtractor):
         return stimOn_times
 
     @staticmethod
-    def get_stimOn_times_lt5(session_path, data=False):
+    def get_stimOn_times_lt5(session_path, data=False, session=None):
         """
         Find the time of the statemachine command to turn on hte stim
         (state stim_on start or rotary_encoder_event2)
@@ -570,37 +482,14 @@ class StimOnTimes(BaseBpodTrialsExtractor):
         Screen is not displaying anything until then.
         (Frame changes are in BNC1High and BNC1Low)
         """
-        if not data:
-            data = raw.load_data(session_path)
-        stim_on = []
-        bnc_h = []
-        bnc_l = []
-        for tr in data:
-            stim_on.append(tr['behavior_data']['States timestamps']['stim_on'][0][0])
-            if 'BNC1High' in tr['behavior_data']['Events timestamps'].keys():
-                bnc_h.append(np.array(tr['behavior_data']
-                                      ['Events timestamps']['BNC1High']))
-            else:
-                bnc_h.append(np.array([np.NINF]))
-            if 'BNC1Low' in tr['behavior_data']['Events timestamps'].keys():
-                bnc_l.append(np.array(tr['behavior_data']
-                                      ['Events timestamps']['BNC1Low']))
-            else:
-                bnc_l.append(np.array([np.NINF]))
-
-        stim_on = np.array(stim_on)
-        bnc_h = np.array(bnc_h)
-        bnc_l = np.array(bnc_l)
-
-        count_missing = 0
-        stimOn_times = np.zeros_like(stim_on)
-        for i in range(len(stim_on)):
-            hl = np.sort(np.concatenate([bnc_h[i], bnc_l[i]]))
-            stot = hl[hl > stim_on[i]]
-            if np.size(stot) == 0:
-                stot = np.array([np.nan])
-                count_missing += 1
-            stimOn_times[i] = stot[0]
+        if session is None:
+            session = BpodSession(session_path, bpod_trials=data)
+        stim_on = session.states('stim_on')[:, 0]
+        # first BNC1 front (high or low) after the stim_on state start
+        fronts, itrial = session.table.port_events('BNC1')
+        after = fronts > stim_on[itrial]
+        stimOn_times = session.table.first(fronts[after], itrial[after])
+        count_missing = np.sum(np.isnan(stimOn_times))
 
         if np.all(np.isnan(stimOn_times)):
             _logger.error(f'{session_path}: Missing ALL BNC1 stimulus ({count_missing} trials')
@@ -620,27 +509,16 @@ class StimOnOffFreezeTimes(BaseBpodTrialsExtractor):
     var_names = ['stimOn_times', 'stimOff_times', 'stimFreeze_times']
 
     def _extract(self):
-        choice = Choice(self.session_path).extract(
-            bpod_trials=self.bpod_trials, settings=self.settings, save=False
-        )[0]
-        f2TTL = [raw.get_port_events(tr, name="BNC1") for tr in self.bpod_trials]
-
-        stimOn_times = np.array([])
-        stimOff_times = np.array([])
-        stimFreeze_times = np.array([])
-        for tr in f2TTL:
-            if tr and len(tr) == 2:
-                stimOn_times = np.append(stimOn_times, tr[0])
-                stimOff_times = np.append(stimOff_times, tr[-1])
-                stimFreeze_times = np.append(stimFreeze_times, np.nan)
-            elif tr and len(tr) >= 3:
-                stimOn_times = np.append(stimOn_times, tr[0])
-                stimOff_times = np.append(stimOff_times, tr[-1])
-                stimFreeze_times = np.append(stimFreeze_times, tr[-2])
-            else:
-                stimOn_times = np.append(stimOn_times, np.nan)
-                stimOff_times = np.append(stimOff_times, np.nan)
-                stimFreeze_times = np.append(stimFreeze_times, np.nan)
+        choice = Choice(self.session_path).extract(session=self.session, save=False)[0]
+        f2TTL, itrial = self.session.table.port_events("BNC1")
+        # first, last and second to last fronts of the trials with at least 2 fronts
+        nfronts = np.bincount(itrial, minlength=self.session.ntrials)
+        ilast = np.cumsum(nfronts) - 1
+        stimOn_times, stimOff_times, stimFreeze_times = (
+            np.full(self.session.ntrials, np.nan) for _ in range(3))
+        stimOn_times[nfronts >= 2] = f2TTL[(ilast - nfronts + 1)[nfronts >= 2]]
+        stimOff_times[nfronts >= 2] = f2TTL[ilast[nfronts >= 2]]
+        stimFreeze_times[nfronts >= 3] = f2TTL[ilast[nfronts >= 3] - 1]
 
         # In no_go trials no stimFreeze happens jsut stim Off
         stimFreeze_times[choice == 0] = np.nan
@@ -743,12 +621,8 @@ class CameraTimestamps(BaseBpodTrialsExtractor):
 
 
 def extract_all(session_path, save=False, bpod_trials=False, settings=False):
-    if not bpod_trials:
-        bpod_trials = raw.load_data(session_path)
-    if not settings:
-        settings = raw.load_settings(session_path)
-    if settings is None or settings['IBLRIG_VERSION_TAG'] == '':
-        settings = {'IBLRIG_VERSION_TAG': '100.0.0'}
+    session = BpodSession(session_path, bpod_trials=bpod_trials, settings=settings)
+    settings = session.settings
 
     base = [FeedbackType, ContrastLR, ProbabilityLeft, Choice, RepNum, RewardVolume,
             FeedbackTimes, StimOnTimes, Intervals, ResponseTimes, GoCueTriggerTimes,
@@ -759,6 +633,5 @@ def extract_all(session_path, save=False, bpod_trials=False, settings=False):
     else:
         base.extend([IncludedTrials, ItiDuration])
 
-    out, fil = run_extractor_classes(
-        base, save=save, session_path=session_path, bpod_trials=bpod_trials, settings=settings)
+    out, fil = run_extractor_classes(base, save=save, session_path=session_path, session=session)
     return out, fil
@@ -31,7 +31,7 @@ def get_trial_start_times(session_path, data=None):
 def sync_rotary_encoder(session_path, bpod_data=None, re_events=None):
     if not bpod_data:
         bpod_data = raw.load_data(session_path)
-    evt = re_events or raw.load_encoder_events(session_path)
+    evt = re_events if re_events is not None else raw.load_encoder_events(session_path)
     # we work with stim_on (2) and closed_loop (3) states for the synchronization with bpod
     tre = evt.re_ts.values / 1e6  # convert to seconds
     # the first trial on the rotary encoder is a dud
@@ -86,20 +86,24 @@ def sync_rotary_encoder(session_path, bpod_data=None, re_events=None):
     return interpolate.interp1d(re, bp, fill_value="extrapolate")
 
 
-def get_wheel_position(session_path, bp_data=None, display=False):
+def get_wheel_position(session_path, bp_data=None, display=False, re_positions=None,
+                       re_events=None):
     """
     Gets wheel timestamps and position. Position is in radian (constant above for radius is 1)
     mathematical convention.
     :param session_path:
     :param bp_data (optional): bpod trials read from jsonable file
     :param display (optional): (bool)
+    :param re_positions (optional): rotary encoder positions dataframe as per
+     raw.load_encoder_positions
+    :param re_events (optional): rotary encoder events dataframe as per raw.load_encoder_events
     :return: timestamps (np.array)
     :return: positions (np.array)
     """
     status = 0
     if not bp_data:
         bp_data = raw.load_data(session_path)
-    df = raw.load_encoder_positions(session_path)
+    df = re_positions if re_positions is not None else raw.load_encoder_positions(session_path)
     if df is None:
         _logger.error('No wheel data for ' + str(session_path))
         return None, None
@@ -108,13 +112,13 @@ def get_wheel_position(session_path, bp_data=None, display=False):
     data['re_ts'] = df.re_ts.values
     data['re_pos'] = df.re_pos.values * -1  # anti-clockwise is positive in our output
     data['re_pos'] = data['re_pos'] / 1024 * 2 * np.pi  # convert positions to radians
-    trial_starts = get_trial_start_times(session_path)
+    trial_starts = get_trial_start_times(session_path, data=bp_data)
     # need a flag if the data resolution is 1ms due to the old version of rotary encoder firmware
     if np.all(np.mod(data['re_ts'], 1e3) == 0):
         status = 1
     data['re_ts'] = data['re_ts'] / 1e6  # convert ts to seconds
     # # get the converter function to translate re_ts into behavior times
-    re2bpod = sync_rotary_encoder(session_path)
+    re2bpod = sync_rotary_encoder(session_path, bpod_data=bp_data, re_events=re_events)
     data['re_ts'] = re2bpod(data['re_ts'])
 
     def get_reset_trace_compensation_with_state_machine_times():
@@ -209,7 +213,7 @@ def get_wheel_position(session_path, bp_data=None, display=False):
         import matplotlib.pyplot as plt
         plt.figure()
         ax = plt.axes()
-        tstart = get_trial_start_times(session_path)
+        tstart = get_trial_start_times(session_path, data=bp_data)
         tts = np.c_[tstart, tstart, tstart + np.nan].flatten()
         vts = np.c_[tstart * 0 + 100, tstart * 0 - 100, tstart + np.nan].flatten()
         ax.plot(tts, vts, label='Trial starts')
@@ -366,14 +370,16 @@ class Wheel(BaseBpodTrialsExtractor):
                  'wheel_moves_peak_amplitude', 'firstMovement_times')
 
     def _extract(self):
-        ts, pos = get_wheel_position(self.session_path, self.bpod_trials)
+        ts, pos = get_wheel_position(self.session_path, self.bpod_trials,
+                                     re_positions=self.session.encoder_positions,
+                                     re_events=self.session.encoder_events)
         moves = extract_wheel_moves(ts, pos)
 
         # need some trial based info to output the first movement times
         goCue_times, _ = training_trials.GoCueTimes(self.session_path).extract(
-            save=False, bpod_trials=self.bpod_trials, settings=self.settings)
+            save=False, session=self.session)
         feedback_times, _ = training_trials.FeedbackTimes(self.session_path).extract(
-            save=False, bpod_trials=self.bpod_trials, settings=self.settings)
+            save=False, session=self.session)
         trials = {'goCue_times': goCue_times, 'feedback_times': feedback_times}
         min_qt = self.settings.get('QUIESCENT_PERIOD', None)
 
@@ -1,10 +1,22 @@
+import concurrent.futures
+import contextlib
 import hashlib
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
-BUF_SIZE = 2 ** 28  # 256 megs
+_logger = logging.getLogger('ibllib')
+
+BUF_SIZE = 2 ** 24  # 16 megs, 3 buffers are in flight between the reader thread and the hashers
+HASH_N_WORKERS = 4  # number of files hashed concurrently by md5_files
 
 
 def md5(file_path):
@@ -12,7 +24,7 @@ def md5(file_path):
     Computes md5 hash in a memory reasoned way
     md5hash = hashfile.md5(file_path)
     """
-    return _hash_file(file_path, hashlib.md5())
+    return digests(file_path, algorithms=('md5',))['md5']
 
 
 def sha1(file_path):
@@ -20,21 +32,295 @@ def sha1(file_path):
     Computes sha1 hash in a memory reasoned way
     md5hash = hashfile.sha1(file_path)
     """
-    return _hash_file(file_path, hashlib.sha1())
+    return digests(file_path, algorithms=('sha1',))['sha1']
+
+
+def md5_files(file_list, n_workers=HASH_N_WORKERS, max_size=None):
+    """
+    Computes the md5 hashes of a list of files, several files being read concurrently.
+    Hashing releases the GIL so that the throughput scales with threads until the disk saturates
+    md5hashes = hashfile.md5_files(file_list, max_size=1024 ** 3)
+    :param file_list: list of files
+    :param n_workers: [4] maximum number of files hashed concurrently
+    :param max_size: (optional) files of this size in bytes and above are not hashed (None)
+    :return: list of md5 hashes in the order of the input list
+    """
+    def _md5(file_path):
+        if max_size and Path(file_path).stat().st_size >= max_size:
+            return
+        return md5(file_path)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        return list(executor.map(_md5, file_list))
+
+
+def digests(file_path, algorithms=('md5', 'sha1'), chunk_size=None, progress_bar=None):
+    """
+    Computes several digests of a file reading it only once. A reader thread feeds the buffers
+    to the hashers so that disk reads and hashing overlap.
+    out = hashfile.digests(file_path, algorithms=('md5', 'sha1'), chunk_size=2 ** 26)
+    out['md5'], out['sha1']
+    :param file_path: file to hash
+    :param algorithms: names of hashlib algorithms, defaults to ('md5', 'sha1')
+    :param chunk_size: (optional) if specified, the md5 of each consecutive chunk of chunk_size
+     bytes is output in out['chunks'], allowing partial verification with `verify_chunks`
+    :param progress_bar: (None) if None, displays a progress bar only for files above 512 Mo
+    :return: dictionary algorithm: hexdigest, plus 'chunks' and the 'throughput' in bytes/sec
+    """
+    hashers = {alg: hashlib.new(alg) for alg in algorithms}
+    if chunk_size:
+        chunker = _ChunkHasher(chunk_size)
+        hashers['chunks'] = chunker
+    t0 = time.time()
+    nbytes = _hash_file(file_path, list(hashers.values()), progress_bar=progress_bar)
+    elapsed = time.time() - t0
+    out = {alg: h.hexdigest() for alg, h in hashers.items() if alg != 'chunks'}
+    if chunk_size:
+        out['chunks'] = chunker.hexdigests()
+    out['throughput'] = nbytes / elapsed if elapsed else float('inf')
+    _logger.debug(f"{file_path}: {nbytes / 2 ** 20:.0f} Mo hashed at "
+                  f"{out['throughput'] / 2 ** 20:.0f} Mo/s")
+    return out
+
+
+def verify_chunks(file_path, chunks, chunk_size):
+    """
+    Compares the chunk hashes of a file with the ones computed by `digests`
+    :param file_path: file to verify
+    :param chunks: list of chunk md5 hashes, as output by `digests(..., chunk_size=chunk_size)`
+    :param chunk_size: size of the chunks in bytes
+    :return: list of the indices of the chunks that differ. A truncated or longer file
+     mismatches on the trailing chunks
+    """
+    current = digests(file_path, algorithms=(), chunk_size=chunk_size)['chunks']
+    n = max(len(current), len(chunks))
+    return [i for i in range(n) if i >= len(current) or i >= len(chunks) or
+            current[i] != chunks[i]]
+
+
+class _ChunkHasher:
+    """
+    Hash-like object computing the md5 of each consecutive chunk of data
+    """
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self._digests = []
+        self._current = None
+        self._remaining = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data):
+            if not self._remaining:
+                self._flush()
+                self._current = hashlib.md5()
+                self._remaining = self.chunk_size
+            n = min(self._remaining, len(data))
+            self._current.update(data[:n])
+            self._remaining -= n
+            data = data[n:]
+
+    def _flush(self):
+        if self._current is not None:
+            self._digests.append(self._current.hexdigest())
+            self._current = None
+
+    def hexdigests(self):
+        self._flush()
+        self._remaining = 0
+        return self._digests
 
 
-def _hash_file(file_path, hash_obj, progress_bar=None):
+def _hash_file(file_path, hash_objs, progress_bar=None):
+    """
+    Feeds the content of a file to several hash objects, reading from a separate thread
+    :param file_path: file to hash
+    :param hash_objs: list of hash objects
+    :param progress_bar: (None) if None, displays a progress bar only for files above 512 Mo
+    :return: number of bytes read
+    """
     file_path = Path(file_path)
     file_size = file_path.stat().st_size
     # by default prints a progress bar only for files above 512 Mo
     if progress_bar is None:
         progress_bar = file_size > (512 * 1024 * 1024)
-    b = bytearray(BUF_SIZE)
-    mv = memoryview(b)
-    pbar = tqdm(total=np.ceil(file_size / BUF_SIZE), disable=not progress_bar)
-    with open(file_path, 'rb', buffering=0) as f:
-        for n in iter(lambda: f.readinto(mv), 0):
-            hash_obj.update(mv[:n])
+    # no need to allocate the full buffers for small files
+    buf_size = max(min(BUF_SIZE, file_size), 1)
+    free, full = queue.Queue(), queue.Queue()
+    for _ in range(3):
+        free.put(memoryview(bytearray(buf_size)))
+    stop = threading.Event()
+
+    def _read():
+        try:
+            with open(file_path, 'rb', buffering=0) as f:
+                while not stop.is_set():
+                    mv = free.get()
+                    n = f.readinto(mv)
+                    full.put((mv, n))
+                    if n == 0:
+                        return
+        except Exception as e:
+            full.put((e, 0))
+
+    reader = threading.Thread(target=_read, daemon=True)
+    reader.start()
+    # the hashers update concurrently on each buffer as hashlib releases the GIL
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(hash_objs), 1))
+    pbar = tqdm(total=np.ceil(file_size / buf_size), disable=not progress_bar)
+    nbytes = 0
+    try:
+        while True:
+            mv, n = full.get()
+            if isinstance(mv, Exception):
+                raise mv
+            if n == 0:
+                break
+            if len(hash_objs) == 1:
+                hash_objs[0].update(mv[:n])
+            else:
+                list(executor.map(lambda h: h.update(mv[:n]), hash_objs))
+            nbytes += n
+            free.put(mv)
             pbar.update(1)
-    pbar.close()
-    return hash_obj.hexdigest()
+    finally:
+        stop.set()
+        free.put(memoryview(bytearray(1)))  # unblocks the reader if it waits for a buffer
+        reader.join()
+        executor.shutdown()
+        pbar.close()
+    return nbytes
+
+
+class HashIndex:
+    """
+    Persistent index of file md5 hashes. An entry is valid as long as the file size,
+    modification time and inode are unchanged, in which case the file is not read again.
+    hi = HashIndex('/path/to/.hash_index.parquet')
+    md5hash = hi.md5(file_path)
+    hi.save()
+    Within a batch, the saves are deferred to a single save on exiting the outermost batch:
+    with hi.batch():
+        for file_path in file_paths:
+            hi.md5(file_path)
+            hi.save()  # no-op
+    """
+    _columns = ['path', 'size', 'mtime_ns', 'inode', 'md5']
+
+    def __init__(self, index_file=None):
+        """
+        :param index_file: parquet file in which the index is persisted. If None, the index
+         only lives in memory
+        """
+        self.index_file = Path(index_file) if index_file else None
+        self._index = None  # dictionary path: (size, mtime_ns, inode, md5) loaded on first use
+        self._changed = set()  # paths indexed since the last save
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, file_path):
+        return self.get(file_path) is not None
+
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = self._read()
+            return self._index
+
+    def _read(self):
+        """Reads the index persisted on disk, an empty dictionary if there is none"""
+        if not (self.index_file and self.index_file.exists()):
+            return {}
+        df = pd.read_parquet(self.index_file)
+        return {r[0]: tuple(r[1:]) for r in df[self._columns].itertuples(index=False, name=None)}
+
+    @staticmethod
+    def _key(file_path):
+        return str(Path(file_path).absolute())
+
+    @staticmethod
+    def _stat(file_path):
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, file_path):
+        """
+        Returns the indexed md5 of a file, None if the file is not indexed or has changed
+        """
+        rec = self.index.get(self._key(file_path))
+        if rec is None:
+            return
+        try:
+            stat = self._stat(file_path)
+        except FileNotFoundError:
+            return
+        return rec[3] if tuple(rec[:3]) == stat else None
+
+    def set(self, file_path, md5hash):
+        """
+        Indexes the md5 of a file, for example computed while downloading it
+        """
+        stat = self._stat(file_path)
+        with self._lock:
+            self.index[self._key(file_path)] = (*stat, md5hash)
+            self._changed.add(self._key(file_path))
+
+    def md5(self, file_path):
+        """
+        Returns the md5 of a file from the index, hashes and indexes the file on a miss
+        """
+        md5hash = self.get(file_path)
+        if md5hash is None:
+            md5hash = md5(file_path)
+            self.set(file_path, md5hash)
+        return md5hash
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context in which `save` does nothing, the index is saved once on exiting the outermost
+        batch. Batches may be nested and entered from several threads.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+            self.save()
+
+    def save(self):
+        """
+        Writes the index to disk if it changed, stale entries of deleted files are dropped.
+        As several processes may share the index file, the entries changed by this instance are
+        merged into the index on disk, the most recent file modification time wins. The file is
+        written to a unique temporary file first, so that no process reads a partial file.
+        """
+        with self._lock:
+            if not self._changed or self.index_file is None or self._batch_depth > 0:
+                return
+            index = self._read()
+            for k in self._changed:
+                rec = self.index[k]
+                if k not in index or rec[1] >= index[k][1]:
+                    index[k] = rec
+            self._index = {k: v for k, v in index.items() if Path(k).exists()}
+            rows = [(k, *v) for k, v in self._index.items()]
+            df = pd.DataFrame(rows, columns=self._columns).astype(
+                {'size': np.int64, 'mtime_ns': np.int64, 'inode': np.uint64})
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.index_file.parent, suffix='.tmp',
+                                             prefix=self.index_file.name, delete=False) as tmp:
+                tmp_file = Path(tmp.name)
+            try:
+                df.to_parquet(tmp_file)
+                os.replace(tmp_file, self.index_file)
+            finally:
+                if tmp_file.exists():
+                    tmp_file.unlink()
+            self._changed = set()
@@ -1,12 +1,100 @@
 import json
 
+import numpy as np
 
-def read(file):
-    data = []
-    with open(file, 'r') as f:
+
+def _default_decoder():
+    """
+    Uses orjson if installed, falls back on the json module for lines it doesn't decode
+    """
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+
+    def loads(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:  # NaN and Infinity are only accepted by the json module
+            return json.loads(line)
+    return loads
+
+
+# function decoding one line, may be replaced by any callable accepting bytes
+DECODER = _default_decoder()
+
+
+def iterate(file, decoder=None):
+    """
+    Generator yielding the records of a jsonable file one by one, without reading the whole file
+    for trial in jsonable.iterate(file):
+        ...
+    :param file: jsonable file
+    :param decoder: (optional) function decoding a line, defaults to `jsonable.DECODER`
+    """
+    decoder = decoder or DECODER
+    with open(file, 'rb') as f:
         for line in f:
-            data.append(json.loads(line))
-    return data
+            if line.strip():
+                yield decoder(line)
+
+
+def read(file, decoder=None):
+    return list(iterate(file, decoder=decoder))
+
+
+def index(file):
+    """
+    Returns the byte offsets of the records of a jsonable file
+    :param file: jsonable file
+    :return: np.array of int64 offsets, one per record
+    """
+    offsets = []
+    offset = 0
+    with open(file, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    return np.array(offsets, dtype=np.int64)
+
+
+class Reader:
+    """
+    Random access to the records of a jsonable file. The line offsets are indexed on first
+    access, then each record is read and decoded on demand.
+    trials = jsonable.Reader(file)
+    ntrials = len(trials)
+    last_trial = trials[-1]
+    """
+    def __init__(self, file, offsets=None, decoder=None):
+        """
+        :param file: jsonable file
+        :param offsets: (optional) record offsets as returned by `jsonable.index`
+        :param decoder: (optional) function decoding a line, defaults to `jsonable.DECODER`
+        """
+        self.file = file
+        self._offsets = offsets
+        self.decoder = decoder or DECODER
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._offsets = index(self.file)
+        return self._offsets
+
+    def __len__(self):
+        return self.offsets.size
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        with open(self.file, 'rb') as f:
+            f.seek(self.offsets[item])
+            return self.decoder(f.readline())
+
+    def __iter__(self):
+        return iterate(self.file, decoder=self.decoder)
 
 
 def _write(file, data, mode):
@@ -10,6 +10,7 @@ Module contains one loader function per raw datafile
 import json
 import logging
 import wave
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 
@@ -74,6 +75,34 @@ def load_bpod(session_path):
     return load_settings(session_path), load_data(session_path)
 
 
+def _data_file(session_path):
+    if session_path is None:
+        _logger.warning("No data loaded: session_path is None")
+        return
+    path = Path(session_path).joinpath("raw_behavior_data")
+    path = next(path.glob("_iblrig_taskData.raw*.jsonable"), None)
+    if not path:
+        _logger.warning("No data loaded: could not find raw data file")
+    return path
+
+
+def iter_data(session_path, time='absolute'):
+    """
+    Generator yielding the PyBpod trials (.jsonable) one by one, the file is read and decoded
+    as the trials are consumed.
+
+    :param session_path: Absolute path of session folder
+    :type session_path: str
+    :param time: 'absolute' converts the trials timestamps to seconds from session start
+    :return: generator of trial dictionaries
+    """
+    path = _data_file(session_path)
+    if not path:
+        return
+    for trial in jsonable.iterate(path):
+        yield trial_times_to_times(trial) if time == 'absolute' else trial
+
+
 def load_data(session_path, time='absolute'):
     """
     Load PyBpod data files (.jsonable).
@@ -86,18 +115,177 @@ def load_data(session_path, time='absolute'):
     :return: A list of len ntrials each trial being a dictionary
     :rtype: list of dicts
     """
-    if session_path is None:
-        _logger.warning("No data loaded: session_path is None")
-        return
-    path = Path(session_path).joinpath("raw_behavior_data")
-    path = next(path.glob("_iblrig_taskData.raw*.jsonable"), None)
+    path = _data_file(session_path)
     if not path:
-        _logger.warning("No data loaded: could not find raw data file")
         return None
-    data = jsonable.read(path)
+    # the timestamps are converted while streaming, the raw trials are never all in memory
     if time == 'absolute':
-        data = [trial_times_to_times(t) for t in data]
-    return data
+        return [trial_times_to_times(t) for t in jsonable.iterate(path)]
+    return jsonable.read(path)
+
+
+class BpodTrialsTable(object):
+    """
+    Flat columnar table of the states and events of Bpod trials, backed by numpy arrays.
+    Each row is one state or event occurrence with columns:
+        trial: trial index (int64)
+        code: state or event name code (int64), see `names` and `is_state`
+        start: start time of the state or event time (float64)
+        stop: stop time of the state, same as start for events (float64)
+    The rows of a given state or event are ordered by trial and by occurrence within the trial.
+
+    >>> table = BpodTrialsTable(load_data(session_path))
+    >>> stim_on = table.first_state('stim_on')  # (ntrials, 2) first [start, stop] per trial
+    >>> times, trial = table.port_events('BNC1')  # BNC1High and BNC1Low fronts
+
+    :param data: iterable of trial dictionaries as per `load_data` or `iter_data`
+    :param convert_times: if True, the trial timestamps are relative to the trial start and
+     are converted to absolute times as per `trial_times_to_times`, see `load_trials_table`
+    :param events: (optional) only keep the events whose name contains one of these strings,
+     defaults to all events. States are always kept.
+    """
+
+    def __init__(self, data, convert_times=False, events=None):
+        codes = {}
+        # event names are checked against the filter only once
+        keep = None if events is None else {}
+        # one block of rows per trial and state or event name: code, trial, size, times
+        blocks = {True: ([], [], [], []), False: ([], [], [], [])}
+        trial_times = []
+        for i, tr in enumerate(data):
+            bd = tr['behavior_data']
+            trial_times.append([bd['Trial start timestamp'], bd['Trial end timestamp'],
+                                bd['Bpod start timestamp']])
+            for is_state, key in ((True, 'States timestamps'), (False, 'Events timestamps')):
+                code, trial, size, times = blocks[is_state]
+                for name, t in bd[key].items():
+                    if not is_state and keep is not None and not keep.setdefault(
+                            name, any(e in name for e in events)):
+                        continue
+                    code.append(codes.setdefault((name, is_state), len(codes)))
+                    trial.append(i)
+                    size.append(len(t))
+                    times.extend(t)
+        columns = []
+        for is_state, (code, trial, size, times) in blocks.items():
+            times = np.array(times, dtype=np.float64).reshape(-1, 2 if is_state else 1)
+            columns.append((np.repeat(np.array(code, dtype=np.int64), size),
+                            np.repeat(np.array(trial, dtype=np.int64), size),
+                            times[:, 0], times[:, -1]))
+        self.code, self.trial, self.start, self.stop = (np.concatenate(c) for c in zip(*columns))
+        self.names = [k[0] for k in codes]
+        self.is_state = np.array([k[1] for k in codes], dtype=bool)
+        self._codes = codes
+        trial_times = np.array(trial_times, dtype=np.float64).reshape(-1, 3)
+        if convert_times:
+            # same operations order as trial_times_to_times for bitwise identical results
+            for col in (self.start, self.stop):
+                col += trial_times[self.trial, 0]
+                col -= trial_times[self.trial, 2]
+            trial_times[:, :2] -= trial_times[:, 2:]
+        self.trial_start, self.trial_end = (trial_times[:, 0], trial_times[:, 1])
+        # rows of each code, ordered by trial and occurrence
+        self._order = np.argsort(self.code, kind='stable')
+        self._bounds = np.searchsorted(self.code[self._order], np.arange(len(codes) + 1))
+
+    def __len__(self):
+        return self.code.size
+
+    @property
+    def ntrials(self):
+        return self.trial_start.size
+
+    def rows(self, name, state=True):
+        """
+        Indices of the rows of a state or an event, ordered by trial and occurrence
+        :param name: state or event name
+        :param state: True for a state, False for an event
+        :return: np.array of int64 row indices (empty if the name is not found)
+        """
+        c = self._codes.get((name, state), None)
+        if c is None:
+            return np.array([], dtype=np.int64)
+        return self._order[self._bounds[c]:self._bounds[c + 1]]
+
+    def first(self, values, trial):
+        """
+        First value for each trial, NaN for the trials without values
+        :param values: np.array of values ordered by trial
+        :param trial: np.array of the trial indices of the values
+        :return: np.array (ntrials, ) or (ntrials, ...)
+        """
+        out = np.full((self.ntrials,) + values.shape[1:], np.nan)
+        itr, i0 = np.unique(trial, return_index=True)
+        out[itr] = values[i0]
+        return out
+
+    def split(self, values, trial):
+        """
+        Splits values ordered by trial into a list of arrays, one per trial
+        """
+        return np.split(values, np.cumsum(np.bincount(trial, minlength=self.ntrials))[:-1])
+
+    def states(self, name):
+        """
+        All occurrences of a state
+        :param name: state name
+        :return: (start, stop, trial) np.arrays
+        """
+        r = self.rows(name, state=True)
+        return self.start[r], self.stop[r], self.trial[r]
+
+    def first_state(self, name):
+        """
+        First [start, stop] of a state for each trial, NaNs if the state wasn't visited
+        :param name: state name
+        :return: np.array (ntrials, 2)
+        """
+        r = self.rows(name, state=True)
+        return self.first(np.c_[self.start[r], self.stop[r]], self.trial[r])
+
+    def events(self, name):
+        """
+        All occurrences of an event
+        :param name: exact event name, e.g. 'BNC1High'
+        :return: (times, trial) np.arrays
+        """
+        r = self.rows(name, state=False)
+        return self.start[r], self.trial[r]
+
+    def first_event(self, name):
+        """
+        First occurrence of an event for each trial, NaN where the event didn't happen
+        :param name: exact event name
+        :return: np.array (ntrials, )
+        """
+        return self.first(*self.events(name))
+
+    def port_events(self, name):
+        """
+        Occurrences of all the events containing `name`, sorted in time within each trial, as
+        per `get_port_events`
+        :param name: event name pattern, e.g. 'BNC1'
+        :return: (times, trial) np.arrays
+        """
+        r = np.concatenate([self.rows(n, state=False) for n, s in self._codes
+                            if not s and name in n] + [np.array([], dtype=np.int64)])
+        r = r[np.lexsort((self.start[r], self.trial[r]))]
+        return self.start[r], self.trial[r]
+
+
+def load_trials_table(session_path):
+    """
+    Load the states and events of the PyBpod data file (.jsonable) into a BpodTrialsTable,
+    with timestamps in seconds from session start. The trials are streamed from the file and the
+    times converted for all trials at once.
+
+    :param session_path: Absolute path of session folder
+    :return: BpodTrialsTable
+    """
+    path = _data_file(session_path)
+    if not path:
+        return None
+    return BpodTrialsTable(jsonable.iterate(path), convert_times=True)
 
 
 def load_settings(session_path):
@@ -136,7 +324,7 @@ def load_stim_position_screen(session_path):
     return data
 
 
-def load_encoder_events(session_path, settings=False):
+def load_encoder_events(session_path, settings=False, cache=False):
     """
     Load Rotary Encoder (RE) events raw data file.
 
@@ -156,6 +344,7 @@ def load_encoder_events(session_path, settings=False):
 
     :param session_path: [description]
     :type session_path: [type]
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe w/ 3 cols and (ntrials * 3) lines
     :rtype: Pandas.DataFrame
     """
@@ -175,68 +364,182 @@ def load_encoder_events(session_path, settings=False):
     if not path:
         return None
     if version.ge(settings['IBLRIG_VERSION_TAG'], '5.0.0'):
-        return _load_encoder_events_file_ge5(path)
+        return _load_encoder_events_file_ge5(path, cache=cache)
     else:
-        return _load_encoder_events_file_lt5(path)
-
-
-def _load_encoder_ssv_file(file_path, **kwargs):
+        return _load_encoder_events_file_lt5(path, cache=cache)
+
+
+def _ssv_int_tokens(buf, start, end):
+    """
+    Parses integer tokens from a bytes buffer
+    :param buf: np.uint8 buffer
+    :param start: token starts indices
+    :param end: token ends indices (excluded)
+    :return: np.int64 values, np.bool valid tokens
+    """
+    neg = (end > start) & (buf[np.minimum(start, buf.size - 1)] == ord('-'))
+    start = start + neg
+    # tokens longer than 18 digits would overflow int64
+    ok = (end > start) & (end - start <= 18)
+    width = int(np.max(end[ok] - start[ok], initial=1))
+    # tokens are right aligned and parsed one digit column at a time, left padded with zeros
+    values = np.zeros(start.size, dtype=np.int64)
+    for i in range(width):
+        pos = end - width + i
+        inside = pos >= start
+        # the uint8 subtraction wraps around for characters below '0'
+        digits = (buf[np.maximum(pos, 0)] - np.uint8(ord('0'))) * inside
+        ok &= digits <= 9
+        values *= 10
+        values += digits
+    values[neg] *= -1
+    return values, ok
+
+
+def _ssv_str_tokens(buf, start, end):
+    """
+    Extracts tokens from a bytes buffer into a fixed width bytes array
+    :param buf: np.uint8 buffer
+    :param start: token starts indices
+    :param end: token ends indices (excluded)
+    :return: np.array of bytes
+    """
+    length = end - start
+    ichar = np.arange(max(int(length.max(initial=0)), 1))
+    chars = buf[np.minimum(start[:, np.newaxis] + ichar, buf.size - 1)]
+    chars[ichar >= length[:, np.newaxis]] = 0
+    return chars.view(f'S{ichar.size}').ravel()
+
+
+def _load_encoder_ssv_file(file_path, names, usecols, str_cols=('bns_ts',)):
+    """
+    Parses a space separated rotary encoder file (.ssv) into numpy arrays. As for the pandas
+    parser, the extra fields of a line beyond `names` are ignored and blank lines are skipped.
+    The lines with missing or non-integer values are corrupt and skipped.
+    :param file_path: .ssv file
+    :param names: names of the space separated fields of a line
+    :param usecols: names of the fields to keep
+    :param str_cols: fields kept as bytes, the other fields are parsed as int64
+    :return: dictionary of np.arrays, number of corrupt lines. The 'index' array is the row
+     number of each record in the file, not counting blank lines
+    """
     file_path = Path(file_path)
     if file_path.stat().st_size == 0:
         _logger.error(f"{file_path.name} is an empty file. ")
         raise ValueError(f"{file_path.name} is an empty file. ABORT EXTRACTION. ")
-    return pd.read_csv(file_path, sep=' ', header=None, error_bad_lines=False, **kwargs)
+    buf = np.fromfile(file_path, dtype=np.uint8)
+    if np.any(buf == ord('\r')):
+        buf = buf[buf != ord('\r')]
+    buf = np.r_[buf, np.uint8(ord('\n'))]
+    # tokens are delimited by spaces and line ends
+    is_eol = buf == ord('\n')
+    seps = np.flatnonzero(is_eol | (buf == ord(' ')))
+    tok_start, tok_end = (np.r_[0, seps[:-1] + 1], seps)
+    ieol = np.flatnonzero(is_eol[seps])
+    # number of tokens and first token of each line
+    ntok = np.diff(np.r_[-1, ieol])
+    first = ieol - ntok + 1
+    blank = (ntok == 1) & (tok_start[first] == tok_end[first])
+    valid = ~blank
+    data = OrderedDict([('index', np.cumsum(valid) - 1)])
+    for name in usecols:
+        k = names.index(name)
+        itok = first[ntok > k] + k
+        if name in str_cols:
+            values = _ssv_str_tokens(buf, tok_start[itok], tok_end[itok])
+            ok = tok_end[itok] > tok_start[itok]
+        else:
+            values, ok = _ssv_int_tokens(buf, tok_start[itok], tok_end[itok])
+        data[name] = np.zeros(ntok.size, dtype=values.dtype)
+        data[name][ntok > k] = values
+        valid[ntok <= k] = False
+        valid[ntok > k] &= ok
+    # the last line is always blank as a line end was appended
+    ncorrupt = int(np.sum(~valid & ~blank))
+    return OrderedDict((k, v[valid]) for k, v in data.items()), ncorrupt
 
 
-def _load_encoder_positions_file_lt5(file_path):
+def _load_encoder_file(file_path, names, usecols, groom, label, cache=False):
+    """
+    Loads and grooms a rotary encoder file into a dataframe.
+    :param cache: if True, the groomed data is saved in a binary .npy sidecar next to the
+     .ssv file, and read from there on subsequent calls as long as the .ssv file is not modified
+    """
+    file_path = Path(file_path)
+    cache_file = file_path.with_name(file_path.name + '.npy')
+    data = None
+    if (cache and cache_file.exists() and
+            cache_file.stat().st_mtime_ns >= file_path.stat().st_mtime_ns):
+        data = np.load(cache_file)
+        # sidecars written before the row index was kept are re-created
+        data = OrderedDict((k, data[k]) for k in data.dtype.names) \
+            if 'index' in data.dtype.names else None
+    if data is None:
+        data, ncorrupt = _load_encoder_ssv_file(file_path, names=names, usecols=usecols)
+        if data['re_ts'].size == 0:
+            raise ValueError(f"{file_path.name} has no valid records. ABORT EXTRACTION. ")
+        if ncorrupt:
+            _logger.warning(label + ' has missing/incomplete records \n %s', file_path)
+        data = groom(data, label=label, path=file_path)
+        if cache:
+            tmp_file = cache_file.with_name(cache_file.name + '.part')
+            with open(tmp_file, 'wb') as fid:
+                np.save(fid, np.rec.fromarrays(list(data.values()), names=list(data.keys())))
+            tmp_file.replace(cache_file)
+    if 'bns_ts' in data:
+        data['bns_ts'] = data['bns_ts'].astype(str)
+    return pd.DataFrame(data)
+
+
+def _load_encoder_positions_file_lt5(file_path, cache=False):
     """
     File loader without the session overhead
     :param file_path:
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe of encoder events
     """
-    data = _load_encoder_ssv_file(file_path,
-                                  names=['_', 're_ts', 're_pos', 'bns_ts', '__'],
-                                  usecols=['re_ts', 're_pos', 'bns_ts'])
-    return _groom_wheel_data_lt5(data, label='_iblrig_encoderPositions.raw.ssv', path=file_path)
+    return _load_encoder_file(file_path, names=['_', 're_ts', 're_pos', 'bns_ts', '__'],
+                              usecols=['re_ts', 're_pos', 'bns_ts'], groom=_groom_wheel_data_lt5,
+                              label='_iblrig_encoderPositions.raw.ssv', cache=cache)
 
 
-def _load_encoder_positions_file_ge5(file_path):
+def _load_encoder_positions_file_ge5(file_path, cache=False):
     """
     File loader without the session overhead
     :param file_path:
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe of encoder events
     """
-    data = _load_encoder_ssv_file(file_path,
-                                  names=['re_ts', 're_pos', '_'],
-                                  usecols=['re_ts', 're_pos'])
-    return _groom_wheel_data_ge5(data, label='_iblrig_encoderPositions.raw.ssv', path=file_path)
+    return _load_encoder_file(file_path, names=['re_ts', 're_pos', '_'],
+                              usecols=['re_ts', 're_pos'], groom=_groom_wheel_data_ge5,
+                              label='_iblrig_encoderPositions.raw.ssv', cache=cache)
 
 
-def _load_encoder_events_file_lt5(file_path):
+def _load_encoder_events_file_lt5(file_path, cache=False):
     """
     File loader without the session overhead
     :param file_path:
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe of encoder events
     """
-    data = _load_encoder_ssv_file(file_path,
-                                  names=['_', 're_ts', '__', 'sm_ev', 'bns_ts', '___'],
-                                  usecols=['re_ts', 'sm_ev', 'bns_ts'])
-    return _groom_wheel_data_lt5(data, label='_iblrig_encoderEvents.raw.ssv', path=file_path)
+    return _load_encoder_file(file_path, names=['_', 're_ts', '__', 'sm_ev', 'bns_ts', '___'],
+                              usecols=['re_ts', 'sm_ev', 'bns_ts'], groom=_groom_wheel_data_lt5,
+                              label='_iblrig_encoderEvents.raw.ssv', cache=cache)
 
 
-def _load_encoder_events_file_ge5(file_path):
+def _load_encoder_events_file_ge5(file_path, cache=False):
     """
     File loader without the session overhead
     :param file_path:
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe of encoder events
     """
-    data = _load_encoder_ssv_file(file_path,
-                                  names=['re_ts', 'sm_ev', '_'],
-                                  usecols=['re_ts', 'sm_ev'])
-    return _groom_wheel_data_ge5(data, label='_iblrig_encoderEvents.raw.ssv', path=file_path)
+    return _load_encoder_file(file_path, names=['re_ts', 'sm_ev', '_'],
+                              usecols=['re_ts', 'sm_ev'], groom=_groom_wheel_data_ge5,
+                              label='_iblrig_encoderEvents.raw.ssv', cache=cache)
 
 
-def load_encoder_positions(session_path, settings=False):
+def load_encoder_positions(session_path, settings=False, cache=False):
     """
     Load Rotary Encoder (RE) positions from raw data file within a session path.
 
@@ -260,6 +563,7 @@ def load_encoder_positions(session_path, settings=False):
 
     :param session_path: Absolute path of session folder
     :type session_path: str
+    :param cache: (False) keep a binary sidecar of the groomed data for subsequent loads
     :return: dataframe w/ 3 cols and N positions
     :rtype: Pandas.DataFrame
     """
@@ -280,9 +584,9 @@ def load_encoder_positions(session_path, settings=False):
         _logger.warning("No data loaded: could not find raw encoderPositions file")
         return None
     if version.ge(settings['IBLRIG_VERSION_TAG'], '5.0.0'):
-        return _load_encoder_positions_file_ge5(path)
+        return _load_encoder_positions_file_ge5(path, cache=cache)
     else:
-        return _load_encoder_positions_file_lt5(path)
+        return _load_encoder_positions_file_lt5(path, cache=cache)
 
 
 def load_encoder_trial_info(session_path):
@@ -350,11 +654,7 @@ def load_ambient_sensor(session_path):
     path = next(path.glob("_iblrig_ambientSensorData.raw*.jsonable"), None)
     if not path:
         return None
-    data = []
-    with open(path, 'r') as f:
-        for line in f:
-            data.append(json.loads(line))
-    return data
+    return jsonable.read(path)
 
 
 def load_mic(session_path):
@@ -381,46 +681,47 @@ def load_mic(session_path):
     return data
 
 
-def _clean_wheel_dataframe(data, label, path):
-    if np.any(data.isna()):
-        _logger.warning(label + ' has missing/incomplete records \n %s', path)
-    # first step is to re-interpret as numeric objects if not already done
-    for col in data.columns:
-        if data[col].dtype == np.object and col not in ['bns_ts']:
-            data[col] = pd.to_numeric(data[col], errors='coerce')
-    # then drop Nans and duplicates
-    data.dropna(inplace=True)
-    data.drop_duplicates(keep='first', inplace=True)
-    data.reset_index(inplace=True)
+def _clean_wheel_data(data, label, path):
+    """
+    Removes duplicates and fixes the timestamps of the encoder data
+    :param data: dictionary of np.arrays as read by `_load_encoder_ssv_file`
+    :return: dictionary of np.arrays, with re_ts as float64
+    """
+    # drop duplicate records, keep the first occurrence. The row index is not a field
+    fields = [v for k, v in data.items() if k != 'index']
+    order = np.lexsort(fields[::-1])
+    dup = np.zeros(order.size, dtype=bool)
+    dup[1:] = np.all([v[order][1:] == v[order][:-1] for v in fields], axis=0)
+    keep = np.sort(order[~dup])
+    data = OrderedDict((k, v[keep]) for k, v in data.items())
     # handle the clock resets when microseconds exceed uint32 max value
     drop_first = False
-    data['re_ts'] = data['re_ts'].astype(np.double, copy=False)
-    if any(np.diff(data['re_ts']) < 0):
-        ind = np.where(np.diff(data['re_ts']) < 0)[0]
-        for i in ind:
-            # the first sample may be corrupt, in this case throw away
-            if i <= 1:
-                drop_first = i
-                _logger.warning(label + ' rotary encoder positions timestamps'
-                                        ' first sample corrupt ' + str(path))
-            # if it's an uint32 wraparound, the diff should be close to 2 ** 32
-            elif 32 - np.log2(data['re_ts'][i] - data['re_ts'][i + 1]) < 0.2:
-                data.loc[i + 1:, 're_ts'] = data.loc[i + 1:, 're_ts'] + 2 ** 32
-            # there is also the case where 2 positions are swapped and need to be swapped back
-
-            elif data['re_ts'][i] > data['re_ts'][i + 1] > data['re_ts'][i - 1]:
-                _logger.warning(label + ' rotary encoder timestamps swapped at index: ' +
-                                str(i) + '  ' + str(path))
-                a, b = data.iloc[i].copy(), data.iloc[i + 1].copy()
-                data.iloc[i], data.iloc[i + 1] = b, a
-            # if none of those 3 cases apply, raise an error
-            else:
-                _logger.error(label + ' Rotary encoder timestamps are not sorted.' + str(path))
-                data.sort_values('re_ts', inplace=True)
-                data.reset_index(inplace=True)
+    data['re_ts'] = data['re_ts'].astype(np.double)
+    re_ts = data['re_ts']
+    ind = np.where(np.diff(re_ts) < 0)[0]
+    for i in ind:
+        # the first sample may be corrupt, in this case throw away
+        if i <= 1:
+            drop_first = i
+            _logger.warning(label + ' rotary encoder positions timestamps'
+                                    ' first sample corrupt ' + str(path))
+        # if it's an uint32 wraparound, the diff should be close to 2 ** 32
+        elif 32 - np.log2(re_ts[i] - re_ts[i + 1]) < 0.2:
+            re_ts[i + 1:] += 2 ** 32
+        # there is also the case where 2 positions are swapped and need to be swapped back
+        elif re_ts[i] > re_ts[i + 1] > re_ts[i - 1]:
+            _logger.warning(label + ' rotary encoder timestamps swapped at index: ' +
+                            str(i) + '  ' + str(path))
+            for v in data.values():
+                v[[i, i + 1]] = v[[i + 1, i]]
+        # if none of those 3 cases apply, raise an error
+        else:
+            _logger.error(label + ' Rotary encoder timestamps are not sorted.' + str(path))
+            isort = np.argsort(re_ts)
+            for v in data.values():
+                v[:] = v[isort]
     if drop_first is not False:
-        data.drop(data.loc[:drop_first].index, inplace=True)
-        data = data.reindex()
+        data = OrderedDict((k, v[drop_first + 1:]) for k, v in data.items())
     return data
 
 
@@ -430,12 +731,14 @@ def _groom_wheel_data_lt5(data, label='file ', path=''):
     the wheel position files. There are many possible errors described below, but
     nothing excludes getting new ones.
     """
-    data = _clean_wheel_dataframe(data, label, path)
-    data.drop(data.loc[data.bns_ts.apply(len) != 33].index, inplace=True)
+    data = _clean_wheel_data(data, label, path)
+    keep = np.char.str_len(data['bns_ts']) == 33
+    data = OrderedDict((k, v[keep]) for k, v in data.items())
     # check if the time scale is in ms
-    sess_len_sec = (datetime.strptime(data['bns_ts'].iloc[-1][:25], '%Y-%m-%dT%H:%M:%S.%f') -
-                    datetime.strptime(data['bns_ts'].iloc[0][:25], '%Y-%m-%dT%H:%M:%S.%f')).seconds
-    if data['re_ts'].iloc[-1] / (sess_len_sec + 1e-6) < 1e5:  # should be 1e6 normally
+    bns_ts = [b[:25].decode() for b in data['bns_ts'][[0, -1]]]
+    sess_len_sec = (datetime.strptime(bns_ts[1], '%Y-%m-%dT%H:%M:%S.%f') -
+                    datetime.strptime(bns_ts[0], '%Y-%m-%dT%H:%M:%S.%f')).seconds
+    if data['re_ts'][-1] / (sess_len_sec + 1e-6) < 1e5:  # should be 1e6 normally
         _logger.warning('Rotary encoder reset logs events in ms instead of us: ' +
                         'RE firmware needs upgrading and wheel velocity is potentially inaccurate')
         data['re_ts'] = data['re_ts'] * 1000
@@ -448,9 +751,9 @@ def _groom_wheel_data_ge5(data, label='file ', path=''):
     the wheel position files. There are many possible errors described below, but
     nothing excludes getting new ones.
     """
-    data = _clean_wheel_dataframe(data, label, path)
+    data = _clean_wheel_data(data, label, path)
     # check if the time scale is in ms
-    if (data['re_ts'].iloc[-1] - data['re_ts'].iloc[0]) / 1e6 < 20:
+    if (data['re_ts'][-1] - data['re_ts'][0]) / 1e6 < 20:
         _logger.warning('Rotary encoder reset logs events in ms instead of us: ' +
                         'RE firmware needs upgrading and wheel velocity is potentially inaccurate')
         data['re_ts'] = data['re_ts'] * 1000
@@ -583,60 +886,25 @@ def load_bpod_fronts(session_path: str, data: dict = False) -> list:
     """
     if not data:
         data = load_data(session_path)
-
-    BNC1_fronts = np.array([[np.nan, np.nan]])
-    BNC2_fronts = np.array([[np.nan, np.nan]])
-    for tr in data:
-        BNC1_fronts = np.append(
-            BNC1_fronts,
-            np.array(
-                [
-                    [x, 1]
-                    for x in tr["behavior_data"]["Events timestamps"].get("BNC1High", [np.nan])
-                ]
-            ),
-            axis=0,
-        )
-        BNC1_fronts = np.append(
-            BNC1_fronts,
-            np.array(
-                [
-                    [x, -1]
-                    for x in tr["behavior_data"]["Events timestamps"].get("BNC1Low", [np.nan])
-                ]
-            ),
-            axis=0,
-        )
-        BNC2_fronts = np.append(
-            BNC2_fronts,
-            np.array(
-                [
-                    [x, 1]
-                    for x in tr["behavior_data"]["Events timestamps"].get("BNC2High", [np.nan])
-                ]
-            ),
-            axis=0,
-        )
-        BNC2_fronts = np.append(
-            BNC2_fronts,
-            np.array(
-                [
-                    [x, -1]
-                    for x in tr["behavior_data"]["Events timestamps"].get("BNC2Low", [np.nan])
-                ]
-            ),
-            axis=0,
-        )
-
-    BNC1_fronts = BNC1_fronts[1:, :]
-    BNC1_fronts = BNC1_fronts[BNC1_fronts[:, 0].argsort()]
-    BNC2_fronts = BNC2_fronts[1:, :]
-    BNC2_fronts = BNC2_fronts[BNC2_fronts[:, 0].argsort()]
-
-    BNC1 = {"times": BNC1_fronts[:, 0], "polarities": BNC1_fronts[:, 1]}
-    BNC2 = {"times": BNC2_fronts[:, 0], "polarities": BNC2_fronts[:, 1]}
-
-    return [BNC1, BNC2]
+    table = BpodTrialsTable(data, events=('BNC1', 'BNC2'))
+    out = []
+    for bnc in ('BNC1', 'BNC2'):
+        times, polarities, trial, order = ([], [], [], [])
+        for i, (event, pol) in enumerate(((f'{bnc}High', 1), (f'{bnc}Low', -1))):
+            t, tr = table.events(event)
+            # trials without the event have a single NaN front
+            missing = np.setdiff1d(np.arange(table.ntrials), tr)
+            times.extend([t, missing * np.nan])
+            trial.extend([tr, missing])
+            polarities.append(np.zeros(t.size + missing.size) + pol)
+            order.append(np.zeros(t.size + missing.size) + i)
+        times, polarities, trial, order = map(np.concatenate, (times, polarities, trial, order))
+        # fronts ordered by trial, high fronts first, before sorting by time
+        isort = np.lexsort((order, trial))
+        fronts = np.c_[times[isort], polarities[isort]]
+        fronts = fronts[fronts[:, 0].argsort()]
+        out.append({"times": fronts[:, 0], "polarities": fronts[:, 1]})
+    return out
 
 
 def get_port_events(trial: dict, name: str = '') -> list:
@@ -1,7 +1,9 @@
+from collections import OrderedDict
 import json
 import logging
 from pathlib import Path
 import re
+import threading
 
 import numpy as np
 
@@ -12,16 +14,154 @@ from ibllib.io import hashfile
 
 SAMPLE_SIZE = 2  # int16
 DEFAULT_BATCH_SIZE = 1e6
+DEFAULT_CACHE_BYTES = 2 ** 28  # size of the cache of decompressed chunks for mtscomp files
 _logger = logging.getLogger('ibllib')
 
 
+class ChunkCache(object):
+    """
+    Least recently used cache of decompressed chunks, bounded by the total size in bytes of
+    the arrays it holds. Thread-safe.
+    >>> cache = ChunkCache(max_bytes=2 ** 28)
+    >>> chunk = cache.get(ichunk, lambda: decompress(ichunk))
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __contains__(self, key):
+        return key in self._chunks
+
+    def get(self, key, fcn):
+        """
+        Returns the cached array for key, computes it with fcn() and caches it if absent
+        """
+        with self._lock:
+            if key in self._chunks:
+                self._chunks.move_to_end(key)
+                return self._chunks[key]
+        # the computation is done outside of the lock so that threads decompress in parallel
+        arr = fcn()
+        with self._lock:
+            if key not in self._chunks:
+                self._chunks[key] = arr
+                self.nbytes += arr.nbytes
+            # evict least recently used chunks, always keeping the last one
+            while self.nbytes > self.max_bytes and len(self._chunks) > 1:
+                _, old = self._chunks.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return arr
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self.nbytes = 0
+
+
+class MtscompReader(object):
+    """
+    Array-like random access to a mtscomp compressed file. Decompressed chunks are kept in a
+    size-bounded LRU cache and only the requested samples and channels are copied from them,
+    so that repeated small reads (sync traces, waveforms snippets) do not decompress the same
+    chunks again and do not concatenate all channels of each chunk.
+    Supports slices, integers, lists and arrays of indices along both dimensions. Contrary to
+    numpy, indexing with arrays along both dimensions selects all combinations of samples and
+    channels (as `np.ix_`).
+    """
+    def __init__(self, cbin_file, ch_file=None, cache_bytes=DEFAULT_CACHE_BYTES):
+        self._reader = mtscomp.Reader()
+        self._reader.open(cbin_file, ch_file or Path(cbin_file).with_suffix('.ch'))
+        self.chunk_bounds = np.array(self._reader.chunk_bounds)
+        self.chunk_offsets = np.array(self._reader.chunk_offsets)
+        self.cache = ChunkCache(max_bytes=cache_bytes)
+
+    @property
+    def shape(self):
+        return self._reader.shape
+
+    @property
+    def dtype(self):
+        return self._reader.dtype
+
+    @property
+    def n_chunks(self):
+        return self._reader.n_chunks
+
+    def read_chunk(self, ichunk):
+        """
+        :param ichunk: index of the chunk
+        :return: full decompressed chunk (nsamples, nchannels), from the cache if available
+        """
+        ichunk = int(ichunk)
+        # chunks are cached here: bypass the count-based lru cache mtscomp sets on the instance
+        return self.cache.get(ichunk, lambda: mtscomp.Reader.read_chunk(
+            self._reader, ichunk, int(self.chunk_offsets[ichunk]),
+            int(self.chunk_offsets[ichunk + 1] - self.chunk_offsets[ichunk])))
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            nsel, csel = item if len(item) == 2 else (item[0], slice(None))
+        else:
+            nsel, csel = (item, slice(None))
+        ns, nc = self.shape
+        # samples indices
+        if isinstance(nsel, slice):
+            isamples = np.arange(*nsel.indices(ns))
+        else:
+            isamples = np.array(nsel, dtype=np.int64)
+            isamples[isamples < 0] += ns
+            if np.any(isamples < 0) or np.any(isamples >= ns):
+                raise IndexError(f"index out of bounds for axis 0 with size {ns}")
+        scalar = isamples.ndim == 0
+        isamples = np.atleast_1d(isamples)
+        # channels indices: output shape is computed from a dummy array
+        if not isinstance(csel, slice) and not np.isscalar(csel):
+            csel = np.array(csel, dtype=np.int64)
+        out = np.empty((isamples.size,) + np.empty((1, nc), dtype=bool)[:, csel].shape[1:],
+                       dtype=self.dtype)
+        # loop over the chunks, sorting samples by chunk
+        ichunks = np.searchsorted(self.chunk_bounds, isamples, side='right') - 1
+        contiguous = isinstance(nsel, slice) and nsel.step in (None, 1)
+        if contiguous:
+            uchunks, first = np.unique(ichunks, return_index=True)
+            islices = np.split(np.arange(isamples.size), first[1:])
+        else:
+            order = np.argsort(ichunks, kind='stable')
+            uchunks, first = np.unique(ichunks[order], return_index=True)
+            islices = np.split(order, first[1:])
+        for ichunk, iout in zip(uchunks, islices):
+            chunk = self.read_chunk(ichunk)
+            rows = isamples[iout] - self.chunk_bounds[ichunk]
+            if contiguous:
+                out[iout[0]:iout[-1] + 1] = chunk[rows[0]:rows[-1] + 1, csel]
+            elif isinstance(csel, slice) or np.isscalar(csel):
+                out[iout] = chunk[rows, csel]
+            else:
+                out[iout] = chunk[np.ix_(rows, csel)]
+        return out[0] if scalar else out
+
+    def close(self):
+        self.cache.clear()
+        self._reader.close()
+
+
 class Reader:
     """
     Class for SpikeGLX reading purposes
     Some format description was found looking at the Matlab SDK here
     https://github.com/billkarsh/SpikeGLX/blob/master/MATLAB-SDK/DemoReadSGLXData.m
     """
-    def __init__(self, sglx_file):
+    def __init__(self, sglx_file, cache_bytes=DEFAULT_CACHE_BYTES):
+        """
+        :param sglx_file: path to the binary file (.bin or mtscomp compressed .cbin)
+        :param cache_bytes: for compressed files, maximum size of the cache of decompressed
+         chunks in bytes
+        """
         self.file_bin = Path(sglx_file)
         self.nbytes = self.file_bin.stat().st_size
         file_meta_data = Path(sglx_file).with_suffix('.meta')
@@ -37,8 +177,8 @@ class Reader:
         self.channel_conversion_sample2v = _conversion_sample2v_from_meta(self.meta)
         # if we are not looking at a compressed file, use a memmap, otherwise instantiate mtscomp
         if self.is_mtscomp:
-            self._raw = mtscomp.Reader()
-            self._raw.open(self.file_bin, self.file_bin.with_suffix('.ch'))
+            self._raw = MtscompReader(self.file_bin, self.file_bin.with_suffix('.ch'),
+                                      cache_bytes=cache_bytes)
         else:
             if self.nc * self.ns * 2 != self.nbytes:
                 ftsec = self.file_bin.stat().st_size / 2 / self.nc / self.fs
@@ -166,6 +306,32 @@ class Reader:
         analog[np.where(analog >= threshold)] = 1
         return np.concatenate((digital, np.int8(analog)), axis=1)
 
+    def read_sync_fronts(self, _slice=slice(0, 10000), threshold=1.2):
+        """
+        Detects fronts on the sync traces at specified samples without converting the digital
+        sync to floats or splitting all of its samples into bits.
+        Equivalent to `dsp.fronts(sr.read_sync(_slice, threshold), axis=0)`
+        >>> ind, channels, polarities = sr.read_sync_fronts(slice(0,10000))
+        :param _slice: samples slice
+        :param threshold: (V) threshold for front detection on analog sync, defaults to 1.2 V
+        :return: sample indices (relative to the slice start), channels and polarities (1 rise,
+         -1 fall) of fronts, sorted by sample then channel
+        """
+        ind, channels, polarities = fronts_sync_digital(
+            self._raw[_slice, _get_sync_trace_indices_from_meta(self.meta)])
+        analog = self.read_sync_analog(_slice)
+        if analog is None:
+            return ind, channels, polarities
+        analog = np.int8(analog >= threshold)
+        d = np.diff(analog, axis=0)
+        ia, ca = np.where(d != 0)
+        # the analog channels are appended after the 16 bits of each digital sync trace
+        ind = np.r_[ind, ia + 1]
+        channels = np.r_[channels, ca + 16 * len(_get_sync_trace_indices_from_meta(self.meta))]
+        polarities = np.r_[polarities, d[ia, ca]]
+        ordre = np.lexsort((channels, ind))
+        return ind[ordre], channels[ordre], polarities[ordre]
+
     def compress_file(self, keep_original=True, **kwargs):
         """
         Compresses
@@ -208,9 +374,11 @@ class Reader:
             self.file_bin = kwargs['out']
         return kwargs['out']
 
-    def verify_hash(self):
+    def verify_hash(self, digests=None):
         """
         Computes SHA-1 hash and returns True if it matches metadata, False otherwise
+        :param digests: (optional) dictionary output by `hashfile.digests` on the binary file
+         including 'sha1', to avoid reading the file again when other digests are needed
         :return: boolean
         """
         if self.is_mtscomp:
@@ -224,7 +392,8 @@ class Reader:
             sm = sm.upper()
         else:
             sm = self.meta.fileSHA1
-        sc = hashfile.sha1(self.file_bin).upper()
+        sc = (digests or {}).get('sha1') or hashfile.sha1(self.file_bin)
+        sc = sc.upper()
         if sm == sc:
             log_func = _logger.info
         else:
@@ -424,6 +593,34 @@ def split_sync(sync_tr):
     return np.int8(out)
 
 
+def fronts_sync_digital(sync_tr):
+    """
+    Detects fronts on int16 digital synchronisation traces. Only the samples where the int16 word
+    changes are split into bits, so that this is much cheaper than splitting the whole trace.
+    Equivalent to `ibllib.dsp.fronts(split_sync(sync_tr), axis=0)`
+
+    :param sync_tr: numpy vector (or array with one column per trace) of int16 samples
+    :return: sample indices, channel indices (bit + 16 * trace index) and polarities
+     (1 rise, -1 fall) of the fronts, sorted by sample then channel
+    """
+    sync_tr = np.int16(sync_tr).reshape(np.shape(sync_tr)[0], -1)
+    ind, channels, polarities = ([], [], [])
+    for itr in range(sync_tr.shape[1]):
+        tr = sync_tr[:, itr]
+        ichange = np.where(tr[1:] != tr[:-1])[0] + 1
+        d = split_sync(tr[ichange]) - split_sync(tr[ichange - 1])
+        isamp, ibit = np.where(d != 0)
+        ind.append(ichange[isamp])
+        channels.append(ibit + 16 * itr)
+        polarities.append(d[isamp, ibit])
+    ind, channels, polarities = (np.concatenate(ind), np.concatenate(channels),
+                                 np.concatenate(polarities))
+    if sync_tr.shape[1] > 1:
+        ordre = np.lexsort((channels, ind))
+        ind, channels, polarities = (ind[ordre], channels[ordre], polarities[ordre])
+    return ind, channels, polarities
+
+
 def get_neuropixel_version_from_folder(session_path):
     ephys_files = glob_ephys_files(session_path)
     return get_neuropixel_version_from_files(ephys_files)
@@ -40,7 +40,8 @@ class RawEphysQC(tasks.Task):
     level = 0  # this job doesn't depend on anything
 
     def _run(self, overwrite=False):
-        qc_files = ephysqc.raw_qc_session(self.session_path, overwrite=overwrite)
+        qc_files = ephysqc.raw_qc_session(self.session_path, overwrite=overwrite,
+                                          n_workers=self.cpu)
         return qc_files
 
 
@@ -186,11 +187,14 @@ class EphysSyncSpikeSorting(tasks.Task):
         Outputs individual probes
         """
         # first sync the probes
-        status, sync_files = sync_probes.sync(self.session_path)
+        with self.stage('sync_probes'):
+            status, sync_files = sync_probes.sync(self.session_path)
         # then convert ks2 to ALF and resync spike sorting data
-        alf_files = spikes.sync_spike_sortings(self.session_path)
+        with self.stage('sync_spike_sortings'):
+            alf_files = spikes.sync_spike_sortings(self.session_path)
         # outputs the probes object in the ALF folder
-        probe_files = spikes.probes_description(self.session_path, one=self.one)
+        with self.stage('probes_description'):
+            probe_files = spikes.probes_description(self.session_path, one=self.one)
         return sync_files + alf_files + probe_files
 
 
@@ -216,7 +220,8 @@ class EphysMtscomp(tasks.Task):
                     out_files.append(bin_file)
                 else:
                     _logger.info(f"Compressing binary file {bin_file}")
-                    out_files.append(sr.compress_file(keep_original=False))
+                    with self.stage(f'compress_{typ}'):
+                        out_files.append(sr.compress_file(keep_original=False))
         return out_files
 
 
@@ -1,11 +1,15 @@
+import concurrent.futures
 import logging
+import os
+import time
+import traceback
 from pathlib import Path
 
 from ibllib.pipes import ephys_preprocessing, training_preprocessing, tasks
 import ibllib.io.raw_data_loaders as rawio
 
 import oneibl.registration as registration
-from oneibl.one import ONE
+from oneibl.one import ONE, connection_params, one_from_params
 
 _logger = logging.getLogger('ibllib')
 
@@ -24,6 +28,9 @@ def job_creator(root_path, one=None, dry=False, rerun=False, max_md5_size=None):
     1) create the sessions on Alyx
     2) register the corresponding raw data files on Alyx
     3) create the tasks to be run on Alyx
+    The raw data files of all sessions are hashed concurrently. The flag of a session is removed
+    only once its files are registered and its tasks created, an error on a session is logged
+    and doesn't stop the others.
     :param root_path: main path containing sessions or session path
     :param one
     :param dry
@@ -37,36 +44,55 @@ def job_creator(root_path, one=None, dry=False, rerun=False, max_md5_size=None):
     flag_files = list(Path(root_path).glob('**/extract_me.flag'))
     flag_files += list(Path(root_path).glob('**/raw_session.flag'))
     all_datasets = []
+    created = {}
     for flag_file in flag_files:
         session_path = flag_file.parent
         _logger.info(f'creating session for {session_path}')
         if dry:
             continue
-        # providing a false flag stops the registration after session creation
-        rc.create_session(session_path)
+        try:
+            rc.create_session(session_path)
+        except Exception:
+            _logger.error(f'{session_path} session creation failed\n{traceback.format_exc()}')
+            continue
+        created[session_path] = flag_file
+    if dry:
+        return all_datasets
+    for session_path, files, dsets, error in registration.iter_register_sessions_raw_data(
+            list(created.keys()), one=one, max_md5_size=max_md5_size):
+        flag_file = created[session_path]
+        try:
+            if error is not None:
+                raise error
+            if dsets is not None:
+                all_datasets.extend(dsets)
+            _create_session_tasks(session_path, flag_file, one=one, rerun=rerun)
+        except Exception:
+            _logger.error(f'{session_path} registration failed, {flag_file.name} is kept\n'
+                          f'{traceback.format_exc()}')
+            continue
         flag_file.unlink()
-        files, dsets = registration.register_session_raw_data(
-            session_path, one=one, max_md5_size=max_md5_size)
-        if dsets is not None:
-            all_datasets.extend(dsets)
-        session_type = rawio.get_session_extractor_type(session_path)
-        if session_type in ['biased', 'habituation', 'training']:
-            pipe = training_preprocessing.TrainingExtractionPipeline(session_path, one=one)
-        # only start extracting ephys on a raw_session.flag
-        elif session_type in ['ephys'] and flag_file.name == 'raw_session.flag':
-            pipe = ephys_preprocessing.EphysExtractionPipeline(session_path, one=one)
-        else:
-            _logger.info(f"Session type {session_type} as no matching extractor {session_path}")
-            return
-        if rerun:
-            rerun__status__in = '__all__'
-        else:
-            rerun__status__in = ['Waiting']
-        pipe.create_alyx_tasks(rerun__status__in=rerun__status__in)
     return all_datasets
 
 
-def job_runner(subjects_path, lab=None, dry=False, one=None, count=5):
+def _create_session_tasks(session_path, flag_file, one=None, rerun=False):
+    session_type = rawio.get_session_extractor_type(session_path)
+    if session_type in ['biased', 'habituation', 'training']:
+        pipe = training_preprocessing.TrainingExtractionPipeline(session_path, one=one)
+    # only start extracting ephys on a raw_session.flag
+    elif session_type in ['ephys'] and flag_file.name == 'raw_session.flag':
+        pipe = ephys_preprocessing.EphysExtractionPipeline(session_path, one=one)
+    else:
+        _logger.info(f"Session type {session_type} as no matching extractor {session_path}")
+        return
+    if rerun:
+        rerun__status__in = '__all__'
+    else:
+        rerun__status__in = ['Waiting']
+    pipe.create_alyx_tasks(rerun__status__in=rerun__status__in)
+
+
+def job_runner(subjects_path, lab=None, dry=False, one=None, count=5, n_workers=1):
     """
     Function to be used as a process to run the jobs as they are created on the database
     THis will query waiting jobs from the specified Lab
@@ -74,6 +100,7 @@ def job_runner(subjects_path, lab=None, dry=False, one=None, count=5):
     :param lab: lab name as per Alyx
     :param dry:
     :param count:
+    :param n_workers: [1] number of tasks run concurrently, see tasks_runner
     :return:
     """
     if one is None:
@@ -84,10 +111,12 @@ def job_runner(subjects_path, lab=None, dry=False, one=None, count=5):
         return  # if the lab is none, this will return empty tasks each time
     tasks = one.alyx.rest('tasks', 'list', status='Waiting',
                           django=f'session__lab__name__in,{lab}')
-    tasks_runner(subjects_path, tasks, one=one, count=count, time_out=3600, dry=dry)
+    tasks_runner(subjects_path, tasks, one=one, count=count, time_out=3600, dry=dry,
+                 n_workers=n_workers)
 
 
-def tasks_runner(subjects_path, tasks_dict, one=None, dry=False, count=5, time_out=None, **kwargs):
+def tasks_runner(subjects_path, tasks_dict, one=None, dry=False, count=5, time_out=None,
+                 n_workers=1, parallel='process', max_cpu=None, max_ram=None, **kwargs):
     """
     Function to run a list of tasks (task dictionary from Alyx query) on a local server
     :param subjects_path:
@@ -96,12 +125,23 @@ def tasks_runner(subjects_path, tasks_dict, one=None, dry=False, count=5, time_o
     :param dry:
     :param count: maximum number of tasks to run
     :param time_out: between each task, if time elapsed is greater than time out, returns (seconds)
+    :param n_workers: [1] if above 1, the tasks are scheduled according to their parents and run
+     concurrently, each task that has all its parents complete being started as soon as the
+     resources allow (see `_run_tasks_graph`)
+    :param parallel: ['process'] or 'thread', only used when n_workers > 1. With threads, the
+     process-level counters of the task profiles include the other tasks and are flagged
+     'concurrent', see `tasks.ResourceProfiler`
+    :param max_cpu: (n_workers > 1) number of cores shared by the tasks, defaults to all cores
+    :param max_ram: (n_workers > 1) RAM in Go shared by the tasks, defaults to the physical RAM
     :param kwargs:
     :return: list of dataset dictionaries
     """
     if one is None:
         one = ONE()
-    import time
+    if n_workers > 1 and not dry:
+        return _run_tasks_graph(subjects_path, tasks_dict, one=one, count=count,
+                                time_out=time_out, n_workers=n_workers, parallel=parallel,
+                                max_cpu=max_cpu, max_ram=max_ram, **kwargs)
     tstart = time.time()
     c = 0
     last_session = None
@@ -126,3 +166,114 @@ def tasks_runner(subjects_path, tasks_dict, one=None, dry=False, count=5, time_o
                 all_datasets.extend(dsets)
                 c += 1
     return all_datasets
+
+
+def _total_ram():
+    """Physical memory in Go, None if it can't be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return
+
+
+def _run_alyx_task_process(tdict, session_path, one_params, **kwargs):
+    return tasks.run_alyx_task(tdict=tdict, session_path=session_path,
+                               one=one_from_params(one_params), **kwargs)
+
+
+def _run_tasks_graph(subjects_path, tasks_dict, one=None, count=5, time_out=None, n_workers=2,
+                     parallel='process', max_cpu=None, max_ram=None, **kwargs):
+    """
+    Runs a list of Alyx tasks concurrently. A task is ready when all its parents in the list are
+    finished, the ready tasks are started by decreasing priority provided the cpu, ram and
+    io_charge of the running tasks fit within max_cpu, max_ram and 100% io. A task that doesn't
+    fit the resources is run alone. The status transitions are the ones of
+    `tasks.run_alyx_task`: a task whose parents errored is set to Held without running.
+    :param count: maximum number of tasks to run
+    :param time_out: no task is started after time_out seconds, the running ones are awaited
+    :return: list of dataset dictionaries
+    """
+    if parallel == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+        fcn = _run_alyx_task_process
+        one_arg = connection_params(one)
+    elif parallel == 'thread':
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+        fcn = tasks.run_alyx_task
+        one_arg = one
+    else:
+        raise ValueError(f"parallel should be 'thread' or 'process', got {parallel}")
+    max_cpu = max_cpu or os.cpu_count() or n_workers
+    max_ram = max_ram or _total_ram() or float('inf')
+    pending = {td['id']: td for td in tasks_dict}
+    # highest priority first, then the order of the input list
+    order = {td['id']: (-(td.get('priority') or 0), i) for i, td in enumerate(tasks_dict)}
+    finished = {}  # task id: task dictionary after the run
+    running = {}  # future: task dictionary
+    session_paths = {}
+    all_datasets = []
+    tstart = time.time()
+    nrun = 0
+
+    def _session_path(eid):
+        if eid not in session_paths:
+            ses = one.alyx.rest('sessions', 'list', django=f"pk,{eid}")[0]
+            session_paths[eid] = Path(subjects_path).joinpath(
+                Path(ses['subject'], ses['start_time'][:10], str(ses['number']).zfill(3)))
+        return session_paths[eid]
+
+    def _load(key):
+        return sum(td.get(key) or 0 for td in running.values())
+
+    try:
+        while True:
+            for tid in sorted(pending, key=order.get):
+                if nrun >= count or (time_out and time.time() - tstart > time_out):
+                    break
+                tdict = pending[tid]
+                parents = tdict.get('parents') or []
+                running_ids = [td['id'] for td in running.values()]
+                if any(p in pending or p in running_ids for p in parents):
+                    continue
+                if running and (_load('cpu') + (tdict.get('cpu') or 0) > max_cpu or
+                                _load('ram') + (tdict.get('ram') or 0) > max_ram or
+                                _load('io_charge') + (tdict.get('io_charge') or 0) > 100):
+                    continue
+                # the parents run in this batch are checked from their final status, otherwise
+                # run_alyx_task queries the database
+                job_deck = [finished[p] for p in parents] if all(
+                    p in finished for p in parents) else None
+                session_path = _session_path(tdict['session'])
+                del pending[tid]
+                nrun += 1
+                if job_deck and any(j['status'] != 'Complete' for j in job_deck):
+                    # no need for a worker to flag a task with failed parents
+                    t, dsets = tasks.run_alyx_task(tdict=tdict, session_path=session_path,
+                                                   one=one, job_deck=job_deck, **kwargs)
+                    finished[tid] = t
+                    all_datasets.extend(dsets or [])
+                    continue
+                _logger.info(f"starting {tdict['name']} on {session_path}")
+                future = executor.submit(fcn, tdict, session_path, one_arg,
+                                         job_deck=job_deck, **kwargs)
+                running[future] = tdict
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                tdict = running.pop(future)
+                try:
+                    t, dsets = future.result()
+                except Exception:
+                    # the worker itself failed, as opposed to the task that logs its own errors
+                    log = traceback.format_exc()
+                    _logger.error(log)
+                    t = one.alyx.rest('tasks', 'partial_update', id=tdict['id'],
+                                      data={'status': 'Errored', 'log': log})
+                    dsets = []
+                finished[tdict['id']] = t
+                all_datasets.extend(dsets or [])
+    finally:
+        executor.shutdown(wait=True)
+    return all_datasets
@@ -1,20 +1,133 @@
 from pathlib import Path
 import abc
+import contextlib
 import logging
 import io
 import importlib
+import os
+import threading
 import time
 from _collections import OrderedDict
 import traceback
 
 from graphviz import Digraph
+import pandas as pd
 
 from ibllib.misc import version
-from ibllib.io import params
+from ibllib.io import params, jsonable
 from oneibl.registration import register_dataset
 
 
 _logger = logging.getLogger('ibllib')
+PROFILE_FILE = 'logs/tasks_profile.jsonable'  # relative to the session path
+
+
+def _proc_rss():
+    """Resident memory of the current process in bytes, None if /proc is not available"""
+    try:
+        with open('/proc/self/statm') as fid:
+            return int(fid.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return
+
+
+def _proc_io():
+    """Bytes read and written by the current process through system calls, Nones if unknown"""
+    try:
+        with open('/proc/self/io') as fid:
+            counters = dict(line.split(':') for line in fid.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+def _thread_time():
+    """CPU time of the current thread in seconds, None before python 3.7"""
+    return time.thread_time() if hasattr(time, 'thread_time') else None
+
+
+class ResourceProfiler:
+    """
+    Measures the wall time, cpu time (including child processes), peak resident memory and the
+    bytes read / written by the current process within a context. The peak memory is sampled
+    from a background thread every `interval` seconds.
+    The cpu time of the calling thread alone is in 'thread_cpu_secs'. The other counters are
+    process-level: if another profiler ran in the same process meanwhile (tasks run in threads),
+    the profile is flagged 'concurrent' as those counters include the usage of the other tasks.
+    with ResourceProfiler() as rp:
+        do_stuff()
+    rp.profile
+    """
+    _lock = threading.Lock()
+    _active = {}  # thread identifier of each running profiler in this process
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.profile = {}
+        self._stop = threading.Event()
+        self._peak_rss = None
+        self._concurrent = False
+
+    @classmethod
+    def active_threads(cls):
+        """Identifiers of the threads running a profiled context in this process"""
+        with cls._lock:
+            return set(cls._active.values())
+
+    def _sample(self):
+        while True:
+            rss = _proc_rss()
+            if rss is not None:
+                self._peak_rss = max(rss, self._peak_rss or 0)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        with self._lock:
+            self._concurrent = len(self._active) > 0
+            for other in self._active:
+                other._concurrent = True
+            self._active[self] = threading.get_ident()
+        self._t0, self._times0, self._io0 = time.time(), os.times(), _proc_io()
+        self._thread_time0 = _thread_time()
+        self._peak_rss = None
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._sampler.join()
+        times, io1, thread_time = os.times(), _proc_io(), _thread_time()
+        with self._lock:
+            self._active.pop(self, None)
+        cpu = [t1 - t0 for t0, t1 in zip(self._times0[:4], times[:4])]
+        self.profile = {
+            'time_elapsed_secs': time.time() - self._t0,
+            'cpu_secs': sum(cpu),
+            'cpu_children_secs': cpu[2] + cpu[3],
+            'thread_cpu_secs': (thread_time - self._thread_time0
+                                if thread_time is not None else None),
+            'peak_rss_gb': self._peak_rss / 1024 ** 3 if self._peak_rss else None,
+            'read_gb': (io1[0] - self._io0[0]) / 1024 ** 3 if io1[0] is not None else None,
+            'write_gb': (io1[1] - self._io0[1]) / 1024 ** 3 if io1[1] is not None else None,
+            'concurrent': self._concurrent,
+        }
+
+
+class _TaskLogFilter(logging.Filter):
+    """
+    Keeps the log records of a task run: the ones emitted by the thread running the task and
+    by threads that don't run another task, such as the helper threads started by the task.
+    """
+    def __init__(self):
+        super().__init__()
+        self.thread = threading.get_ident()
+
+    def filter(self, record):
+        return (record.thread == self.thread or
+                record.thread not in ResourceProfiler.active_threads())
 
 
 class Task(abc.ABC):
@@ -29,6 +142,7 @@ class Task(abc.ABC):
     outputs = None
     time_elapsed_secs = None
     time_out_secs = None
+    profile = None  # resources used by the last run, see ResourceProfiler
     version = version.ibllib()
 
     def __init__(self, session_path, parents=None, taskid=None, one=None):
@@ -36,6 +150,7 @@ class Task(abc.ABC):
         self.one = one
         self.session_path = session_path
         self.register_kwargs = {}
+        self._stages = OrderedDict()
         if parents:
             self.parents = parents
         else:
@@ -64,19 +179,25 @@ class Task(abc.ABC):
         ch = logging.StreamHandler(log_capture_string)
         str_format = '%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
         ch.setFormatter(logging.Formatter(str_format))
+        # the logger is shared by the tasks run concurrently in threads, keep this task records
+        ch.addFilter(_TaskLogFilter())
         _logger.addHandler(ch)
         _logger.info(f"Starting job {self.__class__}")
         # run
-        start_time = time.time()
-        try:
-            self.outputs = self._run(**kwargs)
-            self.status = 0
-            _logger.info(f"Job {self.__class__} complete")
-        except BaseException:
-            _logger.error(traceback.format_exc())
-            _logger.info(f"Job {self.__class__} errored")
-            self.status = -1
-        self.time_elapsed_secs = time.time() - start_time
+        self._stages = OrderedDict()
+        with ResourceProfiler() as rp:
+            try:
+                self.outputs = self._run(**kwargs)
+                self.status = 0
+                _logger.info(f"Job {self.__class__} complete")
+            except BaseException:
+                _logger.error(traceback.format_exc())
+                _logger.info(f"Job {self.__class__} errored")
+                self.status = -1
+        self.time_elapsed_secs = rp.profile['time_elapsed_secs']
+        self.profile = dict(rp.profile, stages=self._stages)
+        self._save_profile()
+        _logger.info(f"Resources: {self.profile}")
         # log the outputs-+
         if isinstance(self.outputs, list):
             nout = len(self.outputs)
@@ -94,6 +215,30 @@ class Task(abc.ABC):
         self.tearDown()
         return self.status
 
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times a stage of the _run() method, the timings are output in self.profile['stages']
+        with self.stage('sync'):
+            ...
+        """
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self._stages[name] = self._stages.get(name, 0) + time.time() - t0
+
+    def _save_profile(self):
+        """Appends the profile of the run to the session profile file"""
+        try:
+            profile_file = Path(self.session_path).joinpath(PROFILE_FILE)
+            profile_file.parent.mkdir(exist_ok=True, parents=True)
+            jsonable.append(profile_file, [dict(
+                self.profile, name=self.name, status=self.status, version=self.version,
+                date_time=time.strftime('%Y-%m-%dT%H:%M:%S'))])
+        except (OSError, TypeError) as e:
+            _logger.warning(f"could not save the task profile: {e}")
+
     def register_datasets(self, one=None, **kwargs):
         """
         Register output datasets form the task to Alyx
@@ -262,6 +407,27 @@ class Pipeline(abc.ABC):
         return self.__class__.__name__
 
 
+def profile_report(root_path, summary=True):
+    """
+    Gathers the resources profiles of the tasks run on the sessions below a root path
+    :param root_path: session path or folder containing sessions
+    :param summary: (True) if True, returns the statistics per task name, otherwise one row
+     per task run
+    :return: pandas.DataFrame
+    """
+    records = []
+    for profile_file in Path(root_path).glob(f'**/{PROFILE_FILE}'):
+        session_path = profile_file.parents[len(Path(PROFILE_FILE).parents) - 1]
+        records.extend([dict(r, session_path=str(session_path))
+                        for r in jsonable.read(profile_file)])
+    df = pd.DataFrame(records)
+    if not summary or df.size == 0:
+        return df
+    cols = ['time_elapsed_secs', 'cpu_secs', 'peak_rss_gb', 'read_gb', 'write_gb']
+    return df.groupby('name')[cols].agg(['count', 'mean', 'max']).sort_values(
+        ('time_elapsed_secs', 'mean'), ascending=False)
+
+
 def run_alyx_task(tdict=None, session_path=None, one=None, job_deck=None, max_md5_size=None):
     """
     Runs a single Alyx job and registers output datasets
@@ -1,4 +1,6 @@
+import json
 import logging
+from pathlib import Path
 
 import numpy as np
 
@@ -23,6 +25,7 @@ from ibllib.io.extractors.training_trials import (
     run_extractor_classes,
 )
 from ibllib.io.extractors.training_trials import ContrastLR as biasedContrastLR
+from ibllib.io.extractors.base import BpodSession
 from ibllib.io.extractors.ephys_fpga import ProbaContrasts, _get_pregenerated_events
 import ibllib.io.raw_data_loaders as raw
 from ibllib.io.extractors.training_wheel import get_wheel_position
@@ -33,8 +36,10 @@ _logger = logging.getLogger("ibllib")
 def extract_bpod_trial_data(session_path, raw_bpod_trials=None, raw_settings=None):
     """Extracts and loads ephys sessions from bpod data"""
     _logger.info(f"Extracting session: {session_path}")
-    raw_bpod_trials = raw_bpod_trials or raw.load_data(session_path)
-    raw_settings = raw_settings or raw.load_settings(session_path)
+    # the raw data is parsed once and shared by all the extractors
+    session = BpodSession(session_path, bpod_trials=raw_bpod_trials, settings=raw_settings)
+    raw_bpod_trials = session.bpod_trials
+    raw_settings = session.raw_settings
     extractor_type = raw.get_session_extractor_type(session_path)
     classes = [
         StimOnOffFreezeTimes,
@@ -62,13 +67,7 @@ def extract_bpod_trial_data(session_path, raw_bpod_trials=None, raw_settings=Non
     elif extractor_type == "training":
         classes.extend([ContrastLR, ProbabilityLeft])
 
-    out, _ = run_extractor_classes(
-        classes,
-        save=False,
-        session_path=session_path,
-        bpod_trials=raw_bpod_trials,
-        settings=raw_settings,
-    )
+    out, _ = run_extractor_classes(classes, save=False, session_path=session_path, session=session)
     if extractor_type == "ephys":
         out.update(_get_pregenerated_events(raw_bpod_trials, raw_settings))
     else:
@@ -102,6 +101,7 @@ class BpodQCExtractor(object):
     def load_raw_data(self):
         _logger.info(f"Loading raw data from {self.session_path}")
         self.raw_data = raw.load_data(self.session_path)
+        self.ntrials = len(self.raw_data)
         self.details = raw.load_settings(self.session_path)
         self.BNC1, self.BNC2 = raw.load_bpod_fronts(self.session_path, data=self.raw_data)
         # NOTE: wheel_position is actually an extractor needs _iblrig_encoderPositions.raw
@@ -116,3 +116,49 @@ class BpodQCExtractor(object):
         self.trial_data = extract_bpod_trial_data(
             self.session_path, raw_bpod_trials=self.raw_data, raw_settings=self.details
         )
+
+    def save(self, file, **kwargs):
+        """
+        Saves the extracted data to a npz file, so that the QC can be re-computed without
+        parsing and extracting the raw data again.
+        :param file: npz file name
+        :param kwargs: additional values saved alongside the data, e.g. a raw data fingerprint
+        :return: None
+        """
+        arrays = {k: np.array(v) for k, v in kwargs.items()}
+        arrays.update({"details": np.array(json.dumps(self.details)),
+                       "ntrials": np.array(self.ntrials)})
+        for name in ("trial_data", "wheel_data", "BNC1", "BNC2"):
+            arrays.update({f"{name}.{k}": v for k, v in getattr(self, name).items()})
+        # write to a temporary file first so that an interrupted run doesn't leave a corrupt file
+        file_tmp = Path(file).with_name(Path(file).name + ".part")
+        with open(file_tmp, "wb") as fid:
+            np.savez(fid, **arrays)
+        file_tmp.replace(file)
+
+    @classmethod
+    def load(cls, file, session_path=None):
+        """
+        Instantiates an extractor from a npz file written by `BpodQCExtractor.save`. The raw
+        data isn't loaded, `raw_data` is None.
+        :param file: npz file name
+        :param session_path: (optional) session path of the data
+        :return: BpodQCExtractor instance, dict of the additional values saved
+        """
+        self = cls.__new__(cls)
+        self.session_path = session_path
+        self.raw_data = None
+        data = {name: {} for name in ("trial_data", "wheel_data", "BNC1", "BNC2")}
+        extras = {}
+        with np.load(file) as npz:
+            for k in npz.files:
+                name, _, key = k.partition(".")
+                if name in data:
+                    data[name][key] = npz[k]
+                else:
+                    extras[k] = npz[k][()]
+        self.details = json.loads(extras.pop("details"))
+        self.ntrials = int(extras.pop("ntrials"))
+        for name, value in data.items():
+            setattr(self, name, value)
+        return self, extras
@@ -4,7 +4,7 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 
-from brainbox.behavior.wheel import cm_to_rad, traces_by_trial
+from brainbox.behavior.wheel import cm_to_rad
 from ibllib.io.extractors.ephys_fpga import WHEEL_TICKS
 from ibllib.io.extractors.training_wheel import WHEEL_RADIUS_CM
 from ibllib.qc.base import QC
@@ -63,10 +63,14 @@ class BpodQC(QC):
                 self.log.info("Attempting download...")
                 self.one.load(self.eid, dataset_types=dstypes, download_only=True)
 
-    def load_data(self, lazy=False):
-        self.extractor = BpodQCExtractor(self.session_path, lazy=lazy)
+    def load_data(self, lazy=False, extractor=None):
+        """
+        :param lazy: if True, the trial data isn't extracted
+        :param extractor: (optional) BpodQCExtractor with extracted data, e.g. loaded from disk
+        """
+        self.extractor = extractor or BpodQCExtractor(self.session_path, lazy=lazy)
         self.wheel_gain = self.extractor.details["STIM_GAIN"]
-        self.bpod_ntrials = len(self.extractor.raw_data)
+        self.bpod_ntrials = self.extractor.ntrials
         self.wheel_trial_idxs = BpodQC.hack_ts(
             self.extractor.wheel_data["re_ts"],
             self.extractor.trial_data["intervals_0"],
@@ -245,25 +249,19 @@ def load_wheel_freeze_during_quiescence(trial_data, wheel_data):
     """
     assert np.all(np.diff(wheel_data["re_ts"]) > 0)
     assert trial_data["quiescence"].size == trial_data["stimOnTrigger_times"].size
-    # Get tuple of wheel times and positions over each trial's quiescence period
+    # Get the wheel samples indices over each trial's quiescence period
     qevt_start_times = trial_data["stimOnTrigger_times"] - trial_data["quiescence"]
-    traces = traces_by_trial(
-        wheel_data["re_ts"],
-        wheel_data["re_pos"],
-        start=qevt_start_times,
-        end=trial_data["stimOnTrigger_times"],
-    )
-
+    i0, i1 = _wheel_trace_indices(
+        wheel_data["re_ts"], qevt_start_times, trial_data["stimOnTrigger_times"])
+    pos = wheel_data["re_pos"]
     metric = np.zeros((len(trial_data["quiescence"]), 2))  # (n_trials, n_directions)
-    for i, trial in enumerate(traces):
-        t, pos = trial
-        # Get the last position before the period began
-        if pos.size > 0:
-            # Find the position of the preceding sample and subtract it
-            idx = np.abs(wheel_data["re_ts"] - t[0]).argmin() - 1
-            origin = wheel_data["re_pos"][idx if idx != -1 else 0]
-            # Find the absolute min and max relative to the last sample
-            metric[i, :] = np.abs([np.min(pos - origin), np.max(pos - origin)])
+    has_samples = i1 > i0
+    # The position of the sample preceding the period is the origin
+    origin = pos[np.maximum(i0[has_samples] - 1, 0)]
+    # Find the absolute min and max relative to the last sample
+    pmin = _reduce_segments(np.minimum, pos, i0, i1)[has_samples]
+    pmax = _reduce_segments(np.maximum, pos, i0, i1)[has_samples]
+    metric[has_samples, :] = np.abs(np.c_[pmin - origin, pmax - origin])
     # Reduce to the largest displacement found in any direction
     metric = np.max(metric, axis=1)
     metric = 180 * metric / np.pi  # convert to degrees from radians
@@ -279,19 +277,14 @@ def load_wheel_move_before_feedback(trial_data, wheel_data):
     Metric: (w_t - 0.05) - (w_t + 0.05) where t = feedback_time
     Criterion: != 0 for 99% of non-NoGo trials
     """
-    # Get tuple of wheel times and positions within 100ms of feedback
-    traces = traces_by_trial(
-        wheel_data["re_ts"],
-        wheel_data["re_pos"],
-        start=trial_data["feedback_times"] - 0.05,
-        end=trial_data["feedback_times"] + 0.05,
-    )
+    # Get the wheel samples indices within 100ms of feedback
+    i0, i1 = _wheel_trace_indices(wheel_data["re_ts"], trial_data["feedback_times"] - 0.05,
+                                  trial_data["feedback_times"] + 0.05)
     metric = np.zeros_like(trial_data["feedback_times"])
     # For each trial find the displacement
-    for i, trial in enumerate(traces):
-        pos = trial[1]
-        if pos.size > 1:
-            metric[i] = pos[-1] - pos[0]
+    pos = wheel_data["re_pos"]
+    ok = (i1 - i0) > 1
+    metric[ok] = pos[i1[ok] - 1] - pos[i0[ok]]
 
     # except no-go trials
     metric[trial_data["choice"] == 0] = np.nan
@@ -315,23 +308,16 @@ def load_wheel_move_during_closed_loop(trial_data, wheel_data, wheel_gain):
         log.warning("No wheel_gain input in function call, returning None")
         return None
 
-    # Get tuple of wheel times and positions over each trial's closed-loop period
-    traces = traces_by_trial(
-        wheel_data["re_ts"],
-        wheel_data["re_pos"],
-        start=trial_data["goCueTrigger_times"],
-        end=trial_data["response_times"],
-    )
-
+    # Get the wheel samples indices over each trial's closed-loop period
+    i0, i1 = _wheel_trace_indices(wheel_data["re_ts"], trial_data["goCueTrigger_times"],
+                                  trial_data["response_times"])
     metric = np.zeros_like(trial_data["feedback_times"])
-    # For each trial find the absolute displacement
-    for i, trial in enumerate(traces):
-        t, pos = trial
-        if pos.size != 0:
-            # Find the position of the preceding sample and subtract it
-            idx = np.abs(wheel_data["re_ts"] - t[0]).argmin() - 1
-            origin = wheel_data["re_pos"][idx]
-            metric[i] = np.abs(pos - origin).max()
+    # For each trial find the absolute displacement from the position of the preceding sample
+    pos = wheel_data["re_pos"]
+    ok = i1 > i0
+    origin = pos[i0[ok] - 1]
+    metric[ok] = np.maximum(_reduce_segments(np.maximum, pos, i0, i1)[ok] - origin,
+                            origin - _reduce_segments(np.minimum, pos, i0, i1)[ok])
 
     # Load wheel_gain and thresholds for each trial
     wheel_gain = np.array([wheel_gain] * len(trial_data["position"]))
@@ -348,6 +334,36 @@ def load_wheel_move_during_closed_loop(trial_data, wheel_data, wheel_gain):
     return metric, passed
 
 
+def _wheel_trace_indices(re_ts, start, end):
+    """
+    Indices of the wheel samples strictly within each interval, such that for each trial the
+    samples re_ts[i0:i1] are those of `brainbox.behavior.wheel.traces_by_trial`
+    :param re_ts: sorted wheel timestamps
+    :param start: array of interval starts
+    :param end: array of interval ends
+    :return: i0, i1 arrays of indices, the interval has no sample if i1 <= i0
+    """
+    i0 = np.searchsorted(re_ts, start, side='right')
+    i1 = np.searchsorted(re_ts, end, side='left')
+    # searchsorted puts NaNs at the end: an interval with a NaN bound has no sample
+    nans = np.isnan(start) | np.isnan(end)
+    i1 = np.where(nans, i0, i1)
+    return i0, i1
+
+
+def _reduce_segments(ufunc, a, i0, i1):
+    """
+    Applies a reduction to each segment a[i0:i1] in a single pass, ie.
+    np.array([ufunc.reduce(a[i:j]) for i, j in zip(i0, i1)]). The output is meaningless for
+    the empty segments
+    """
+    if a.size == 0:
+        return np.zeros(np.size(i0), dtype=a.dtype)
+    # interleaving the starts and ends, every other reduction is a segment
+    a = np.r_[a, a[-1:]]  # the ends may be equal to the array size
+    return ufunc.reduceat(a, np.c_[i0, i1].ravel())[::2]
+
+
 def load_positive_feedback_stimOff_delays(trial_data):
     """ Delay between valve and stim off should be 1s
     Variable name: positive_feedback_stimOff_delays
@@ -13,16 +13,28 @@ Example: Run full QC for a given session and view the results
     ext.compute_all_qc()
     print(ext.frame)
 
+Example: Re-run the QC on many sessions, re-using the extracted data and metrics cached on disk
+    frames = run_batch_qc(eids, one=one, cache_dir='/data/qc_cache', n_workers=8)
+
 TODO Integrate ephys QC
 """
+import concurrent.futures
+import functools
+import hashlib
 import logging
+import traceback
+from pathlib import Path
 
 import numpy as np
 
 from alf.io import is_uuid_string
+from ibllib.io import hashfile
+from ibllib.misc import version
+from ibllib.qc import bpodqc_metrics
+from ibllib.qc.bpodqc_extractors import BpodQCExtractor
 from ibllib.qc.bpodqc_metrics import BpodQC
 from ibllib.qc.oneqc_metrics import ONEQC
-from oneibl.one import ONE
+from oneibl.one import ONE, connection_params, one_from_params
 
 log = logging.getLogger("ibllib")
 
@@ -121,12 +133,53 @@ class ExtendedQC(object):
             self.compute_all_qc()
             self.build_extended_qc_frame()
 
-    def compute_all_qc(self):
+    def compute_all_qc(self, cache_dir=None, clobber=False):
+        """
+        :param cache_dir: (optional) if set, the extracted Bpod data and the Bpod metric frames
+         are cached in this folder and re-used as long as the ibllib version, the raw data and the
+         metrics code are unchanged
+        :param clobber: (False) if True, ignores the cached files and overwrites them
+        """
+        if cache_dir is not None:
+            return self._compute_all_qc_cached(cache_dir, clobber=clobber)
         self.bpodqc = BpodQC(self.eid, one=self.one, lazy=False)
         self.oneqc = ONEQC(
             self.eid, one=self.one, bpod_ntrials=self.bpodqc.bpod_ntrials, lazy=False
         )
 
+    def _compute_all_qc_cached(self, cache_dir, clobber=False):
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        files = _cache_files(cache_dir, self.eid)
+        self.bpodqc = BpodQC(self.eid, one=self.one, lazy=True)
+        fingerprint = _raw_fingerprint(self.bpodqc.session_path)
+        # the Bpod metric frames are re-used if neither the raw data nor the metrics code changed
+        frames = None if clobber else _load_cache(files['frames'], fingerprint)
+        if frames is not None and frames.pop('code') == _metrics_code_digest():
+            self.bpodqc.bpod_ntrials = frames.pop('ntrials')
+            self.bpodqc.metrics = {k[8:]: v for k, v in frames.items() if k.startswith('metrics.')}
+            self.bpodqc.passed = {k[7:]: v for k, v in frames.items() if k.startswith('passed.')}
+        else:
+            # otherwise the extracted data is re-used if the raw data didn't change
+            inputs = None if clobber else _load_cache(files['inputs'], fingerprint, load=False)
+            if inputs is not None:
+                extractor, _ = BpodQCExtractor.load(inputs, session_path=self.bpodqc.session_path)
+            else:
+                if fingerprint is None:
+                    self.bpodqc._ensure_required_data()
+                    fingerprint = _raw_fingerprint(self.bpodqc.session_path)
+                extractor = BpodQCExtractor(self.bpodqc.session_path)
+                extractor.save(files['inputs'], fingerprint=fingerprint)
+            self.bpodqc.load_data(extractor=extractor)
+            self.bpodqc.compute()
+            frames = {'fingerprint': fingerprint, 'code': _metrics_code_digest(),
+                      'ntrials': self.bpodqc.bpod_ntrials}
+            frames.update({f'metrics.{k}': v for k, v in self.bpodqc.metrics.items()})
+            frames.update({f'passed.{k}': v for k, v in self.bpodqc.passed.items()})
+            _save_npz(files['frames'], frames)
+        # the ONE QC depends on the Alyx datasets, not on the raw data: it is never cached
+        self.oneqc = ONEQC(self.eid, one=self.one, bpod_ntrials=self.bpodqc.bpod_ntrials,
+                           lazy=False)
+
     def build_extended_qc_frame(self):
         if self.bpodqc is None:
             self.compute_all_qc()
@@ -163,3 +216,101 @@ class ExtendedQC(object):
 
     def compute_session_status(self, crit):
         return compute_session_status(self.frame)
+
+
+def _cache_files(cache_dir, eid):
+    """The cache files of a session are keyed by session and ibllib version"""
+    prefix = f'{eid}_{version.ibllib()}'
+    return {k: Path(cache_dir).joinpath(f'{prefix}.{k}.npz') for k in ('inputs', 'frames')}
+
+
+def _raw_fingerprint(session_path):
+    """
+    Hash of the raw behaviour files of a session, used to invalidate the cached QC.
+    :return: md5 hexdigest, None if there is no raw data locally
+    """
+    if session_path is None:
+        return
+    files = sorted(Path(session_path).joinpath('raw_behavior_data').glob('_iblrig_*.raw.*'))
+    if len(files) == 0:
+        return
+    md5s = hashfile.md5_files(files)
+    return hashlib.md5(''.join(f.name + h for f, h in zip(files, md5s)).encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _metrics_code_digest():
+    """Hash of the QC metrics source code: a change of criterion invalidates the cached frames"""
+    return hashlib.md5(Path(bpodqc_metrics.__file__).read_bytes()).hexdigest()
+
+
+def _save_npz(file, arrays):
+    file_tmp = Path(file).with_name(Path(file).name + '.part')
+    with open(file_tmp, 'wb') as fid:
+        np.savez(fid, **{k: np.array(v) for k, v in arrays.items()})
+    file_tmp.replace(file)
+
+
+def _load_cache(file, fingerprint, load=True):
+    """
+    Checks a cache file against the raw data fingerprint. If the raw data isn't available
+    locally the cache file is considered valid.
+    :param load: if True returns a dictionary of the cached values, otherwise the file name
+    :return: None if the cache file doesn't exist, is corrupt or out of date
+    """
+    if not Path(file).exists():
+        return
+    try:
+        with np.load(file, allow_pickle=True) as npz:
+            if fingerprint is not None and str(npz['fingerprint']) != fingerprint:
+                return
+            if not load:
+                return file
+            return {k: npz[k] if npz[k].ndim else npz[k].item() for k in npz.files}
+    except Exception as e:
+        log.warning(f'Corrupt QC cache file {file}, re-computing: {e}')
+
+
+def _batch_qc_session(eid, one=None, one_params=None, cache_dir=None, clobber=False,
+                      update=False):
+    """Runs the extended QC of a single session, returns the frame, None if it errored"""
+    try:
+        one = one or one_from_params(one_params)
+        eqc = ExtendedQC(eid=eid, one=one, lazy=True)
+        eqc.compute_all_qc(cache_dir=cache_dir, clobber=clobber)
+        eqc.build_extended_qc_frame()
+        if update:
+            eqc.update_extended_qc()
+        return eqc.frame
+    except Exception:
+        log.error(f'Extended QC failed for session {eid}\n{traceback.format_exc()}')
+
+
+def run_batch_qc(eids, one=None, cache_dir=None, n_workers=1, clobber=False, update=False):
+    """
+    Computes the extended QC of many sessions in a process pool. The extracted Bpod data and the
+    Bpod metric frames are cached on disk per session and ibllib version, so that a re-run only
+    downloads, extracts and computes the sessions whose raw data or metrics code changed. The
+    ONE QC reflects the current Alyx datasets and is always re-computed.
+    :param eids: list of session uuids
+    :param one: ONE instance, the worker processes connect with the same parameters
+    :param cache_dir: (optional) cache folder, defaults to the ONE cache dir + '/qc_cache'
+    :param n_workers: number of worker processes, if 1 the sessions are run in this process
+    :param clobber: (False) if True, the cached files are overwritten
+    :param update: (False) if True, the extended_qc field of the Alyx sessions is updated
+    :return: dictionary {eid: extended qc frame}, the frame is None if the QC errored
+    """
+    one = one or ONE()
+    cache_dir = Path(cache_dir or Path(one._par.CACHE_DIR).joinpath('qc_cache'))
+    kwargs = dict(cache_dir=cache_dir, clobber=clobber, update=update)
+    if n_workers == 1:
+        return {eid: _batch_qc_session(eid, one=one, **kwargs) for eid in eids}
+    one_params = connection_params(one)
+    frames = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_batch_qc_session, eid, one_params=one_params, **kwargs): eid
+                   for eid in eids}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            frames[futures[future]] = future.result()
+            log.info(f'Extended QC {i + 1}/{len(futures)}: {futures[future]}')
+    return {eid: frames[eid] for eid in eids}
@@ -1,7 +1,10 @@
 import abc
 import concurrent.futures
+import functools
 import logging
 import os
+import threading
+from datetime import datetime, timedelta
 from pathlib import Path, PurePath
 
 import requests
@@ -22,6 +25,7 @@ from brainbox.core import ismember, ismember2d
 _logger = logging.getLogger('ibllib')
 
 NTHREADS = 4  # number of download threads
+CACHE_TTL = timedelta(hours=24)  # cache first mode: sessions cached since are not queried again
 
 _ENDPOINTS = {  # keynames are possible input arguments and values are actual endpoints
     'data': 'dataset-types',
@@ -110,7 +114,7 @@ def _ses2pandas(ses, dtypes=None):
     uuid_fields = ['id', 'eid']
     join = {'subject': ses['subject'], 'lab': ses['lab'], 'eid': ses['url'][-36:],
             'start_time': np.datetime64(ses['start_time']), 'number': ses['number'],
-            'task_protocol': ses['task_protocol']}
+            'task_protocol': ses['task_protocol'], 'date_cached': np.datetime64(datetime.now())}
     col = parquet.rec2col(rec, include=include, uuid_fields=uuid_fields, join=join,
                           types={'file_size': np.double}).to_df()
     return col
@@ -127,11 +131,18 @@ class OneAbstract(abc.ABC):
         self._par = self._par.set('CACHE_DIR', cache_dir or self._par.CACHE_DIR)
         # init the cache file
         self._cache_file = Path(self._par.CACHE_DIR).joinpath('.one_cache.parquet')
+        self._cache_lock = threading.RLock()  # sessions may be resolved from several threads
         if self._cache_file.exists():
             # we need to keep this part fast enough for transient objects
             self._cache = parquet.load(self._cache_file)
+            # caches written by previous versions don't know when datasets were cached
+            if self._cache.size > 0 and 'date_cached' not in self._cache:
+                self._cache['date_cached'] = np.datetime64('NaT', 'ns')
         else:
             self._cache = pd.DataFrame()
+        # md5 of the local files, indexed on their size, modification time and inode
+        self._hash_index = hashfile.HashIndex(
+            Path(self._par.CACHE_DIR).joinpath('.one_hash_index.parquet'))
 
     def _load(self, eid, dataset_types=None, dclass_output=False, download_only=False,
               offline=False, **kwargs):
@@ -152,6 +163,13 @@ class OneAbstract(abc.ABC):
             dc = self._make_dataclass_offline(eid_str, dataset_types, **kwargs)
         else:
             dc = self._make_dataclass(eid_str, dataset_types, **kwargs)
+        return self._format_output(dc, eid_str, dataset_types, dclass_output, download_only)
+
+    @staticmethod
+    def _format_output(dc, eid_str, dataset_types, dclass_output=False, download_only=False):
+        """
+        Loads the files content of a session dataclass and formats the output of `load`
+        """
         # load the files content in variables if requested
         if not download_only:
             for ind, fil in enumerate(dc.local_path):
@@ -217,6 +235,28 @@ def ONE(offline=False, **kwargs):
         return OneAlyx(**kwargs)
 
 
+def connection_params(one):
+    """
+    Hashable connection parameters of a ONE instance, to instantiate the same ONE in another
+    process with `one_from_params`
+    :param one: ONE instance
+    :return: tuple of (keyword, value) pairs
+    """
+    return tuple({'base_url': one._par.ALYX_URL, 'username': one._par.ALYX_LOGIN,
+                  'password': one._par.ALYX_PWD, 'cache_dir': one._par.CACHE_DIR}.items())
+
+
+@functools.lru_cache(maxsize=None)
+def one_from_params(params):
+    """
+    ONE instance from the parameters output by `connection_params`. The instance is cached so
+    that each worker process connects to Alyx once
+    :param params: tuple of (keyword, value) pairs
+    :return: ONE instance
+    """
+    return ONE(**dict(params), silent=True)
+
+
 class OneOffline(OneAbstract):
 
     def _make_dataclass(self, *args, **kwargs):
@@ -233,9 +273,18 @@ class OneOffline(OneAbstract):
 
 
 class OneAlyx(OneAbstract):
-    def __init__(self, **kwargs):
+    def __init__(self, cache_first=False, cache_ttl=CACHE_TTL, **kwargs):
+        """
+        :param cache_first: [False] if True, sessions datasets are resolved from the local
+         parquet cache, the database is only queried if a dataset is missing from the cache or
+         from the disk, or if the session was cached more than `cache_ttl` ago
+        :param cache_ttl: [timedelta(hours=24)] time after which a session cache is stale. If
+         None, the cache never expires
+        """
         # get parameters override if inputs provided
         super(OneAlyx, self).__init__(**kwargs)
+        self._cache_first = cache_first
+        self._cache_ttl = cache_ttl
         try:
             self._alyxClient = wc.AlyxClient(username=self._par.ALYX_LOGIN,
                                              password=self._par.ALYX_PWD,
@@ -412,26 +461,148 @@ class OneAlyx(OneAbstract):
         From a Session ID and dataset types, queries Alyx database, downloads the data
         from Globus, and loads into numpy array. Supports multiple sessions
         """
-        if isinstance(eid, str):
-            return self._load(eid, **kwargs)
-        if isinstance(eid, list):
-            # dataclass output requested
-            if kwargs.get('dclass_output', False):
-                for i, e in enumerate(eid):
-                    if i == 0:
-                        out = self._load(e, **kwargs)
+        # the md5 index is saved once at the end of the load rather than after each file
+        with self._hash_index.batch():
+            if isinstance(eid, str):
+                return self._load(eid, **kwargs)
+            if isinstance(eid, list):
+                # the sessions are loaded concurrently, and re-ordered as per the input list
+                outs = [None for _ in eid]
+                for i, out in self._iter_sessions(eid, **kwargs):
+                    outs[i] = out
+                # dataclass output requested
+                if kwargs.get('dclass_output', False):
+                    for i, o in enumerate(outs):
+                        if i == 0:
+                            out = o
+                        else:
+                            out.append(o)
+                else:  # list output requested
+                    out = [o[0] for o in outs]
+                return out
+
+    def load_sessions(self, eids, dataset_types=None, dclass_output=False, dry_run=False,
+                      cache_dir=None, download_only=False, clobber=False, offline=False,
+                      keep_uuid=False, n_workers=NTHREADS):
+        """
+        Loads several sessions. The session records are resolved concurrently and the files of
+        all sessions are downloaded through a single bounded thread pool. Sessions are yielded as
+        soon as their files are downloaded, so that processing a session overlaps with the
+        downloads of the next ones.
+
+        for eid, (spike_times,) in one.load_sessions(eids, dataset_types=['spikes.times']):
+            ...
+
+        :param eids: list of Experiment IDs
+        :type eids: list
+        :param n_workers: [4] number of threads shared by the queries and the downloads
+        :type n_workers: int
+        All other parameters are the ones of `load` for a single session.
+
+        :return: generator of (eid, output) tuples in completion order, the output being the one
+         of `load` for a single session
+        :rtype: generator
+        """
+        eids = [e[-36:] for e in eids]
+        with self._hash_index.batch():
+            for i, out in self._iter_sessions(
+                    eids, dataset_types=dataset_types, dclass_output=dclass_output,
+                    dry_run=dry_run, cache_dir=cache_dir, download_only=download_only,
+                    clobber=clobber, offline=offline, keep_uuid=keep_uuid, n_workers=n_workers):
+                yield eids[i], out
+
+    def _iter_sessions(self, eids, dataset_types=None, dclass_output=False, dry_run=False,
+                       cache_dir=None, download_only=False, clobber=False, offline=False,
+                       keep_uuid=False, n_workers=NTHREADS):
+        """
+        Generator yielding (index of the session in eids, output) in completion order
+        """
+        eids = [e[-36:] for e in eids]
+        dataset_types = [dataset_types] if isinstance(dataset_types, str) else dataset_types
+        if not dataset_types or dataset_types == ['__all__']:
+            dclass_output = True
+        cache_dir = self._get_cache_dir(cache_dir)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+        pending = {}  # future: (session index, dataset index or None for the session query)
+        dcs, ndownloads = ({}, {})
+        try:
+            for i, eid in enumerate(eids):
+                if offline:
+                    future = executor.submit(self._make_dataclass_offline, eid, dataset_types,
+                                             cache_dir=cache_dir)
+                else:
+                    future = executor.submit(self._resolve_session, eid, dataset_types,
+                                             cache_dir=cache_dir, dry_run=dry_run,
+                                             clobber=clobber, keep_uuid=keep_uuid)
+                pending[future] = (i, None)
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i, ind = pending.pop(future)
+                    if ind is None:
+                        # the session is resolved: queue its downloads
+                        dcs[i] = future.result()
+                        downloads = {} if offline else self._submit_downloads(
+                            executor, dcs[i], dry_run=dry_run, cache_dir=cache_dir,
+                            clobber=clobber, keep_uuid=keep_uuid)
+                        pending.update({f: (i, ind) for ind, f in downloads.items()})
+                        ndownloads[i] = len(downloads)
                     else:
-                        out.append(self._load(e, **kwargs))
-            else:  # list output requested
-                out = []
-                for e in eid:
-                    out.append(self._load(e, **kwargs)[0])
-            return out
+                        dcs[i].local_path[ind] = future.result()
+                        ndownloads[i] -= 1
+                    if ndownloads[i] == 0:
+                        ndownloads.pop(i)
+                        yield i, self._format_output(dcs.pop(i), eids[i], dataset_types,
+                                                     dclass_output, download_only)
+        finally:
+            # if the generator is not exhausted, do not start the remaining downloads
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
 
     def _make_dataclass(self, eid, dataset_types=None, cache_dir=None, dry_run=False,
                         clobber=False, offline=False, keep_uuid=False):
         # if the input as an UUID, add the beginning of URL to it
         cache_dir = self._get_cache_dir(cache_dir)
+        dc = self._resolve_session(eid, dataset_types=dataset_types, cache_dir=cache_dir,
+                                   dry_run=dry_run, clobber=clobber, keep_uuid=keep_uuid)
+        # loop over each dataset and download if necessary
+        with concurrent.futures.ThreadPoolExecutor(max_workers=NTHREADS) as executor:
+            futures = self._submit_downloads(executor, dc, dry_run=dry_run, cache_dir=cache_dir,
+                                             clobber=clobber, offline=offline,
+                                             keep_uuid=keep_uuid)
+            concurrent.futures.wait(list(futures.values()))
+            for ind, future in futures.items():
+                dc.local_path[ind] = future.result()
+        return dc
+
+    def _submit_downloads(self, executor, dc, dry_run=False, **kwargs):
+        """
+        Submits the downloads of the datasets of a session dataclass to an executor
+
+        :return: dictionary dataset index: future returning the local path
+        """
+        futures = {}
+        for ind in range(len(dc)):
+            if dc.url[ind] is None or dry_run:
+                continue
+            futures[ind] = executor.submit(
+                self.download_dataset, dc.url[ind], file_size=dc.file_size[ind],
+                hash=dc.hash[ind], **kwargs)
+        return futures
+
+    def _resolve_session(self, eid, dataset_types=None, cache_dir=None, dry_run=False,
+                         clobber=False, keep_uuid=False):
+        """
+        Gets the dataclass of the session datasets, from the cache in cache first mode or from
+        the database. Nothing is downloaded.
+        """
+        if self._cache_first and not clobber and not keep_uuid:
+            dc = self._make_dataclass_cache(eid, dataset_types=dataset_types,
+                                            cache_dir=cache_dir, dry_run=dry_run)
+            if dc is not None:
+                return dc
         # get session json information as a dictionary from the alyx API
         try:
             ses = self.alyx.rest('sessions', 'read', id=eid)
@@ -439,26 +610,58 @@ class OneAlyx(OneAbstract):
             raise requests.HTTPError('Session ' + eid + ' does not exist')
         # filter by dataset types
         dc = SessionDataInfo.from_session_details(ses, dataset_types=dataset_types, eid=eid)
-        # loop over each dataset and download if necessary
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NTHREADS) as executor:
-            futures = []
-            for ind in range(len(dc)):
-                if dc.url[ind] is None or dry_run:
-                    futures.append(None)
-                else:
-                    futures.append(executor.submit(
-                        self.download_dataset, dc.url[ind], cache_dir=cache_dir, clobber=clobber,
-                        offline=offline, keep_uuid=keep_uuid, file_size=dc.file_size[ind],
-                        hash=dc.hash[ind]))
-            concurrent.futures.wait(list(filter(lambda x: x is not None, futures)))
-            for ind, future in enumerate(futures):
-                if future is None:
-                    continue
-                dc.local_path[ind] = future.result()
-        # filter by daataset types and update the cache
-        self._update_cache(ses, dataset_types=dataset_types)
+        # update the cache with all the session datasets so that it can answer later queries
+        with self._cache_lock:
+            self._update_cache(ses)
         return dc
 
+    def _make_dataclass_cache(self, eid, dataset_types=None, cache_dir=None, dry_run=False):
+        """
+        Resolves the session datasets from the parquet cache. Returns None on a cache miss:
+        session not cached or stale, dataset type not found, file not on disk or not matching
+        the cached size and hash.
+        """
+        npeid = parquet.str2np(eid)[0]
+        with self._cache_lock:
+            if self._cache.size == 0:
+                return
+            df = self._cache[np.logical_and(self._cache['eid_0'].to_numpy() == npeid[0],
+                                            self._cache['eid_1'].to_numpy() == npeid[1])]
+        if df.size == 0 or not np.all(self._is_cache_fresh(df['date_cached'])):
+            return
+        # same dataset selection as SessionDataInfo.from_datasets
+        if not dataset_types:
+            collections = df['collection'].fillna('').apply(lambda c: Path(c).parts)
+            df = df[collections.apply(lambda p: 'alf' in p and 'raw_ephys_data' not in p)]
+        elif dataset_types != ['__all__']:
+            if not np.all(np.isin(dataset_types, df['dataset_type'])):
+                return
+            df = df[ismember(df['dataset_type'], dataset_types)[0]]
+        dc = SessionDataInfo.from_pandas(df, cache_dir)
+        if dry_run:
+            # as for a database query, nothing is downloaded nor loaded on a dry run
+            dc.local_path = [None for _ in dc.local_path]
+            return dc
+        for local_path, file_size, hash in zip(dc.local_path, dc.file_size, dc.hash):
+            if not local_path.exists():
+                return
+            if file_size > 0 and local_path.stat().st_size != file_size:
+                return
+            if hash and self._hash_index.md5(local_path) != hash:
+                return
+        self._hash_index.save()
+        return dc
+
+    def _is_cache_fresh(self, dates):
+        """
+        :param dates: dates at which datasets were cached
+        :return: bool array, True if the cache is younger than the TTL
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        if self._cache_ttl is None:
+            return ~np.isnat(dates)
+        return dates > np.datetime64(datetime.now() - self._cache_ttl)
+
     def _ls(self, table=None, verbose=False):
         """
         Queries the database for a list of 'users' and/or 'dataset-types' and/or 'subjects' fields
@@ -599,7 +802,8 @@ class OneAlyx(OneAbstract):
         :return: local file path
         """
         out_files = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NTHREADS) as executor:
+        with self._hash_index.batch(), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=NTHREADS) as executor:
             futures = [executor.submit(self.download_dataset, dset, file_size=dset['file_size'],
                                        hash=dset['hash'], **kwargs) for dset in dsets]
             concurrent.futures.wait(futures)
@@ -651,33 +855,49 @@ class OneAlyx(OneAbstract):
         """
         Path(target_dir).mkdir(parents=True, exist_ok=True)
         local_path = str(target_dir) + os.sep + os.path.basename(url)
+        # the files of an interrupted download are resumed unless a fresh download is required
+        discard = clobber
         if not keep_uuid:
             local_path = remove_uuid_file(local_path, dry=True)
         if Path(local_path).exists() and not offline:
             # the local file hash doesn't match the dataset table cached hash
-            hash_mismatch = hash and hashfile.md5(Path(local_path)) != hash
+            hash_mismatch = hash and self._hash_index.md5(local_path) != hash
             file_size_mismatch = file_size and Path(local_path).stat().st_size != file_size
             if hash_mismatch or file_size_mismatch:
-                clobber = True
+                clobber = discard = True
                 _logger.warning(f" local md5 or size mismatch, re-downloading {local_path}")
         # if there is no cached file, download
         else:
             clobber = True
         if clobber:
-            local_path, md5 = wc.http_download_file(
-                url, username=self._par.HTTP_DATA_SERVER_LOGIN,
-                password=self._par.HTTP_DATA_SERVER_PWD, cache_dir=str(target_dir),
-                clobber=clobber, offline=offline, return_md5=True)
+            resumed = not discard and len(wc.partial_files(
+                Path(target_dir).joinpath(os.path.basename(url)))) > 0
+
+            def download(discard):
+                local_path, md5 = wc.http_download_file(
+                    url, username=self._par.HTTP_DATA_SERVER_LOGIN,
+                    password=self._par.HTTP_DATA_SERVER_PWD, cache_dir=str(target_dir),
+                    clobber=discard, offline=offline, return_md5=True)
+                hash_mismatch = hash and md5 != hash
+                file_size_mismatch = file_size and Path(local_path).stat().st_size != file_size
+                return local_path, md5, hash_mismatch or file_size_mismatch
+
+            local_path, md5, mismatch = download(discard)
+            if mismatch and resumed:
+                _logger.warning(f"md5 or size mismatch of the resumed download {url}, "
+                                f"downloading from scratch")
+                local_path, md5, mismatch = download(True)
             # post download, if there is a mismatch between Alyx and the newly downloaded file size
             # or hash flag the offending file record in Alyx for database maintenance
-            hash_mismatch = hash and md5 != hash
-            file_size_mismatch = file_size and Path(local_path).stat().st_size != file_size
-            if hash_mismatch or file_size_mismatch:
+            if mismatch:
                 self._tag_mismatched_file_record(url)
-        if keep_uuid:
-            return local_path
-        else:
-            return remove_uuid_file(local_path)
+        if not keep_uuid:
+            local_path = remove_uuid_file(local_path)
+        if clobber:
+            # the md5 has been computed while downloading, no need to read the file again
+            self._hash_index.set(local_path, md5)
+        self._hash_index.save()
+        return local_path
 
     @staticmethod
     def search_terms():
@@ -807,10 +1027,10 @@ class OneAlyx(OneAbstract):
         out.update({'local_path': self.path_from_eid(eid)})
         return out
 
-    def _update_cache(self, ses, dataset_types):
+    def _update_cache(self, ses, dataset_types=None):
         """
         :param ses: session details dictionary as per Alyx response
-        :param dataset_types:
+        :param dataset_types: [None] defaults to all the datasets with a file url
         :return: is_updated (bool): if the cache was updated or not
         """
         save = False
@@ -833,11 +1053,14 @@ class OneAlyx(OneAbstract):
                              pqt_dsets['file_size'].iloc[isin].to_numpy(),
                              rtol=0, atol=0, equal_nan=True)
             eq = np.logical_and(heq, feq)
-            # update new hash / filesizes
-            if not np.all(eq):
-                self._cache.iloc[icache].loc[:, ['file_size', 'hash']] =\
-                    pqt_dsets.iloc[np.where(isin)[0]].loc[:, ['file_size', 'hash']]
+            # the cache only needs to be written if stale, the in memory dates are always updated
+            if not np.all(eq) or not np.all(self._is_cache_fresh(
+                    self._cache['date_cached'].iloc[icache])):
                 save = True
+            # update new hash / filesizes
+            for k in ['file_size', 'hash', 'date_cached']:
+                self._cache.iloc[icache, self._cache.columns.get_loc(k)] = \
+                    pqt_dsets[k].to_numpy()[isin]
             # append datasets that haven't been found
             if not np.all(isin):
                 self._cache = self._cache.append(pqt_dsets.iloc[np.where(~isin)[0]])
@@ -1,4 +1,5 @@
 from pathlib import Path
+import concurrent.futures
 import json
 import datetime
 import logging
@@ -38,7 +39,8 @@ def _check_filename_for_registration(full_file, patterns):
 
 
 def register_dataset(file_list, one=None, created_by=None, repository=None, server_only=False,
-                     versions=False, dry=False, max_md5_size=None):
+                     versions=False, dry=False, max_md5_size=None, hashes=None,
+                     n_workers=hashfile.HASH_N_WORKERS):
     """
     Registers a set of files belonging to a session only on the server
     :param file_list: (list of pathlib.Path or pathlib.Path)
@@ -51,6 +53,8 @@ def register_dataset(file_list, one=None, created_by=None, repository=None, serv
     :param verbose: (bool) logs
     :param max_md5_size: (int) maximum file in bytes to compute md5 sum (always compute if Npne)
     defaults to None
+    :param hashes: optional (list of strings): md5 hashes already computed for the file list
+    :param n_workers: [4] number of files hashed concurrently
     :return:
     """
     if created_by is None:
@@ -68,11 +72,10 @@ def register_dataset(file_list, one=None, created_by=None, repository=None, serv
 
     # computing the md5 can be very long, so this is an option to skip if the file is bigger
     # than a certain threshold
-    if max_md5_size:
-        hashes = [hashfile.md5(p) if
-                  p.stat().st_size < max_md5_size else None for p in file_list]
+    if hashes is None:
+        hashes = hashfile.md5_files(file_list, n_workers=n_workers, max_size=max_md5_size)
     else:
-        hashes = [hashfile.md5(p) for p in file_list]
+        assert isinstance(hashes, list) and len(hashes) == len(file_list)
 
     session_path = alf.io.get_session_path(file_list[0])
     # first register the file
@@ -105,14 +108,96 @@ def register_session_raw_data(session_path, one=None, overwrite=False, dry=False
     :return: list of file to register
     :return: Alyx response: dictionary of registered files
     """
+    dtypes = one.alyx.rest('dataset-types', 'list')
+    registration_patterns = [dt['filename_pattern'] for dt in dtypes if dt['filename_pattern']]
+    files_2_register = _raw_files_to_register(session_path, one, registration_patterns,
+                                              overwrite=overwrite)
+    response = register_dataset(files_2_register, one=one, versions=None, dry=dry, **kwargs)
+    return files_2_register, response
+
+
+def register_sessions_raw_data(session_paths, one=None, overwrite=False, dry=False,
+                               max_md5_size=None, n_workers=hashfile.HASH_N_WORKERS, **kwargs):
+    """
+    Registers the raw data files of several sessions to Alyx. The dataset types are queried
+    once, the files of all sessions are hashed concurrently in a single pool, then each session
+    is registered with a single `register-file` request.
+    :param session_paths: list of session paths
+    :param one: one instance to work with
+    :param overwrite: (False) if set to True, will patch the datasets. It will take very long.
+    If set to False (default) will skip all already registered data.
+    :param dry: do not register files, returns the list of files to be registered
+    :param max_md5_size: (int) maximum file in bytes to compute md5 sum (always compute if None)
+    :param n_workers: [4] number of files hashed concurrently
+    :param kwargs: directly passed to the register_dataset function
+    :return: list of (list of files to register, Alyx response) tuples, one per session
+    """
+    out = []
+    for _, files, response, error in iter_register_sessions_raw_data(
+            session_paths, one=one, overwrite=overwrite, dry=dry, max_md5_size=max_md5_size,
+            n_workers=n_workers, **kwargs):
+        if error is not None:
+            raise error
+        out.append((files, response))
+    return out
+
+
+def iter_register_sessions_raw_data(session_paths, one=None, overwrite=False, dry=False,
+                                    max_md5_size=None, n_workers=hashfile.HASH_N_WORKERS,
+                                    **kwargs):
+    """
+    Generator version of `register_sessions_raw_data`: the files of all sessions are submitted
+    to a single hashing pool and each session is registered and yielded as soon as its files are
+    hashed. An error on a session is caught and yielded, it doesn't stop the other sessions.
+    for session_path, files, response, error in iter_register_sessions_raw_data(paths, one=one):
+        ...
+    :return: generator of (session path, list of files, Alyx response, exception or None)
+    """
+    def _md5(file_path):
+        if max_md5_size and Path(file_path).stat().st_size >= max_md5_size:
+            return
+        return hashfile.md5(file_path)
+
+    dtypes = one.alyx.rest('dataset-types', 'list')
+    registration_patterns = [dt['filename_pattern'] for dt in dtypes if dt['filename_pattern']]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        pending = []
+        for session_path in session_paths:
+            try:
+                files = _raw_files_to_register(
+                    session_path, one, registration_patterns, overwrite=overwrite)
+            except Exception as e:
+                pending.append((session_path, [], e))
+                continue
+            pending.append((session_path, files, [executor.submit(_md5, f) for f in files]))
+        for session_path, files, futures in pending:
+            if isinstance(futures, Exception):
+                yield session_path, files, None, futures
+                continue
+            try:
+                hashes = [future.result() for future in futures]
+                response = register_dataset(files, one=one, versions=None, dry=dry,
+                                            hashes=hashes, **kwargs)
+            except Exception as e:
+                # the remaining hashes of a failed session aren't needed anymore
+                for future in futures:
+                    future.cancel()
+                yield session_path, files, None, e
+                continue
+            yield session_path, files, response, None
+
+
+def _raw_files_to_register(session_path, one, registration_patterns, overwrite=False):
+    """
+    Lists the raw data files of a session matching a dataset type, leaving out the already
+    registered datasets unless overwrite is True
+    """
     session_path = Path(session_path)
     eid = one.eid_from_path(session_path, use_cache=False)  # needs to make sure we're up to date
-    # query the database for existing datasets on the session and allowed dataset types
+    # query the database for existing datasets on the session
     dsets = one.alyx.rest('datasets', 'list', session=eid)
     already_registered = [
         session_path.joinpath(Path(ds['collection'] or '').joinpath(ds['name'])) for ds in dsets]
-    dtypes = one.alyx.rest('dataset-types', 'list')
-    registration_patterns = [dt['filename_pattern'] for dt in dtypes if dt['filename_pattern']]
     # glob all the files
     glob_patterns = [pat for pat in REGISTRATION_GLOB_PATTERNS if pat.startswith('raw')]
     files_2_register = []
@@ -125,8 +210,7 @@ def register_session_raw_data(session_path, one=None, overwrite=False, dry=False
     # filter 2/2 unless overwrite is True, filter out the datasets that already exists
     if not overwrite:
         files_2_register = list(filter(lambda f: f not in already_registered, files_2_register))
-    response = register_dataset(files_2_register, one=one, versions=None, dry=dry, **kwargs)
-    return files_2_register, response
+    return files_2_register
 
 
 class RegistrationClient:
@@ -290,7 +374,7 @@ class RegistrationClient:
         # register all files that match the Alyx patterns, warn user when files are encountered
         rename_files_compatibility(ses_path, md['IBLRIG_VERSION_TAG'])
         F = []  # empty list whose keys will be relative paths and content filenames
-        md5s = []
+        files = []
         file_sizes = []
         for fn in _glob_session(ses_path):
             if fn.suffix in EXCLUDED_EXTENSIONS:
@@ -316,8 +400,9 @@ class RegistrationClient:
             rel_path = Path(str(fn)[str(fn).find(str(gen_rel_path)):])
             F.append(str(rel_path.relative_to(gen_rel_path)))
             file_sizes.append(fn.stat().st_size)
-            md5s.append(hashfile.md5(fn) if fn.stat().st_size < 1024 ** 3 else None)
+            files.append(fn)
             _logger.info('Registering ' + str(fn))
+        md5s = hashfile.md5_files(files, max_size=1024 ** 3)
 
         r_ = {'created_by': username,
               'path': str(gen_rel_path),
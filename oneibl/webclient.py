@@ -1,14 +1,16 @@
+import concurrent.futures
 import json
 import logging
 import math
 import os
 import re
-import urllib.request
+import threading
 from collections.abc import Mapping
 from pathlib import Path
 import hashlib
 
 import requests
+import requests.adapters
 
 from alf.io import is_uuid_string
 from ibllib.misc import pprint, print_progress
@@ -53,28 +55,198 @@ class _PaginatedResponse(Mapping):
             yield self.__getitem__(i)
 
 
-def http_download_file_list(links_to_file_list, **kwargs):
+DOWNLOAD_CHUNK_BYTES = 2 ** 22  # size of the blocks streamed to disk
+DOWNLOAD_N_WORKERS = 4  # number of files downloaded concurrently by http_download_file_list
+DOWNLOAD_N_SEGMENTS = 4  # number of byte ranges downloaded in parallel for large files
+DOWNLOAD_SEGMENT_MIN_BYTES = 2 ** 27  # files smaller than this are downloaded in one stream
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_PRINT_LOCK = threading.Lock()  # the progress bars of concurrent downloads don't interleave
+
+
+def _http_session(username='', password=''):
+    """
+    Returns a requests session shared by all downloads using the same credentials, so that
+    the connections to the file server are pooled and re-used across files and threads.
+
+    :param username: authentication for password protected file server.
+    :param password: authentication for password protected file server.
+    :return: requests.Session
+    """
+    with _SESSIONS_LOCK:
+        if (username, password) not in _SESSIONS:
+            session = requests.Session()
+            pool_size = DOWNLOAD_N_WORKERS * DOWNLOAD_N_SEGMENTS
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                    pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if username and password:
+                session.auth = (username, password)
+            # byte ranges and sizes refer to the file on disk, not to a compressed stream
+            session.headers['Accept-Encoding'] = 'identity'
+            _SESSIONS[(username, password)] = session
+        return _SESSIONS[(username, password)]
+
+
+def partial_files(file_name):
+    """
+    Files left by an interrupted download of `file_name`: the `.part` file, the `.partN`
+    segment files and the `.part.validator` file holding the ETag or Last-Modified header of
+    the server copy that was partly downloaded.
+
+    :param file_name: full path of the downloaded file
+    :return: list of pathlib.Path
+    """
+    part_file = Path(str(file_name) + '.part')
+    pattern = re.compile(re.escape(part_file.name) + r'(\d+|\.validator)?')
+    return [f for f in part_file.parent.glob(part_file.name + '*') if pattern.fullmatch(f.name)]
+
+
+def _http_download_stream(session, url, part_file, file_size=None, return_md5=False,
+                          progress=True, validator=None):
+    """
+    Streams a file into a partial file, resuming from the bytes already on disk with a HTTP
+    Range request. The range is conditional on the server copy being unchanged (If-Range), if
+    the server returns the full file instead, the download starts over.
+
+    :param session: requests session
+    :param url: http link to the file
+    :param part_file: pathlib.Path of the partial file
+    :param file_size: expected file size in bytes, if known
+    :param return_md5: if True, computes the md5 of the full file while downloading
+    :param progress: prints a progress bar if True and the file size is known
+    :param validator: ETag or Last-Modified header of the server copy
+    :return: md5 hexdigest or None
+    """
+    offset = part_file.stat().st_size if part_file.exists() else 0
+    if file_size is not None and offset > file_size:
+        offset = 0
+    elif offset and offset == file_size:
+        return _md5_file(part_file) if return_md5 else None
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    if offset and validator:
+        headers['If-Range'] = validator
+    with session.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0
+        md5 = hashlib.md5()
+        if return_md5 and offset:
+            md5 = _md5_file(part_file, hexdigest=False)
+        file_size_dl = offset
+        with open(part_file, 'ab' if offset else 'wb') as f:
+            for buffer in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                file_size_dl += len(buffer)
+                f.write(buffer)
+                if return_md5:
+                    md5.update(buffer)
+                if progress and file_size:
+                    with _PRINT_LOCK:
+                        print_progress(file_size_dl, file_size, prefix='', suffix='')
+    return md5.hexdigest() if return_md5 else None
+
+
+def _http_download_segment(session, url, segment_file, first, last, validator=None):
+    """
+    Downloads the bytes [first, last] of a file into a segment file, resuming from the bytes
+    already on disk. Raises a HTTPError if the range is not honoured, which is the case if
+    the server copy changed since `validator` was read.
+    """
+    first += segment_file.stat().st_size if segment_file.exists() else 0
+    if first > last:
+        return
+    headers = {'Range': f'bytes={first}-{last}'}
+    if validator:
+        headers['If-Range'] = validator
+    with session.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise requests.HTTPError(f"Range request not honoured {url}", response=r)
+        with open(segment_file, 'ab') as f:
+            for buffer in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                f.write(buffer)
+
+
+def _http_download_segments(session, url, part_file, file_size, n_segments,
+                            return_md5=False, validator=None):
+    """
+    Downloads a file as parallel byte ranges, each segment is written in its own partial
+    file so that it can be resumed independently. The segments are then concatenated into
+    the partial file.
+
+    :return: md5 hexdigest or None
+    """
+    edges = [file_size * i // n_segments for i in range(n_segments + 1)]
+    segment_files = [part_file.with_name(f"{part_file.name}{i}") for i in range(n_segments)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_segments) as executor:
+        futures = [executor.submit(_http_download_segment, session, url, sf, first, last - 1,
+                                   validator=validator)
+                   for sf, first, last in zip(segment_files, edges[:-1], edges[1:])]
+        for future in futures:
+            future.result()
+    md5 = hashlib.md5()
+    with open(part_file, 'wb') as f:
+        for sf in segment_files:
+            with open(sf, 'rb') as fs:
+                while True:
+                    buffer = fs.read(DOWNLOAD_CHUNK_BYTES)
+                    if not buffer:
+                        break
+                    f.write(buffer)
+                    if return_md5:
+                        md5.update(buffer)
+    for sf in segment_files:
+        sf.unlink()
+    return md5.hexdigest() if return_md5 else None
+
+
+def _md5_file(file_path, hexdigest=True):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        while True:
+            buffer = f.read(DOWNLOAD_CHUNK_BYTES)
+            if not buffer:
+                break
+            md5.update(buffer)
+    return md5.hexdigest() if hexdigest else md5
+
+
+def http_download_file_list(links_to_file_list, n_workers=DOWNLOAD_N_WORKERS, **kwargs):
     """
     Downloads a list of files from the flat Iron from a list of links.
     Same options behaviour as http_download_file
 
     :param links_to_file_list: list of http links to files.
     :type links_to_file_list: list
+    :param n_workers: [4] maximum number of files downloaded concurrently, the progress bars
+     are only printed if 1.
+    :type n_workers: int
 
     :return: (list) a list of the local full path of the downloaded files.
     """
-    file_names_list = []
-    for link_str in links_to_file_list:
-        file_names_list.append(http_download_file(link_str, **kwargs))
+    kwargs.setdefault('progress', n_workers <= 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        file_names_list = list(executor.map(lambda link: http_download_file(link, **kwargs),
+                                            links_to_file_list))
     return file_names_list
 
 
 def http_download_file(full_link_to_file, *, clobber=False, offline=False,
-                       username='', password='', cache_dir='', return_md5=False):
+                       username='', password='', cache_dir='', return_md5=False,
+                       n_segments=DOWNLOAD_N_SEGMENTS,
+                       segment_min_bytes=DOWNLOAD_SEGMENT_MIN_BYTES, progress=True):
     """
+    The file is written into a `.part` file renamed once complete, so an interrupted download
+    never leaves a truncated file behind and is resumed with a HTTP Range request on the next
+    call. Large files are downloaded as parallel byte ranges if the server accepts ranges.
+    A partial download is only resumed if the ETag (or Last-Modified) header of the server
+    copy is the one stored when it started, otherwise it starts over.
+
     :param full_link_to_file: http link to the file.
     :type full_link_to_file: str
-    :param clobber: [False] If True, force overwrite the existing file.
+    :param clobber: [False] If True, force overwrite the existing file and discard the files of
+     an interrupted download.
     :type clobber: bool
     :param username: [''] authentication for password protected file server.
     :type username: str
@@ -83,6 +255,12 @@ def http_download_file(full_link_to_file, *, clobber=False, offline=False,
     :param cache_dir: [''] directory in which files are cached; defaults to user's
      Download directory.
     :type cache_dir: str
+    :param n_segments: [4] number of byte ranges downloaded in parallel for large files.
+    :type n_segments: int
+    :param segment_min_bytes: [2 ** 27] files smaller than this are downloaded in one stream.
+    :type segment_min_bytes: int
+    :param progress: [True] prints a progress bar for single stream downloads.
+    :type progress: bool
 
     :return: (str) a list of the local full path of the downloaded files.
     """
@@ -103,48 +281,54 @@ def http_download_file(full_link_to_file, *, clobber=False, offline=False,
     elif offline:
         return (file_name, hashfile.md5(file_name)) if return_md5 else file_name
 
-    # This should be the base url you wanted to access.
-    baseurl = os.path.split(str(full_link_to_file))[0]
-
-    # Create a password manager
-    manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-    if (len(password) != 0) & (len(username) != 0):
-        manager.add_password(None, baseurl, username, password)
-
-    # Create an authentication handler using the password manager
-    auth = urllib.request.HTTPBasicAuthHandler(manager)
-
-    # Create an opener that will replace the default urlopen method on further calls
-    opener = urllib.request.build_opener(auth)
-    urllib.request.install_opener(opener)
-
-    # Open the url and get the length
+    session = _http_session(username, password)
+    # get the file length and whether the server accepts byte ranges
     try:
-        u = urllib.request.urlopen(full_link_to_file)
-    except urllib.error.HTTPError as e:
+        r = session.head(full_link_to_file, allow_redirects=True)
+        r.raise_for_status()
+    except requests.HTTPError as e:
         _logger.error(f"{str(e)} {full_link_to_file}")
         raise e
-
-    file_size = int(u.getheader('Content-length'))
+    file_size = r.headers.get('Content-Length')
+    file_size = int(file_size) if file_size is not None else None
+    accept_ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
 
     print(f"Downloading: {file_name} Bytes: {file_size}")
-    file_size_dl = 0
-    block_sz = 8192 * 64 * 8
-
-    md5 = hashlib.md5()
-    f = open(file_name, 'wb')
-    while True:
-        buffer = u.read(block_sz)
-        if not buffer:
-            break
-        file_size_dl += len(buffer)
-        f.write(buffer)
-        if return_md5:
-            md5.update(buffer)
-        print_progress(file_size_dl, file_size, prefix='', suffix='')
-    f.close()
-
-    return (file_name, md5.hexdigest()) if return_md5 else file_name
+    part_file = Path(file_name + '.part')
+    # a partial download is only resumed if the server copy is the one partly downloaded
+    validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+    validator_file = part_file.with_name(part_file.name + '.validator')
+    if clobber or validator is None or not validator_file.exists() or \
+            validator_file.read_text() != validator:
+        for f in partial_files(file_name):
+            f.unlink()
+        if validator:
+            validator_file.write_text(validator)
+    segmented = accept_ranges and n_segments > 1 and file_size and file_size >= segment_min_bytes
+    if segmented:
+        try:
+            md5 = _http_download_segments(session, full_link_to_file, part_file, file_size,
+                                          n_segments, return_md5=return_md5, validator=validator)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 200:
+                raise e
+            # the server copy changed since the HEAD request, start over in a single stream
+            _logger.warning(f"{full_link_to_file} changed on the server, restarting download")
+            for f in partial_files(file_name):
+                f.unlink()
+            segmented, validator = (False, None)
+    if not segmented:
+        md5 = _http_download_stream(session, full_link_to_file, part_file, file_size,
+                                    return_md5=return_md5, progress=progress, validator=validator)
+    # the partial file is kept for a later resume if the transfer was cut short
+    if file_size is not None and part_file.stat().st_size != file_size:
+        raise IOError(f"Incomplete download {full_link_to_file}: "
+                      f"{part_file.stat().st_size}/{file_size} bytes")
+    os.replace(part_file, file_name)
+    if validator_file.exists():
+        validator_file.unlink()
+
+    return (file_name, md5) if return_md5 else file_name
 
 
 def file_record_to_url(file_records, urls=[]):
@@ -2,6 +2,7 @@ import unittest
 import tempfile
 from pathlib import Path
 import shutil
+import os
 
 import alf.files
 
@@ -83,6 +84,24 @@ class TestsAlfPartsFilters(unittest.TestCase):
         with self.assertRaises(TypeError):
             alf.files.filter_by(self.tmpdir, unknown=None)
 
+    def test_folder_index(self):
+        for f in ['noalf.file', 'spikes.times.npy']:
+            self.tmpdir.joinpath(f).touch()
+        # a recently modified folder is listed but not indexed
+        names, alf_files, _ = alf.files.folder_index(self.tmpdir)
+        self.assertEqual(alf_files, ['spikes.times.npy'])
+        self.assertEqual(set(names), {'noalf.file', 'spikes.times.npy'})
+        self.assertFalse(str(self.tmpdir.absolute()) in alf.files._FOLDER_INDEX)
+        # an older folder is indexed
+        os.utime(self.tmpdir, (1e9, 1e9))
+        alf.files.folder_index(self.tmpdir)
+        self.assertTrue(str(self.tmpdir.absolute()) in alf.files._FOLDER_INDEX)
+        self.assertEqual(alf.files.filter_by(self.tmpdir)[0], ['spikes.times.npy'])
+        # any change of the folder modification time invalidates the index
+        self.tmpdir.joinpath('spikes.clusters.npy').touch()
+        self.assertEqual(set(alf.files.filter_by(self.tmpdir)[0]),
+                         {'spikes.times.npy', 'spikes.clusters.npy'})
+
     def tearDown(self) -> None:
         shutil.rmtree(self.tmpdir)
 
@@ -4,6 +4,8 @@ from pathlib import Path
 import shutil
 import json
 import uuid
+import os
+from unittest import mock
 
 import numpy as np
 
@@ -204,6 +206,14 @@ class TestsAlf(unittest.TestCase):
             obj = alf.io.load_object(self.tmpdir)
         self.assertTrue('object name should be provided too' in str(context.exception))
 
+    def test_load_object_lazy(self):
+        obj = alf.io.load_object(self.tmpdir, 'neuveu', lazy=True)
+        self.assertTrue(set(obj.keys()) == {'riri', 'fifi', 'loulou'})
+        self.assertTrue(all([isinstance(obj[o], np.memmap) for o in obj]))
+        self.assertTrue(np.all(obj.riri == np.load(self.object_files[0])))
+        with self.assertRaises(ValueError):
+            obj.riri[0] = 0  # read-only
+
     def test_save_npy(self):
         # test with straight vectors
         a = {'riri': np.random.rand(100),
@@ -230,6 +240,63 @@ class TestsAlf(unittest.TestCase):
             alf.io.save_object_npy(self.tmpdir, a, 'neuveux')
         self.assertTrue('Dimensions are not consistent' in str(context.exception))
 
+    def test_consolidated(self):
+        with tempfile.TemporaryDirectory() as td:
+            td = Path(td)
+            spikes = {'times': np.random.rand(50), 'clusters': np.random.randint(0, 5, 50),
+                      'waveforms': np.asfortranarray(np.random.rand(50, 3, 2))}
+            alf.io.save_object_npy(td, spikes, 'spikes')
+            np.save(td / 'other.empty.npy', np.array([]))
+            np.save(td / 'spikes.timestamps.npy', np.arange(50))
+            alf.io.save_metadata(td / 'spikes.waveforms.npy', {'unit': 'V'})
+            td.joinpath('clusters.metrics.tsv').write_text('a\tb\n1\t2\n')
+            alf.io.save_consolidated(td)
+            cfile = alf.io.ConsolidatedFile(td / alf.io.CONSOLIDATED_FILE)
+            self.assertEqual(set(cfile.files), {
+                'spikes.times.npy', 'spikes.clusters.npy', 'spikes.waveforms.npy',
+                'other.empty.npy', 'spikes.timestamps.npy', 'spikes.waveforms.metadata.json',
+                'clusters.metrics.tsv'})
+            self.assertEqual(cfile.load('clusters.metrics.tsv').to_dict('list'),
+                             {'a': [1], 'b': [2]})
+            self.assertEqual(cfile.load('other.empty.npy').shape, (0,))
+            # the object is read from the consolidated file, with or without copy
+            with mock.patch('alf.io.load_file_content', side_effect=alf.io.load_file_content) \
+                    as lfc:
+                for lazy in (False, True):
+                    out = alf.io.load_object(td, 'spikes', lazy=lazy)
+                    for k in spikes:
+                        self.assertTrue(np.all(out[k] == spikes[k]))
+                    self.assertTrue(out.waveforms.flags.f_contiguous)
+                    self.assertEqual(out.waveformsmetadata, {'unit': 'V'})
+                    self.assertEqual(out.times.flags.writeable, not lazy)
+                t, d = alf.io.read_ts(td / 'spikes.times.npy')
+                self.assertTrue(np.all(t == np.arange(50)) and np.all(d == spikes['times']))
+                lfc.assert_not_called()
+                # a modified file is read from disk
+                np.save(td / 'spikes.times.npy', spikes['times'] * 2)
+                os.utime(td / 'spikes.times.npy', ns=(1, 1))
+                out = alf.io.load_object(td, 'spikes')
+                self.assertTrue(np.all(out.times == spikes['times'] * 2))
+                self.assertTrue(td.joinpath('spikes.times.npy') in
+                                [c[0][0] for c in lfc.call_args_list])
+
+    def test_consolidated_cache(self):
+        # the cache of consolidated readers is bounded, each reader keeps a file descriptor
+        with tempfile.TemporaryDirectory() as td, \
+                mock.patch('alf.io.CONSOLIDATED_CACHE_SIZE', 3), \
+                mock.patch('alf.io._CONSOLIDATED_CACHE', alf.io._CONSOLIDATED_CACHE.__class__()):
+            folders = [Path(td).joinpath(f'alf{i}') for i in range(5)]
+            for i, folder in enumerate(folders):
+                folder.mkdir()
+                alf.io.save_object_npy(folder, {'times': np.arange(10) + i}, 'spikes')
+                alf.io.save_consolidated(folder)
+            for i, folder in enumerate(folders):
+                self.assertEqual(alf.io.load_object(folder, 'spikes').times[0], i)
+            # the least recently used folders are evicted
+            alf.io.load_object(folders[2], 'spikes')
+            self.assertEqual([Path(k).parent.name for k in alf.io._CONSOLIDATED_CACHE],
+                             ['alf3', 'alf4', 'alf2'])
+
     def test_check_dimensions(self):
         a = {'a': np.ones([10, 10]), 'b': np.ones([10, 2]), 'c': np.ones([10])}
         status = alf.io.check_dimensions(a)
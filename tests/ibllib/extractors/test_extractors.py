@@ -2,6 +2,7 @@ import logging
 import unittest
 import functools
 import shutil
+import tempfile
 from pathlib import Path
 
 import numpy as np
@@ -492,6 +493,79 @@ class TestExtractTrialData(unittest.TestCase):
         out, files = extractors.biased_trials.extract_all(
             self.biased_ge5['path'], save=True)
 
+    def test_bpod_session(self):
+        # the raw data is loaded once and shared by all the extractors of the session
+        from unittest import mock
+        from ibllib.io.extractors.base import BpodSession, run_extractor_classes
+        tt = extractors.training_trials
+        classes = [tt.FeedbackType, tt.Choice, tt.FeedbackTimes, tt.StimOnTimes,
+                   tt.StimOnOffFreezeTimes, tt.GoCueTimes, tt.ResponseTimes]
+        with mock.patch('ibllib.io.raw_data_loaders.load_data', wraps=raw.load_data) as ld, \
+                mock.patch('ibllib.io.raw_data_loaders.load_settings',
+                           wraps=raw.load_settings) as ls:
+            out, _ = run_extractor_classes(
+                classes, session_path=self.training_ge5['path'], save=False)
+        self.assertEqual((ld.call_count, ls.call_count), (1, 1))
+        # same outputs as the extractors run on their own
+        for k, v in out.items():
+            if k in ('feedback_times', 'choice', 'goCue_times'):
+                cls = next(c for c in classes if c.var_names == k)
+                np.testing.assert_array_equal(cls(self.training_ge5['path']).extract()[0], v)
+        # per trial state arrays
+        session = BpodSession(self.training_ge5['path'])
+        bpod_trials = session.bpod_trials
+        stim_on = session.states('stim_on')
+        self.assertEqual(stim_on.shape, (self.training_ge5['ntrials'], 2))
+        np.testing.assert_array_equal(
+            stim_on[:, 0], [t['behavior_data']['States timestamps']['stim_on'][0][0]
+                            for t in bpod_trials])
+        self.assertIs(session.states('stim_on'), stim_on)
+        # regression against the trial times extracted before the shared session
+        nan = np.nan
+        expected = {
+            'training_lt5': {
+                'stimOn_times': [55.049, nan, nan, 1496.0036],
+                'goCue_times': [nan, nan, nan, nan],
+                'feedback_times': [55.3579, 700.0702, 1335.779398, 1556.0446]},
+            'biased_ge5': {
+                'stimOn_times': [nan, 4.5505, 10.8554, 14.7498, 17.6878, 20.4994, 84.2283,
+                                 87.2948],
+                'goCue_times': [1.5231, 4.5514, 10.8563, 14.7505, 17.6885, 20.5001, 84.2292,
+                                87.2955],
+                'feedback_times': [2.041, 7.33, 11.2419, 15.1113, 18.017, 80.5009, 84.6842,
+                                   87.9635]}}
+        for sess, times in expected.items():
+            out, _ = run_extractor_classes([tt.StimOnTimes, tt.GoCueTimes, tt.FeedbackTimes],
+                                           session_path=getattr(self, sess)['path'], save=False)
+            for k, v in times.items():
+                np.testing.assert_allclose(out[k], v, rtol=0, atol=1e-9)
+
+    def test_bpod_trials_table(self):
+        for sess in (self.training_lt5, self.biased_ge5):
+            bpod_trials = raw.load_data(sess['path'])
+            table = raw.BpodTrialsTable(bpod_trials)
+            self.assertEqual(table.ntrials, sess['ntrials'])
+            # streaming the file and converting the times at once gives the same table
+            table_ = raw.load_trials_table(sess['path'])
+            for k in ('trial', 'code', 'start', 'stop', 'trial_start', 'trial_end'):
+                np.testing.assert_array_equal(getattr(table, k), getattr(table_, k))
+            # first state occurrences
+            expected = [t['behavior_data']['States timestamps']['closed_loop'][0]
+                        for t in bpod_trials]
+            np.testing.assert_array_equal(table.first_state('closed_loop'), expected)
+            self.assertTrue(np.all(np.isnan(table.first_state('not_a_state'))))
+            # events of all trials and per trial
+            bnc1, trial = table.port_events('BNC1')
+            for i, t in enumerate(table.split(bnc1, trial)):
+                self.assertEqual(list(t), raw.get_port_events(bpod_trials[i], 'BNC1'))
+            expected = [t['behavior_data']['Events timestamps'].get('BNC2High', [np.nan])[0]
+                        for t in bpod_trials]
+            np.testing.assert_array_equal(table.first_event('BNC2High'), expected)
+            # filtered events
+            table = raw.BpodTrialsTable(bpod_trials, events=('BNC1',))
+            self.assertEqual(table.events('BNC2High')[0].size, 0)
+            np.testing.assert_array_equal(table.port_events('BNC1')[0], bnc1)
+
     def test_encoder_positions_clock_reset(self):
         # TRAINING SESSIONS
         # only for training?
@@ -635,6 +709,48 @@ class TestWheelLoaders(unittest.TestCase):
             dy = raw._load_encoder_positions_file_lt5(file_position)
             self.assertTrue(dy.size > 18)
 
+    def test_encoder_cache(self):
+        files = [('ge5', '_iblrig_encoderPositions.raw.ssv', raw._load_encoder_positions_file_ge5),
+                 ('ge5', '_iblrig_encoderEvents.raw.ssv', raw._load_encoder_events_file_ge5),
+                 ('lt5', '_iblrig_encoderPositions.raw.00.ssv',
+                  raw._load_encoder_positions_file_lt5),
+                 ('lt5', '_iblrig_encoderEvents.raw.CorruptMiddle.ssv',
+                  raw._load_encoder_events_file_lt5)]
+        with tempfile.TemporaryDirectory() as td:
+            for folder, name, loader in files:
+                file_ssv = Path(shutil.copy(self.main_path.joinpath('data', 'wheel', folder, name),
+                                            td))
+                df = loader(file_ssv)
+                self.assertFalse(file_ssv.with_name(name + '.npy').exists())
+                # the first load writes the binary sidecar, the second one reads it
+                for _ in range(2):
+                    df_ = loader(file_ssv, cache=True)
+                    self.assertTrue(file_ssv.with_name(name + '.npy').exists())
+                    self.assertTrue(df.equals(df_))
+            # a file without any valid line raises an error
+            file_ssv = Path(td).joinpath('_iblrig_encoderPositions.raw.ssv')
+            file_ssv.write_text('garbage\n')
+            with self.assertRaises(ValueError):
+                raw._load_encoder_positions_file_ge5(file_ssv)
+
+    def test_encoder_ssv_parser(self):
+        # extra fields are ignored, blank lines skipped, incomplete and non-numeric lines dropped
+        lines = ['1000 1 2020-01-01T10:00:00.0000000+01:00',
+                 '2000 2 2020-01-01T10:00:01.0000000+01:00 extra fields',
+                 '',
+                 '3000',
+                 '4000 abc 2020-01-01T10:00:02.0000000+01:00',
+                 '5000 5 2020-01-01T10:00:03.0000000+01:00',
+                 '5000 5 2020-01-01T10:00:03.0000000+01:00']
+        with tempfile.TemporaryDirectory() as td:
+            file_ssv = Path(td).joinpath('_iblrig_encoderPositions.raw.ssv')
+            file_ssv.write_text('\n'.join(lines) + '\n')
+            df = raw._load_encoder_positions_file_ge5(file_ssv)
+        # the index column is the row number in the file without blank lines, as pandas does
+        self.assertEqual(list(df.columns), ['index', 're_ts', 're_pos'])
+        self.assertEqual(df['index'].tolist(), [0, 1, 4])
+        self.assertEqual(df['re_pos'].tolist(), [1, 2, 5])
+
 
 if __name__ == "__main__":
     unittest.main(exit=False)
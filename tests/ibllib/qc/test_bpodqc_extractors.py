@@ -1,10 +1,14 @@
 # Mock dataset
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
 
 import numpy as np
 
 import ibllib.io.raw_data_loaders as raw
 from ibllib.qc.bpodqc_extractors import BpodQCExtractor, extract_bpod_trial_data
+from ibllib.qc.bpodqc_metrics import BpodQC
 from oneibl.one import ONE
 
 one = ONE(
@@ -97,5 +101,41 @@ class TestBpodQCExtractors(unittest.TestCase):
         self.assertTrue(np.all(bla == bla[0]))
 
 
+class TestBpodQCExtractorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.session_path = Path(self.td.name).joinpath('subject', '2020-01-01', '001')
+        shutil.copytree(Path(__file__).parents[1].joinpath(
+            'extractors', 'data', 'session_training_ge5', 'raw_behavior_data'),
+            self.session_path.joinpath('raw_behavior_data'))
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def test_save_load(self):
+        extractor = BpodQCExtractor(self.session_path)
+        file = self.session_path.joinpath('inputs.npz')
+        extractor.save(file, fingerprint='abc')
+        cached, extras = BpodQCExtractor.load(file)
+        self.assertEqual(extras, {'fingerprint': 'abc'})
+        self.assertIsNone(cached.raw_data)
+        self.assertEqual(cached.ntrials, len(extractor.raw_data))
+        self.assertEqual(cached.details, extractor.details)
+        for name in ('trial_data', 'wheel_data', 'BNC1', 'BNC2'):
+            for k, v in getattr(extractor, name).items():
+                np.testing.assert_array_equal(getattr(cached, name)[k], v)
+        # the QC computed from the cached data is the same
+        qcs = [BpodQC(self.session_path, one=one, lazy=True) for _ in range(2)]
+        qcs[0].load_data(extractor=extractor)
+        qcs[1].load_data(extractor=cached)
+        for qc in qcs:
+            qc.compute()
+        self.assertEqual(qcs[0].bpod_ntrials, qcs[1].bpod_ntrials)
+        for k in qcs[0].metrics:
+            np.testing.assert_array_equal(qcs[0].metrics[k], qcs[1].metrics[k])
+            np.testing.assert_array_equal(qcs[0].passed[k], qcs[1].passed[k])
+
+
 if __name__ == "__main__":
     unittest.main(exit=False)
@@ -8,7 +8,7 @@ from ibllib.qc.bpodqc_metrics import BpodQC
 from ibllib.qc import bpodqc_metrics as qcmetrics
 from ibllib.qc.oneutils import download_bpodqc_raw_data
 from oneibl.one import ONE
-from brainbox.behavior.wheel import cm_to_rad
+from brainbox.behavior.wheel import cm_to_rad, traces_by_trial
 
 one = ONE(
     base_url="https://test.alyx.internationalbrainlab.org",
@@ -459,6 +459,30 @@ class TestBpodQCMetrics(unittest.TestCase):
         metric, passed = qcmetrics.load_wheel_integrity(self.wheel, re_encoding='X1')
         self.assertFalse(passed[idx].any())
 
+    def test_wheel_segments(self):
+        # the vectorized wheel traces are the same as the per trial ones
+        ts, pos = self.wheel['re_ts'], self.wheel['re_pos']
+        start, end = self.data['goCueTrigger_times'], self.data['response_times']
+        i0, i1 = qcmetrics._wheel_trace_indices(ts, start, end)
+        pmin = qcmetrics._reduce_segments(np.minimum, pos, i0, i1)
+        pmax = qcmetrics._reduce_segments(np.maximum, pos, i0, i1)
+        for i, (t, p) in enumerate(traces_by_trial(ts, pos, start=start, end=end)):
+            self.assertTrue(np.array_equal(p, pos[i0[i]:i1[i]]))
+            if p.size:
+                self.assertEqual((pmin[i], pmax[i]), (p.min(), p.max()))
+        # an interval with a NaN bound has no sample, as in traces_by_trial
+        start, end = start.copy(), end.copy()
+        end[1] = np.nan
+        start[3] = np.nan
+        i0, i1 = qcmetrics._wheel_trace_indices(ts, start, end)
+        self.assertTrue(i1[1] <= i0[1] and i1[3] <= i0[3])
+        for i, (t, p) in enumerate(traces_by_trial(ts, pos, start=start, end=end)):
+            self.assertTrue(np.array_equal(p, pos[i0[i]:i1[i]]))
+        # without samples the closed loop displacement is 0, not the rest of the session's
+        data = {**self.data, 'response_times': end}
+        metric, _ = qcmetrics.load_wheel_move_during_closed_loop(data, self.wheel, 4)
+        self.assertEqual(metric[1], -cm_to_rad(np.abs(data['position'][1] / 4) * 1e-1))
+
     def test_load_stimulus_move_before_goCue(self):
         no_bnc = qcmetrics.load_stimulus_move_before_goCue(self.data, BNC1=None)
         self.assertTrue(no_bnc is None)
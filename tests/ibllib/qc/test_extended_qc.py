@@ -1,6 +1,13 @@
 # Mock dataset
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
+from unittest import mock
 
+import numpy as np
+
+from ibllib.qc import extended_qc
 from ibllib.qc.extended_qc import compute_session_status
 from ibllib.qc.extended_qc import ExtendedQC
 from oneibl.one import ONE
@@ -56,5 +63,62 @@ class TestExtendedQC(unittest.TestCase):
         assert(out_var_test_status["CRITICAL"] == "test2")
 
 
+class TestExtendedQCCache(unittest.TestCase):
+
+    def test_cache_files(self):
+        with tempfile.TemporaryDirectory() as td:
+            session_path = Path(td).joinpath('subject', '2020-01-01', '001')
+            self.assertIsNone(extended_qc._raw_fingerprint(session_path))
+            raw_file = session_path.joinpath('raw_behavior_data', '_iblrig_taskData.raw.jsonable')
+            raw_file.parent.mkdir(parents=True)
+            raw_file.write_text('{"trial_num": 1}\n')
+            fingerprint = extended_qc._raw_fingerprint(session_path)
+            files = extended_qc._cache_files(td, 'some-eid')
+            self.assertTrue(files['frames'].name.startswith('some-eid_'))
+            frame = {'fingerprint': fingerprint, 'a': np.arange(3), 'b': None, 'c': 2}
+            extended_qc._save_npz(files['frames'], frame)
+            self.assertIsNone(extended_qc._load_cache(files['inputs'], fingerprint))
+            cached = extended_qc._load_cache(files['frames'], fingerprint)
+            self.assertEqual(cached.keys(), frame.keys())
+            np.testing.assert_array_equal(cached['a'], frame['a'])
+            self.assertEqual((cached['b'], cached['c']), (None, 2))
+            # without raw data locally the cache is valid, a change of raw data invalidates it
+            self.assertIsNotNone(extended_qc._load_cache(files['frames'], None))
+            raw_file.write_text('{"trial_num": 2}\n')
+            fingerprint = extended_qc._raw_fingerprint(session_path)
+            self.assertIsNone(extended_qc._load_cache(files['frames'], fingerprint))
+            # a corrupt file is ignored
+            files['frames'].write_bytes(b'corrupt')
+            self.assertIsNone(extended_qc._load_cache(files['frames'], None))
+
+    def test_cached_qc(self):
+        """The Bpod QC is cached, the ONE QC always reflects the current Alyx datasets"""
+        with tempfile.TemporaryDirectory() as td:
+            session_path = Path(td).joinpath('subject', '2020-01-01', '001')
+            shutil.copytree(Path(__file__).parents[1].joinpath(
+                'extractors', 'data', 'session_training_ge5', 'raw_behavior_data'),
+                session_path.joinpath('raw_behavior_data'))
+            one = mock.MagicMock()
+            one.path_from_eid.return_value = session_path
+            one.get_details.return_value = {'n_trials': 12}
+            one.load.return_value = [np.arange(12.)]
+            eid = 'b1c968ad-4874-468d-b2e4-5ffa9b9964e9'
+            frames = []
+            for nan_trials in (0, 3):
+                one.load.return_value[0][:nan_trials] = np.nan
+                with mock.patch('ibllib.qc.extended_qc.BpodQCExtractor',
+                                wraps=extended_qc.BpodQCExtractor) as extractor:
+                    eqc = ExtendedQC(eid=eid, one=one, lazy=True)
+                    eqc.compute_all_qc(cache_dir=Path(td).joinpath('cache'))
+                    eqc.build_extended_qc_frame()
+                frames.append(eqc.frame)
+                # the raw data is extracted on the first run only
+                self.assertEqual(extractor.call_count, int(nan_trials == 0))
+            bpod_keys = [k for k in frames[0] if k.startswith('_bpod_')]
+            self.assertEqual([frames[0][k] for k in bpod_keys], [frames[1][k] for k in bpod_keys])
+            self.assertEqual(frames[0]['_one_stimOn_times_count'], 1)
+            self.assertEqual(frames[1]['_one_stimOn_times_count'], 0.75)
+
+
 if __name__ == "__main__":
     unittest.main(exit=False)
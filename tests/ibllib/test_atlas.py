@@ -31,6 +31,29 @@ class TestBrainRegions(unittest.TestCase):
         self.assertTrue(brs.descendants(ids=688).id.size == 567)
         self.assertTrue(brs.ancestors(ids=688).id.size == 4)
 
+    def test_tree_index(self):
+        brs = regions_from_allen_csv()
+        np.random.seed(0)
+        ids = brs.id[np.random.randint(0, brs.id.size, 1000)]
+        # get works on arrays with repeated ids and preserves the order
+        self.assertTrue(np.all(brs.get(ids).id == ids))
+        with self.assertRaises(ValueError):
+            brs.get([688, 10 ** 9])
+        # is_descendant matches the descendants query
+        isctx = brs.is_descendant(ids, 688)
+        self.assertTrue(np.all(isctx == np.isin(ids, brs.descendants(688).id)))
+        self.assertTrue(brs.is_descendant(688, [688, 1089]))
+        # remapping to a level gives the ancestor at this level, higher regions are unchanged
+        remapped = brs.remap_level(ids, 3)
+        self.assertEqual(remapped.shape, ids.shape)
+        for i, r in zip(ids[:50], remapped[:50]):
+            ancestors = brs.ancestors(i)
+            if np.any(ancestors.level == 3):
+                self.assertEqual(r, ancestors.id[ancestors.level == 3][0])
+            else:
+                self.assertEqual(r, i)
+        self.assertEqual(brs.remap_level(688, 2), 567)
+
 
 class TestCoordinateConversions(unittest.TestCase):
 
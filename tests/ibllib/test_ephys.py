@@ -1,9 +1,12 @@
 # Mock dataset
 import unittest
+from pathlib import Path
+import tempfile
 
 import numpy as np
 
 from ibllib.ephys import ephysqc, neuropixel
+from ibllib.io import spikeglx
 
 
 class TestNeuropixel(unittest.TestCase):
@@ -52,5 +55,44 @@ class TestFpgaTask(unittest.TestCase):
         self.assertTrue(np.all([np.all(qct[k]) for k in qct]))
 
 
+class TestRmsMap(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.TemporaryDirectory()
+        file_meta = Path(__file__).parent.joinpath('fixtures', 'io', 'spikeglx',
+                                                   'sample3B_g0_t0.imec1.lf.meta')
+        self.file_bin = spikeglx._mock_spikeglx_file(
+            Path(self.tdir.name).joinpath('sample3B_g0_t0.imec1.lf.bin'), file_meta,
+            ns=2500 * 40, nc=385, sync_depth=16, random=True)['bin_file']
+
+    def tearDown(self):
+        self.tdir.cleanup()
+
+    def test_rmsmap_parallel(self):
+        ref = ephysqc.rmsmap(self.file_bin)
+        for parallel in ['thread', 'process']:
+            rms = ephysqc.rmsmap(self.file_bin, n_workers=2, max_in_flight=3, parallel=parallel)
+            for k in ref:
+                self.assertTrue(np.array_equal(ref[k], rms[k]))
+
+    def test_rmsmap_checkpoint(self):
+        ref = ephysqc.rmsmap(self.file_bin)
+        # fake a crash after the first 2 windows by saving partial accumulators
+        partial = {k: np.copy(ref[k]) for k in ref}
+        partial['TRMS'][2:] = 0
+        partial['nsamples'][2:] = 0
+        partial['spectral_density'] = np.zeros_like(ref['spectral_density'])
+        sglx = spikeglx.Reader(self.file_bin)
+        for first, last in [(0, 8192), (8192, 16384)]:
+            partial['spectral_density'] += ephysqc._rmsmap_window(sglx, first, last)[2]
+        checkpoint_file = Path(self.tdir.name).joinpath('rmsmap_checkpoint.npz')
+        ephysqc._save_rmsmap_checkpoint(checkpoint_file, partial, 2)
+        rms = ephysqc.rmsmap(self.file_bin, n_workers=2, checkpoint_file=checkpoint_file,
+                             checkpoint_every=1)
+        for k in ref:
+            self.assertTrue(np.array_equal(ref[k], rms[k]))
+        self.assertFalse(checkpoint_file.exists())
+
+
 if __name__ == "__main__":
     unittest.main(exit=False)
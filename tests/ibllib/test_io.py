@@ -1,5 +1,7 @@
 import unittest
 import os
+import hashlib
+import json
 import uuid
 import tempfile
 from pathlib import Path
@@ -8,6 +10,7 @@ import shutil
 import numpy as np
 
 from ibllib.io import params, flags, jsonable, spikeglx, hashfile, misc
+import ibllib.dsp as dsp
 import ibllib.io.raw_data_loaders as raw
 
 
@@ -159,6 +162,134 @@ class TestsJsonable(unittest.TestCase):
         tfile.close()
         os.unlink(tfile.name)
 
+    def testIterateIndex(self):
+        with tempfile.TemporaryDirectory() as td:
+            file = Path(td).joinpath('data.jsonable')
+            data = [{'a': i, 'b': [float(i)] * i, 'c': float('nan') if i == 3 else 'toto'}
+                    for i in range(10)]
+            jsonable.write(file, data)
+            self.assertEqual(len(list(jsonable.iterate(file))), 10)
+            self.assertEqual(jsonable.read(file)[5], data[5])
+            self.assertTrue(np.isnan(jsonable.read(file)[3]['c']))
+            # random access from the lines offsets
+            trials = jsonable.Reader(file)
+            self.assertEqual(len(trials), 10)
+            self.assertEqual(trials[7], data[7])
+            self.assertEqual(trials[-1], data[-1])
+            self.assertEqual(trials[4:6], data[4:6])
+            self.assertEqual(trials.offsets.size, jsonable.index(file).size)
+            # pluggable decoder
+            self.assertEqual(jsonable.read(file, decoder=lambda line: len(line))[0],
+                             len(json.dumps(data[0])) + 1)
+
+
+class TestsHashIndex(unittest.TestCase):
+
+    def test_hash_index(self):
+        with tempfile.TemporaryDirectory() as td:
+            file_path = Path(td).joinpath('toto.npy')
+            np.save(file_path, np.arange(100))
+            hi = hashfile.HashIndex(Path(td).joinpath('.hash_index.parquet'))
+            self.assertEqual(hi.md5(file_path), hashfile.md5(file_path))
+            hi.save()
+            # a new index reads from disk, and doesn't rehash an unchanged file
+            hi = hashfile.HashIndex(Path(td).joinpath('.hash_index.parquet'))
+            self.assertTrue(file_path in hi)
+            hi.set(file_path, 'not_really_an_md5')
+            self.assertEqual(hi.md5(file_path), 'not_really_an_md5')
+            # any change of the file stat invalidates the entry
+            np.save(file_path, np.arange(101))
+            self.assertFalse(file_path in hi)
+            self.assertEqual(hi.md5(file_path), hashfile.md5(file_path))
+            # deleted files are dropped from the persisted index
+            file_path.unlink()
+            hi.save()
+            self.assertEqual(len(hashfile.HashIndex(Path(td).joinpath('.hash_index.parquet'))), 0)
+
+    def test_hash_index_batch(self):
+        with tempfile.TemporaryDirectory() as td:
+            index_file = Path(td).joinpath('.hash_index.parquet')
+            files = [Path(td).joinpath(f'toto{i}.npy') for i in range(3)]
+            hi = hashfile.HashIndex(index_file)
+            # within nested batches, the index is only written on exiting the outermost one
+            with hi.batch():
+                with hi.batch():
+                    for i, f in enumerate(files):
+                        np.save(f, np.arange(100 * i))
+                        hi.md5(f)
+                        hi.save()
+                self.assertFalse(index_file.exists())
+            self.assertEqual(len(hashfile.HashIndex(index_file)), 3)
+            # no temporary file is left behind
+            self.assertEqual(sorted(p.name for p in Path(td).iterdir()),
+                             sorted([index_file.name] + [f.name for f in files]))
+
+    def test_hash_index_merge(self):
+        # two processes sharing the index file don't drop each other entries
+        with tempfile.TemporaryDirectory() as td:
+            index_file = Path(td).joinpath('.hash_index.parquet')
+            files = [Path(td).joinpath(f'toto{i}.npy') for i in range(3)]
+            for i, f in enumerate(files):
+                np.save(f, np.arange(100 * i))
+            hi0, hi1 = (hashfile.HashIndex(index_file), hashfile.HashIndex(index_file))
+            hi0.md5(files[0])
+            hi1.md5(files[1])
+            hi1.set(files[2], 'old_md5')
+            hi0.save()
+            hi1.save()
+            hi0.set(files[2], 'new_md5')
+            hi0.save()
+            hi = hashfile.HashIndex(index_file)
+            self.assertEqual(len(hi), 3)
+            self.assertEqual(hi.get(files[1]), hashfile.md5(files[1]))
+            self.assertEqual(hi.get(files[2]), 'new_md5')
+            # the entry of the most recently modified file wins
+            np.save(files[2], np.arange(5))
+            mtime_ns = files[2].stat().st_mtime_ns + 10 ** 9
+            os.utime(files[2], ns=(mtime_ns, mtime_ns))
+            hi1.md5(files[2])
+            hi1.save()
+            hi0.set(files[2], 'stale_md5')
+            hi0._index[str(files[2].absolute())] = (0, 0, 0, 'stale_md5')
+            hi0.save()
+            self.assertEqual(hashfile.HashIndex(index_file).get(files[2]), hashfile.md5(files[2]))
+
+    def test_md5_files(self):
+        with tempfile.TemporaryDirectory() as td:
+            files = [Path(td).joinpath(f'toto{i}.npy') for i in range(5)]
+            for i, f in enumerate(files):
+                np.save(f, np.arange(100 * i))
+            self.assertEqual(hashfile.md5_files(files, n_workers=3),
+                             [hashfile.md5(f) for f in files])
+            # files above the size threshold are not hashed
+            max_size = files[3].stat().st_size
+            hashes = hashfile.md5_files(files, max_size=max_size)
+            self.assertEqual(hashes[:3], [hashfile.md5(f) for f in files[:3]])
+            self.assertEqual(hashes[3:], [None, None])
+
+    def test_digests(self):
+        with tempfile.TemporaryDirectory() as td:
+            file_path = Path(td).joinpath('toto.bin')
+            data = np.random.bytes(1000)
+            file_path.write_bytes(data)
+            out = hashfile.digests(file_path, algorithms=('md5', 'sha1', 'sha256'),
+                                   chunk_size=300)
+            for alg in ('md5', 'sha1', 'sha256'):
+                self.assertEqual(out[alg], hashlib.new(alg, data).hexdigest())
+            self.assertEqual(out['chunks'], [hashlib.md5(data[i:i + 300]).hexdigest()
+                                             for i in range(0, 1000, 300)])
+            self.assertEqual(hashfile.md5(file_path), out['md5'])
+            self.assertEqual(hashfile.sha1(file_path), out['sha1'])
+            # partial verification only flags the modified and missing chunks
+            self.assertEqual(hashfile.verify_chunks(file_path, out['chunks'], 300), [])
+            file_path.write_bytes(data[:350] + b'x' + data[351:950])
+            self.assertEqual(hashfile.verify_chunks(file_path, out['chunks'], 300), [1, 3])
+            # empty file
+            file_path.write_bytes(b'')
+            out = hashfile.digests(file_path, chunk_size=300)
+            self.assertEqual(out['md5'], hashlib.md5().hexdigest())
+            self.assertEqual(out['chunks'], [])
+
 
 class TestSpikeGLX_glob_ephys(unittest.TestCase):
     """
@@ -268,6 +399,48 @@ class TestsSpikeGLX_compress(unittest.TestCase):
         self.assertTrue(np.all(np.isclose(sr._raw[55] * s2mv, sr[55])))
         self.assertTrue(np.all(np.isclose(sr._raw[5:500] * s2mv, sr[5:500])[:, :-1]))
 
+    def test_read_sync_fronts(self):
+        sl = slice(1000, 12000)
+        ind, fronts = dsp.fronts(self.sr.read_sync(sl), axis=0)
+        ind_, channels_, fronts_ = self.sr.read_sync_fronts(sl)
+        self.assertTrue(np.all(ind[0] == ind_))
+        self.assertTrue(np.all(ind[1] == channels_))
+        self.assertTrue(np.all(fronts == fronts_))
+        # two digital traces are stacked bit-wise
+        tr = self.sr._raw[sl, [10, 384]]
+        ind_, channels_, fronts_ = spikeglx.fronts_sync_digital(tr)
+        ind, fronts = dsp.fronts(np.c_[spikeglx.split_sync(tr[:, 0]),
+                                       spikeglx.split_sync(tr[:, 1])], axis=0)
+        self.assertTrue(np.all(ind[0] == ind_))
+        self.assertTrue(np.all(ind[1] == channels_))
+        self.assertTrue(np.all(fronts == fronts_))
+
+    def test_read_mtscomp_chunks(self):
+        sc = spikeglx.Reader(self.sr.compress_file(), cache_bytes=self.sr.nc * 2 * 30000 * 2)
+        raw, craw = (self.sr._raw, sc._raw)
+        self.assertTrue(isinstance(craw, spikeglx.MtscompReader))
+        self.assertEqual(raw.shape, craw.shape)
+        # slices across chunks, steps, single samples and channels selections
+        for nsel in [slice(0, 10), slice(29990, 30020), slice(100, 70000, 7), slice(None),
+                     slice(-50, None), 5, -1, [4, 30005, 2, 65000], np.array([70000, 10]), []]:
+            for csel in [slice(None), 12, -1, slice(300, 310), [0, 384, 5], []]:
+                # NB: unlike numpy, indices arrays on both dimensions select the outer product
+                np.testing.assert_array_equal(raw[nsel][..., csel], craw[nsel, csel])
+        np.testing.assert_array_equal(raw[31000], craw[31000])
+        with self.assertRaises(IndexError):
+            craw[[raw.shape[0]]]
+        # the cache holds at most 2 chunks and repeated reads don't decompress again
+        self.assertTrue(len(craw.cache) <= 2)
+        craw.read_chunk(0)
+        chunk = craw.read_chunk(0)
+        self.assertTrue(craw.read_chunk(0) is chunk)
+        # reading through the spikeglx methods
+        d0, s0 = self.sr.read(slice(25000, 35000), slice(10, 20))
+        d1, s1 = sc.read(slice(25000, 35000), slice(10, 20))
+        self.assertTrue(np.all(d0 == d1) and np.all(s0 == s1))
+        np.testing.assert_array_equal(self.sr.read_sync_fronts(slice(0, 50000))[0],
+                                      sc.read_sync_fronts(slice(0, 50000))[0])
+
     def test_compress(self):
 
         def compare_data(sr0, sr1):
@@ -376,6 +549,11 @@ class TestsSpikeGLX_Meta(unittest.TestCase):
         self.assertTrue(np.sum(sync) == tglx['sync_depth'])
         for m in np.arange(tglx['sync_depth']):
             self.assertTrue(sync[m + 1, m] == 1)
+        # test the front detection straight from the sync traces
+        ind, fronts = dsp.fronts(sync, axis=0)
+        ind_, channels_, fronts_ = sr.read_sync_fronts(slice(0, tglx['ns']))
+        self.assertTrue(np.all(ind[0] == ind_) and np.all(ind[1] == channels_))
+        self.assertTrue(np.all(fronts == fronts_))
         if sr.type in ['ap', 'lf']:  # exclude nidq from the slicing circus
             # teast reading only one channel
             d, _ = sr.read(slice(None), 10)
@@ -1,10 +1,15 @@
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
+from unittest import mock
+
+import numpy as np
 
 import ibllib.io.raw_data_loaders as rawio
-from ibllib.pipes import misc
+from ibllib.pipes import misc, tasks, local_server
 from oneibl.one import ONE
 
 
@@ -31,6 +36,199 @@ class TestExtractors(unittest.TestCase):
             self.assertEqual(out, to[1])
 
 
+class _ProfiledTask(tasks.Task):
+
+    def _run(self):
+        with self.stage('write'):
+            out_file = self.session_path.joinpath('alf', 'toto.npy')
+            out_file.parent.mkdir(parents=True)
+            np.save(out_file, np.zeros(2 ** 20))
+        return [out_file]
+
+
+class _ThreadTask(tasks.Task):
+    barrier = threading.Barrier(2)
+
+    def _run(self):
+        # both tasks are running while each of them logs
+        self.barrier.wait()
+        tasks._logger.info(f"message from {self.session_path}")
+        self.barrier.wait()
+
+
+class TestTaskProfile(unittest.TestCase):
+
+    def test_task_profile(self):
+        with tempfile.TemporaryDirectory() as td:
+            session_path = Path(td).joinpath('subject', '2020-01-01', '001')
+            task = _ProfiledTask(session_path)
+            self.assertEqual(task.run(), 0)
+            self.assertEqual(task.profile['time_elapsed_secs'], task.time_elapsed_secs)
+            self.assertEqual(list(task.profile['stages'].keys()), ['write'])
+            self.assertTrue(task.profile['cpu_secs'] >= 0)
+            # the profile is part of the task log and saved with the session
+            self.assertIn('Resources:', task.log)
+            df = tasks.profile_report(td, summary=False)
+            self.assertEqual(df['name'].tolist(), ['_ProfiledTask'])
+            self.assertEqual(df['session_path'].tolist(), [str(session_path)])
+            summary = tasks.profile_report(td)
+            self.assertEqual(summary.loc['_ProfiledTask', ('time_elapsed_secs', 'count')], 1)
+            self.assertFalse(task.profile['concurrent'])
+
+    def test_task_profile_threads(self):
+        with tempfile.TemporaryDirectory() as td:
+            task_list = [_ThreadTask(Path(td).joinpath('subject', '2020-01-01', f'00{i}'))
+                         for i in range(2)]
+            threads = [threading.Thread(target=t.run) for t in task_list]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+            for task, other in zip(task_list, task_list[::-1]):
+                self.assertEqual(task.status, 0)
+                # the process-level counters include the other task, the profile is flagged
+                self.assertTrue(task.profile['concurrent'])
+                self.assertIn('thread_cpu_secs', task.profile)
+                # each task log only has its own records
+                self.assertIn(f"message from {task.session_path}", task.log)
+                self.assertNotIn(f"message from {other.session_path}", task.log)
+
+
+class TestJobCreator(unittest.TestCase):
+
+    def test_job_creator_errors(self):
+        """An error on a session leaves its flag, the other sessions are registered"""
+        def create_session(session_path):
+            if session_path.name == '001':
+                raise ValueError('creation failed')
+
+        def register_dataset(files, hashes=None, **kwargs):
+            if files[0].parts[-3] == '002':
+                raise ValueError('registration failed')
+            self.assertEqual(len(hashes), len(files))
+            return [{'name': f.name} for f in files]
+
+        with tempfile.TemporaryDirectory() as td:
+            flags = []
+            for n in range(4):
+                session_path = Path(td).joinpath('subject', '2020-01-01', f'00{n}')
+                raw_file = session_path.joinpath('raw_behavior_data', '_iblrig_taskData.raw.json')
+                raw_file.parent.mkdir(parents=True)
+                raw_file.write_text('{}')
+                flags.append(session_path.joinpath('extract_me.flag'))
+                flags[-1].touch()
+            one = mock.MagicMock()
+            one.alyx.rest.return_value = []
+            with mock.patch('oneibl.registration.RegistrationClient') as rc, \
+                    mock.patch('oneibl.registration._raw_files_to_register',
+                               side_effect=lambda sp, *args, **kwargs: list(
+                                   sp.joinpath('raw_behavior_data').glob('*'))), \
+                    mock.patch('oneibl.registration.register_dataset',
+                               side_effect=register_dataset), \
+                    mock.patch('ibllib.pipes.local_server._create_session_tasks') as cst:
+                rc.return_value.create_session.side_effect = create_session
+                cst.side_effect = lambda sp, *args, **kwargs: 1 / (sp.name != '003')
+                dsets = local_server.job_creator(td, one=one)
+            # 000 ok, 001 creation failed, 002 registration failed, 003 tasks creation failed
+            self.assertEqual([f.exists() for f in flags], [False, True, True, True])
+            self.assertEqual(len(dsets), 2)
+            self.assertEqual(cst.call_count, 2)
+
+
+class _GraphTask(tasks.Task):
+    runs = []  # (task id, start, end) of the runs in this process
+
+    def _run(self):
+        t0 = time.time()
+        try:
+            time.sleep(0.1)
+            if self.taskid.startswith('error'):
+                raise ValueError('task failed')
+        finally:
+            self.runs.append((self.taskid, t0, time.time()))
+        return []
+
+    def register_datasets(self, one=None, **kwargs):
+        return [{'task': self.taskid}]
+
+
+class TestTasksGraph(unittest.TestCase):
+    """Runs a deck of tasks with parents against a mock Alyx"""
+
+    def setUp(self):
+        _GraphTask.runs = []
+        self.td = tempfile.TemporaryDirectory()
+        self.alyx_tasks = {}
+        self.one = mock.MagicMock()
+        self.one.alyx.rest.side_effect = self._rest
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def _rest(self, url, action, id=None, data=None, **kwargs):
+        if url == 'sessions':
+            return [{'subject': 'subject', 'start_time': '2020-01-01T10:00:00', 'number': 1}]
+        if action == 'list':
+            return list(self.alyx_tasks.values())
+        self.alyx_tasks[id].update(data)
+        return dict(self.alyx_tasks[id])
+
+    def _deck(self, *tasks_def):
+        """tasks_def: (id, parents, priority, cpu, ram) tuples"""
+        deck = [{'id': tid, 'name': tid, 'session': 'eid', 'status': 'Waiting',
+                 'executable': f'{__name__}._GraphTask', 'parents': parents,
+                 'priority': priority, 'cpu': cpu, 'ram': ram, 'io_charge': 0}
+                for tid, parents, priority, cpu, ram in tasks_def]
+        self.alyx_tasks.update({td['id']: dict(td) for td in deck})
+        return deck
+
+    def _run(self, deck, **kwargs):
+        kwargs = dict(dict(n_workers=3, parallel='thread', count=10), **kwargs)
+        dsets = local_server.tasks_runner(self.td.name, deck, one=self.one, **kwargs)
+        return sorted(d['task'] for d in dsets)
+
+    def test_resources_and_parents(self):
+        deck = self._deck(('a', [], 30, 2, 1), ('b', [], 40, 1, 3), ('c', [], 20, 1, 3),
+                          ('d', ['a', 'b'], 30, 1, 1), ('error', [], 10, 1, 1),
+                          ('held', ['error'], 30, 1, 1), ('held2', ['held'], 30, 1, 1))
+        self.assertEqual(self._run(deck, max_cpu=2, max_ram=4), ['a', 'b', 'c', 'd'])
+        status = {k: v['status'] for k, v in self.alyx_tasks.items()}
+        self.assertEqual(status, {'a': 'Complete', 'b': 'Complete', 'c': 'Complete',
+                                  'd': 'Complete', 'error': 'Errored', 'held': 'Held',
+                                  'held2': 'Held'})
+        runs = {tid: (t0, t1) for tid, t0, t1 in _GraphTask.runs}
+        # the running tasks never exceed the cpu and ram limits, but some ran concurrently
+        tdicts = {td['id']: td for td in deck}
+        overlaps = []
+        for tid, (t0, _) in runs.items():
+            running = [r for r, (s0, s1) in runs.items() if s0 <= t0 < s1]
+            overlaps.append(len(running))
+            self.assertLessEqual(sum(tdicts[r]['cpu'] for r in running), 2)
+            self.assertLessEqual(sum(tdicts[r]['ram'] for r in running), 4)
+        self.assertGreater(max(overlaps), 1)
+        # a child starts once its parents are finished
+        self.assertGreaterEqual(runs['d'][0], max(runs['a'][1], runs['b'][1]))
+        # b has the highest priority and is started first, a that needs all the cpus waits
+        self.assertGreaterEqual(runs['a'][0], runs['b'][1])
+
+    def test_count_time_out(self):
+        deck = self._deck(*[(f't{i}', [], 30, 1, 1) for i in range(4)])
+        self.assertEqual(self._run(deck, count=2), ['t0', 't1'])
+        self.assertEqual(self.alyx_tasks['t2']['status'], 'Waiting')
+        # with one task at a time, no task is started after the time out
+        deck = self._deck(*[(f'u{i}', [], 30, 1, 1) for i in range(4)])
+        self.assertEqual(self._run(deck, max_cpu=1, time_out=0.05), ['u0'])
+
+    def test_process_pool(self):
+        # the worker processes instantiate their own connection to the mock Alyx
+        deck = self._deck(('a', [], 30, 1, 1), ('b', [], 30, 1, 1), ('c', ['a'], 30, 1, 1),
+                          ('error', [], 30, 1, 1), ('held', ['error'], 30, 1, 1))
+        with mock.patch('ibllib.pipes.local_server.connection_params', return_value=()), \
+                mock.patch('ibllib.pipes.local_server.one_from_params', return_value=self.one):
+            dsets = self._run(deck, parallel='process', n_workers=2)
+        self.assertEqual(dsets, ['a', 'b', 'c'])
+        # the workers updated their own copy of the mock, only Held is set by the main process
+        self.assertEqual(self.alyx_tasks['held']['status'], 'Held')
+
+
 class TestPipesMisc(unittest.TestCase):
     """
     """
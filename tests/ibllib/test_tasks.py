@@ -5,6 +5,7 @@ from collections import OrderedDict
 
 from ibllib.misc import version
 import ibllib.pipes.tasks
+from ibllib.pipes import local_server
 from oneibl.one import ONE
 
 one = ONE(base_url='https://test.alyx.internationalbrainlab.org',
@@ -162,3 +163,14 @@ class TestPipelineAlyx(unittest.TestCase):
         task_deck, dsets = pipeline.rerun_failed()
         check_statuses = [desired_statuses[t['name']] == t['status'] for t in task_deck]
         self.assertTrue(all(check_statuses))
+
+    def test_tasks_runner_parallel(self):
+        pipeline = SomePipeline(self.session_path, one=one)
+        pipeline.create_alyx_tasks()
+        # the tasks are run concurrently, children waiting for their parents
+        tasks = one.alyx.rest('tasks', 'list', session=self.eid, status='Waiting')
+        datasets = local_server.tasks_runner(self.td.name, tasks, one=one, count=len(tasks),
+                                             n_workers=2, parallel='thread')
+        task_deck = one.alyx.rest('tasks', 'list', session=self.eid)
+        self.assertTrue(all([desired_statuses[t['name']] == t['status'] for t in task_deck]))
+        self.assertTrue(set([d['name'] for d in datasets]) == set(desired_datasets))
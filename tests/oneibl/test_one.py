@@ -1,9 +1,11 @@
 import unittest
+from datetime import timedelta
 import numpy as np
 import requests
 from pathlib import Path
 import tempfile
 import shutil
+from unittest import mock
 
 import ibllib.io.hashfile as hashfile
 from alf.io import remove_uuid_file
@@ -23,7 +25,7 @@ class TestOneOffline(unittest.TestCase):
             shutil.copyfile(init_cache_file, cache_dir.joinpath(init_cache_file.name))
 
             # test the constructor
-            self.assertTrue(one._cache.shape[1] == 14)
+            self.assertTrue(one._cache.shape[1] == 15)
 
             # test the load with download false so it returns only file paths
             eid = 'cf264653-2deb-44cb-aa84-89b82507028a'
@@ -115,6 +117,36 @@ class TestLoad(unittest.TestCase):
         self.eid = eids[0]
         self.eid2 = eids[1]
 
+    def test_load_cache_first(self):
+        dtypes = ['channels.site', 'channels.brainLocation']
+        files = one.load(self.eid, dataset_types=dtypes, download_only=True)
+        one_cache = ONE(base_url='https://test.alyx.internationalbrainlab.org',
+                        username='test_user', password='TapetesBloc18', cache_first=True)
+        # the session is cached and the files on disk: no database query
+        with mock.patch.object(one_cache.alyx, 'rest', side_effect=AssertionError):
+            self.assertEqual(one_cache.load(self.eid, dataset_types=dtypes, download_only=True),
+                             files)
+            self.assertTrue('channels.site' in one_cache.list(self.eid))
+        # a missing file falls back on the database and downloads the file
+        files[0].unlink()
+        self.assertEqual(one_cache.load(self.eid, dataset_types=dtypes, download_only=True),
+                         files)
+        # stale cache entries are queried again
+        one_cache._cache_ttl = timedelta(seconds=0)
+        with mock.patch.object(one_cache.alyx, 'rest', side_effect=AssertionError):
+            self.assertRaises(AssertionError, one_cache.load, self.eid, dataset_types=dtypes)
+
+    def test_load_sessions(self):
+        eids = [self.eid, self.eid2]
+        out = dict(one.load_sessions(eids, dataset_types='channels.site'))
+        self.assertEqual(set(out.keys()), set(eids))
+        self.assertTrue(all([len(o[0]) == 748 for o in out.values()]))
+        # the generator can be interrupted
+        sessions = one.load_sessions(eids, dataset_types='channels.site', download_only=True)
+        eid, files = next(sessions)
+        sessions.close()
+        self.assertTrue(eid in eids and files[0].exists())
+
     def test_load_multiple_sessions(self):
         # init stuff to run from cli
         eids = [self.eid, self.eid2]
@@ -0,0 +1,190 @@
+import hashlib
+import http.server
+import re
+import socketserver
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import oneibl.webclient as wc
+from ibllib.io import hashfile
+from oneibl.one import OneAlyx
+
+
+class _RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves in-memory files and honours single byte range requests, conditional on If-Range"""
+    files = {}
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self):
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        first, last = (0, len(data) - 1)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        rng = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if rng and self.headers.get('If-Range', etag) == etag:
+            first = int(rng.group(1))
+            last = int(rng.group(2)) if rng.group(2) else last
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{last}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        return data[first:last + 1]
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+        data = self._send_headers()
+        if data is not None:
+            self.wfile.write(data)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class TestHttpDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(0)
+        _RangeRequestHandler.files = {
+            f'/file{i}.bin': np.random.bytes(1000 + 3 * i) for i in range(6)}
+        cls.server = _ThreadingHTTPServer(('127.0.0.1', 0), _RangeRequestHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        _RangeRequestHandler.requests = []
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def test_download_stream_and_segments(self):
+        data = _RangeRequestHandler.files['/file1.bin']
+        for n_segments in (1, 3):
+            file_name, md5 = wc.http_download_file(
+                self.url + '/file1.bin', cache_dir=self.td.name, clobber=True, return_md5=True,
+                n_segments=n_segments, segment_min_bytes=100)
+            self.assertEqual(Path(file_name).read_bytes(), data)
+            self.assertEqual(md5, hashlib.md5(data).hexdigest())
+            self.assertEqual(list(Path(self.td.name).glob('*.part*')), [])
+        # the 3 segments have been requested as byte ranges
+        self.assertEqual(len(_RangeRequestHandler.requests), 4)
+        self.assertTrue(all(r[1] for r in _RangeRequestHandler.requests[1:]))
+
+    def _etag(self, name):
+        return f'"{hashlib.md5(_RangeRequestHandler.files[name]).hexdigest()}"'
+
+    def test_download_resume(self):
+        data = _RangeRequestHandler.files['/file2.bin']
+        # a download cut short leaves a partial file that is resumed
+        part_file = Path(self.td.name).joinpath('file2.bin.part')
+        part_file.write_bytes(data[:400])
+        validator_file = part_file.with_name('file2.bin.part.validator')
+        validator_file.write_text(self._etag('/file2.bin'))
+        file_name, md5 = wc.http_download_file(
+            self.url + '/file2.bin', cache_dir=self.td.name, return_md5=True)
+        self.assertEqual(_RangeRequestHandler.requests, [('/file2.bin', 'bytes=400-')])
+        self.assertEqual(Path(file_name).read_bytes(), data)
+        self.assertEqual(md5, hashlib.md5(data).hexdigest())
+        self.assertFalse(part_file.exists())
+        self.assertFalse(validator_file.exists())
+        # same for a segment
+        Path(self.td.name).joinpath('file2.bin').unlink()
+        part_file.with_name('file2.bin.part1').write_bytes(data[503:600])
+        validator_file.write_text(self._etag('/file2.bin'))
+        file_name = wc.http_download_file(self.url + '/file2.bin', cache_dir=self.td.name,
+                                          n_segments=2, segment_min_bytes=100)
+        self.assertEqual(Path(file_name).read_bytes(), data)
+        self.assertIn(('/file2.bin', 'bytes=600-1005'), _RangeRequestHandler.requests)
+
+    def test_download_resume_changed(self):
+        data = _RangeRequestHandler.files['/file3.bin']
+        part_file = Path(self.td.name).joinpath('file3.bin.part')
+        # a partial file of another copy of the file, or of unknown origin, is not resumed
+        for validator in ('"another_etag"', None):
+            part_file.write_bytes(b'0' * 400)
+            if validator:
+                part_file.with_name('file3.bin.part.validator').write_text(validator)
+            _RangeRequestHandler.requests = []
+            file_name = wc.http_download_file(self.url + '/file3.bin', cache_dir=self.td.name)
+            self.assertEqual(_RangeRequestHandler.requests, [('/file3.bin', None)])
+            self.assertEqual(Path(file_name).read_bytes(), data)
+            Path(file_name).unlink()
+        # if the file changes between the HEAD and GET requests, the server returns it whole
+        part_file.write_bytes(b'0' * 400)
+        part_file.with_name('file3.bin.part.validator').write_text(self._etag('/file3.bin'))
+        with mock.patch.object(_RangeRequestHandler, 'files',
+                               dict(_RangeRequestHandler.files, **{'/file3.bin': data[::-1]})):
+            with mock.patch.object(wc._http_session('', '').__class__, 'head',
+                                   return_value=mock.MagicMock(headers={
+                                       'Content-Length': str(len(data)),
+                                       'Accept-Ranges': 'bytes',
+                                       'ETag': self._etag('/file3.bin')})):
+                file_name = wc.http_download_file(self.url + '/file3.bin', cache_dir=self.td.name)
+        self.assertEqual(Path(file_name).read_bytes(), data[::-1])
+        Path(file_name).unlink()
+        # clobber discards the partial files
+        part_file.write_bytes(b'0' * 400)
+        part_file.with_name('file3.bin.part1').write_bytes(b'0' * 10)
+        part_file.with_name('file3.bin.part.validator').write_text(self._etag('/file3.bin'))
+        file_name = wc.http_download_file(self.url + '/file3.bin', cache_dir=self.td.name,
+                                          clobber=True)
+        self.assertEqual(Path(file_name).read_bytes(), data)
+        self.assertEqual(wc.partial_files(file_name), [])
+
+    def test_one_download_retry(self):
+        data = _RangeRequestHandler.files['/file4.bin']
+        one = OneAlyx.__new__(OneAlyx)
+        one._par = SimpleNamespace(HTTP_DATA_SERVER_LOGIN='', HTTP_DATA_SERVER_PWD='')
+        one._hash_index = hashfile.HashIndex()
+        one._tag_mismatched_file_record = mock.MagicMock()
+        url = self.url + '/file4.bin'
+        md5 = hashlib.md5(data).hexdigest()
+        # a resumed download with the wrong hash is downloaded again from scratch
+        part_file = Path(self.td.name).joinpath('file4.bin.part')
+        part_file.write_bytes(b'0' * 400)
+        part_file.with_name('file4.bin.part.validator').write_text(self._etag('/file4.bin'))
+        local_path = one._download_file(url, self.td.name, file_size=len(data), hash=md5)
+        self.assertEqual(Path(local_path).read_bytes(), data)
+        self.assertEqual([r[1] for r in _RangeRequestHandler.requests], ['bytes=400-', None])
+        one._tag_mismatched_file_record.assert_not_called()
+        # a fresh download with the wrong hash flags the file record
+        Path(local_path).unlink()
+        one._download_file(url, self.td.name, file_size=len(data), hash='wrong_md5')
+        one._tag_mismatched_file_record.assert_called_once_with(url)
+
+    def test_download_file_list(self):
+        links = [self.url + f'/file{i}.bin' for i in range(6)]
+        file_names = wc.http_download_file_list(links, cache_dir=self.td.name, n_workers=3)
+        self.assertEqual([Path(f).name for f in file_names], [Path(lk).name for lk in links])
+        for f in file_names:
+            self.assertEqual(Path(f).read_bytes(), _RangeRequestHandler.files['/' + Path(f).name])
+
+
+if __name__ == "__main__":
+    unittest.main(exit=False)